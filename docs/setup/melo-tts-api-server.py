@@ -15,18 +15,52 @@ Melo TTS API 服务器
     - 已下载语言资源: python -m unidic download
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Union
+from contextlib import contextmanager
 import uvicorn
+import io
 import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import wave
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 与 Piper 服务共用的指标模块（scripts/tts_metrics.py）、请求合并模块（scripts/tts_singleflight.py）
+# 和合成调度模块（scripts/tts_scheduler.py），部署到其他机器时放在本文件同目录
+# 或用 TTS_SHARED_MODULES_DIR 指定所在目录
+sys.path.insert(0, os.environ.get('TTS_SHARED_MODULES_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+try:
+    import tts_metrics
+except ImportError as e:
+    logger.warning(f"⚠️ 指标模块不可用，/metrics 将返回 503: {e}")
+    tts_metrics = None
+try:
+    from tts_singleflight import SingleFlight
+except ImportError as e:
+    logger.warning(f"⚠️ 请求合并不可用，并发的相同请求会各自合成: {e}")
+    SingleFlight = None
+try:
+    from tts_scheduler import (
+        Cancellation, Cancelled, FairGate, Rejected, PRIORITY_NAMES,
+        make_schedule, parse_deadline_ms, stale_seconds_from_env
+    )
+except ImportError as e:
+    logger.warning(f"⚠️ 合成调度不可用，请求按到达顺序合成，不支持截止时间和取消: {e}")
+    FairGate = None
+
 app = FastAPI(title="Melo TTS API Server")
 
 # 配置 CORS（允许前端跨域请求）
@@ -36,36 +70,167 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Id"],
 )
 
-# 全局变量存储 TTS 模型（延迟加载）
+# 全局变量存储 TTS 模型（启动时在后台加载，请求到来时还没加载完则等待加载）
 _tts_model = None
-_model_lock = None
+_model_lock = threading.Lock()
+
+# 模型加载状态（/health、/readyz 只读这里，不触发加载）
+_loader_state = {"status": "pending", "error": None, "seconds": None}
+_inflight = 0  # 正在合成的请求数
+_inflight_lock = threading.Lock()
+
+
+class _NoMetric:
+    """tts_metrics 不可用时的占位：所有记录操作都是空操作"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def _threadpool_waiting():
+    """等待线程池空位的请求数（只能在事件循环线程中调用）"""
+    import anyio.to_thread
+    return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+
+# 指标（GET /metrics，Prometheus 文本格式）
+# melotts 的 synthesize() 内部不区分文本处理和推理，这里只能整体计时
+if tts_metrics is not None:
+    REQUESTS = tts_metrics.Counter("tts_requests_total", "合成请求数", ("language", "speaker"))
+    INFLIGHT = tts_metrics.Gauge("tts_inflight_requests", "正在处理的合成请求数", function=lambda: _inflight)
+    QUEUE_DEPTH = tts_metrics.Gauge("tts_queue_depth", "等待线程池空位的请求数", function=_threadpool_waiting)
+    INFERENCE_SECONDS = tts_metrics.Histogram("tts_inference_seconds", "合成耗时（含文本处理）", ("language",))
+    REAL_TIME_FACTOR = tts_metrics.Histogram(
+        "tts_real_time_factor", "合成耗时 / 生成的音频时长", ("language",), buckets=tts_metrics.RTF_BUCKETS
+    )
+    REQUEST_SECONDS = tts_metrics.Histogram("tts_request_duration_seconds", "请求总耗时", ("language",))
+    MODEL_LOAD_SECONDS = tts_metrics.Gauge("tts_model_load_seconds", "最近一次加载模型的耗时", ("language",))
+    COALESCED_FOLLOWERS = tts_metrics.Counter(
+        "tts_coalesced_followers_total", "挂到进行中的相同合成上、没有重复合成的请求数"
+    )
+    QUEUE_REJECTED = tts_metrics.Counter(
+        "tts_queue_rejected_total", "合成队列拒绝的请求数（reason: full/preempted/stale/deadline）", ("reason", "priority")
+    )
+    CANCELLED = tts_metrics.Counter(
+        "tts_cancelled_total", "中途停止或撤出队列的合成请求数（reason: cancelled/disconnected/deadline）", ("reason",)
+    )
+    tts_metrics.Gauge(
+        "tts_coalesced_in_flight", "正在进行、可被相同请求合并的合成数",
+        function=lambda: len(_single_flight) if _single_flight is not None else 0
+    )
+else:
+    REQUESTS = INFERENCE_SECONDS = REAL_TIME_FACTOR = REQUEST_SECONDS = MODEL_LOAD_SECONDS = _NoMetric()
+    COALESCED_FOLLOWERS = QUEUE_REJECTED = CANCELLED = _NoMetric()
+
+# 合并进行中的相同合成（文本、语言、说话人都相同）：并发的相同请求只合成一次
+_single_flight = SingleFlight(on_follow=COALESCED_FOLLOWERS.inc) if SingleFlight is not None else None
+
+# 合成名额：同时合成的请求数有上限，等待的请求按优先级、房间和角色公平排队（见 scripts/tts_scheduler.py）
+SYNTHESIS_SLOTS = int(os.environ.get("MELO_SYNTHESIS_SLOTS", "2"))
+MAX_QUEUE = int(os.environ.get("MELO_MAX_QUEUE", "32"))
+_synthesis_gate = FairGate(SYNTHESIS_SLOTS, MAX_QUEUE, stale_seconds_from_env()) if FairGate is not None else None
+# 请求ID与截止时间（剩余毫秒数）请求头，与 Piper 服务相同
+REQUEST_ID_HEADER = "X-Request-Id"
+DEADLINE_HEADER = "X-TTS-Deadline-Ms"
+CANCELLED_STATUS = (499, 504)  # 取消 / 超过截止时间
+
+# 正在处理的请求：{请求ID: Cancellation}，DELETE /tts/{id} 按ID取消
+_active_requests = {}
+_active_requests_lock = threading.Lock()
+
+
+def _cancelled_error(e):
+    CANCELLED.inc((e.reason,))
+    return HTTPException(status_code=504 if e.reason == "deadline" else 499, detail=str(e))
+
+
+@contextmanager
+def synthesis_slot(schedule, cancellation=None):
+    """占用一个合成名额；队列已满、被更高优先级的请求抢占或排队过久时返回 503，超过截止时间返回 504
+
+    排队中或拿到名额时已被取消（DELETE、客户端断开）返回 499。
+    melotts 的 synthesize() 一次合成整段，开始合成后不能中途停止。
+    """
+    if _synthesis_gate is None:
+        yield
+        return
+    try:
+        _synthesis_gate.acquire(schedule, cancellation)
+    except Rejected as e:
+        QUEUE_REJECTED.inc((e.reason, PRIORITY_NAMES[e.priority]))
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Cancelled as e:
+        raise _cancelled_error(e)
+    try:
+        if cancellation is not None:
+            cancellation.check()
+        yield
+    except Cancelled as e:
+        raise _cancelled_error(e)
+    finally:
+        _synthesis_gate.release()
+
+
+def wav_duration(audio_data: bytes) -> float:
+    """WAV 音频时长（秒），无法解析时返回 0（只读文件头）"""
+    try:
+        with wave.open(io.BytesIO(audio_data), "rb") as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return 0.0
 
 
 def get_tts_model():
-    """获取 TTS 模型（延迟加载）"""
+    """获取 TTS 模型（未加载时加载，同一时间只加载一次）"""
     global _tts_model
     if _tts_model is None:
-        try:
-            from melotts import MeloTTS
-            logger.info("正在加载 Melo TTS 模型...")
-            _tts_model = MeloTTS(language='ZH', device='auto')
-            logger.info("✅ Melo TTS 模型加载完成")
-        except ImportError:
-            logger.error("❌ 未安装 Melo TTS，请运行: pip install git+https://github.com/myshell-ai/MeloTTS.git")
-            raise
-        except Exception as e:
-            logger.error(f"❌ 加载 Melo TTS 模型失败: {e}")
-            raise
+        with _model_lock:
+            if _tts_model is None:
+                started = time.monotonic()
+                _loader_state.update(status="loading", error=None)
+                try:
+                    from melotts import MeloTTS
+                    logger.info("正在加载 Melo TTS 模型...")
+                    _tts_model = MeloTTS(language='ZH', device='auto')
+                    _loader_state.update(status="loaded", seconds=round(time.monotonic() - started, 3))
+                    MODEL_LOAD_SECONDS.set(_loader_state["seconds"], ("ZH",))
+                    logger.info("✅ Melo TTS 模型加载完成")
+                except ImportError as e:
+                    _loader_state.update(status="failed", error=str(e))
+                    logger.error("❌ 未安装 Melo TTS，请运行: pip install git+https://github.com/myshell-ai/MeloTTS.git")
+                    raise
+                except Exception as e:
+                    _loader_state.update(status="failed", error=str(e))
+                    logger.error(f"❌ 加载 Melo TTS 模型失败: {e}")
+                    raise
     return _tts_model
 
 
+@app.on_event("startup")
+def start_model_loader():
+    """启动时在后台线程加载模型，服务立即开始监听（加载期间 /readyz 返回 503）"""
+    def run():
+        try:
+            get_tts_model()
+        except Exception:
+            pass  # 错误已记录在 _loader_state 中，请求到来时会重试加载
+
+    threading.Thread(target=run, name="melo-model-loader", daemon=True).start()
+
+
 class TTSRequest(BaseModel):
     """TTS 请求模型"""
     text: str
     lang: str = "ZH"  # 语言代码: ZH, EN, JP 等
     speaker: Optional[str] = None  # 说话人ID（可选）
+    priority: Optional[Union[int, str]] = None  # chat / event / quarrel / announcement 或 1-4
+    room: Optional[str] = None  # 房间 ID（排队时各房间公平）
+    role: Optional[str] = None  # 角色（玩家）ID（排队时同一房间内各角色公平）
 
 
 class HealthResponse(BaseModel):
@@ -77,27 +242,107 @@ class HealthResponse(BaseModel):
 
 @app.get("/health")
 async def health_check():
-    """健康检查端点"""
-    try:
-        # 尝试加载模型以检查服务是否正常
-        model = get_tts_model()
+    """健康检查端点（只读模型加载状态，不加载模型）"""
+    if _loader_state["status"] == "loaded":
         return HealthResponse(status="ok", service="Melo TTS")
-    except Exception as e:
-        logger.error(f"健康检查失败: {e}")
-        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    if _loader_state["status"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {_loader_state['error']}")
+    raise HTTPException(status_code=503, detail="Service unavailable: 模型加载中")
+
+
+@app.get("/livez")
+async def livez():
+    """存活检查：进程能响应即可"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪检查：模型加载完成后才返回 200（只读内存中的状态）"""
+    result = {
+        "status": "ok" if _loader_state["status"] == "loaded" else _loader_state["status"],
+        "models": {"ZH": _loader_state["status"]},
+        "loader": dict(_loader_state),
+        "inflight": _inflight,
+    }
+    return JSONResponse(result, status_code=200 if result["status"] == "ok" else 503)
+
+
+@app.get("/queue/stats")
+def queue_stats():
+    """合成名额与排队统计"""
+    return _synthesis_gate.stats() if _synthesis_gate is not None else {}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标（异步函数：在事件循环线程中读取线程池排队数）"""
+    if tts_metrics is None:
+        raise HTTPException(status_code=503, detail="服务端未安装 tts_metrics")
+    return Response(content=tts_metrics.REGISTRY.render(), media_type=tts_metrics.CONTENT_TYPE)
+
+
+async def cancel_on_disconnect(http_request: Request, cancellation):
+    """请求体读完后 receive() 只在客户端断开时返回 http.disconnect：取消合成（排队中的直接撤下）"""
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+    cancellation.cancel("disconnected")
 
 
 @app.post("/tts")
-async def synthesize_speech(request: TTSRequest):
+async def synthesize_speech(request: TTSRequest, http_request: Request):
     """
-    文本转语音
+    文本转语音（合成在线程池中执行，合成期间事件循环仍能响应健康检查）
+    
+    请求头 X-Request-Id 为请求命名（没有时生成一个，随响应返回），DELETE /tts/{id} 按它取消；
+    客户端断开时同样取消。排队中的请求立即撤下并返回 499，超过 X-TTS-Deadline-Ms 返回 504；
+    已经开始的合成不能中途停止（见 synthesis_slot()）。
     
     Args:
         request: TTS 请求，包含文本和语言代码
+        http_request: 原始请求（读取请求ID和截止时间头）
         
     Returns:
         音频文件（WAV 格式）
     """
+    import asyncio
+    
+    if _synthesis_gate is None:
+        return await run_in_threadpool(render_speech, request, None, None)
+    try:
+        deadline = parse_deadline_ms(http_request.headers.get(DEADLINE_HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cancellation = Cancellation(http_request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex, deadline)
+    with _active_requests_lock:
+        _active_requests[cancellation.request_id] = cancellation
+    watcher = asyncio.ensure_future(cancel_on_disconnect(http_request, cancellation))
+    try:
+        return await run_in_threadpool(render_speech, request, deadline, cancellation)
+    finally:
+        watcher.cancel()
+        with _active_requests_lock:
+            if _active_requests.get(cancellation.request_id) is cancellation:
+                del _active_requests[cancellation.request_id]
+
+
+@app.delete("/tts/{request_id}")
+def cancel_tts(request_id: str):
+    """取消正在处理的合成请求（排队中的直接撤下，已开始的合成完成后不再返回音频）"""
+    with _active_requests_lock:
+        cancellation = _active_requests.get(request_id)
+    if cancellation is None:
+        raise HTTPException(status_code=404, detail=f"没有正在处理的请求 {request_id}")
+    cancellation.cancel()
+    return {"id": request_id, "cancelled": True}
+
+
+def render_speech(request: TTSRequest, deadline, cancellation):
+    """合成一句并返回 Response（在线程池中执行）；deadline 和 cancellation 在没有合成调度时为 None"""
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+    started = time.perf_counter()
     try:
         # 验证输入
         if not request.text or len(request.text.strip()) == 0:
@@ -106,6 +351,13 @@ async def synthesize_speech(request: TTSRequest):
         if len(request.text) > 500:  # 限制文本长度
             raise HTTPException(status_code=400, detail="文本长度不能超过 500 字符")
         
+        schedule = None
+        if _synthesis_gate is not None:
+            try:
+                schedule = make_schedule(request.priority, request.room, request.role, request.text, deadline)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
         # 获取 TTS 模型
         model = get_tts_model()
         
@@ -113,24 +365,56 @@ async def synthesize_speech(request: TTSRequest):
         speaker = request.speaker or request.lang  # 默认使用语言代码作为说话人
         
         logger.info(f"正在合成语音: 文本长度={len(request.text)}, 语言={request.lang}, 说话人={speaker}")
+        REQUESTS.inc((request.lang, speaker))
         
-        # 生成语音
-        audio_data = model.synthesize(
-            text=request.text,
-            language=request.lang,
-            speaker=speaker
-        )
+        def synthesize():
+            # 生成语音
+            with synthesis_slot(schedule, cancellation):
+                synth_started = time.perf_counter()
+                wav = model.synthesize(
+                    text=request.text,
+                    language=request.lang,
+                    speaker=speaker
+                )
+            elapsed = time.perf_counter() - synth_started
+            INFERENCE_SECONDS.observe(elapsed, (request.lang,))
+            duration = wav_duration(wav)
+            if duration > 0:
+                REAL_TIME_FACTOR.observe(elapsed / duration, (request.lang,))
+            return wav
+        
+        if _single_flight is not None:
+            # 同一句话正在合成时直接等它的结果
+            audio_data = None
+            while audio_data is None:
+                try:
+                    audio_data = _single_flight.do((request.text.strip(), request.lang, speaker), synthesize)
+                except HTTPException as e:
+                    # 等的那次合成被它自己的请求取消了：本请求没有取消时重新合成
+                    if e.status_code not in CANCELLED_STATUS or cancellation is None or cancellation.reason:
+                        raise
+        else:
+            audio_data = synthesize()
+        if cancellation is not None:
+            # 合成期间被取消（客户端已断开或 DELETE）：结果已交给合并等待的其他请求，这里不再返回
+            try:
+                cancellation.check()
+            except Cancelled as e:
+                raise _cancelled_error(e)
         
         logger.info(f"✅ 语音合成成功，音频长度={len(audio_data)} 字节")
         
         # 返回音频文件
+        headers = {
+            "Content-Disposition": "attachment; filename=speech.wav",
+            "X-Audio-Duration": str(estimate_duration(request.text))
+        }
+        if cancellation is not None:
+            headers[REQUEST_ID_HEADER] = cancellation.request_id
         return Response(
             content=audio_data,
             media_type="audio/wav",
-            headers={
-                "Content-Disposition": "attachment; filename=speech.wav",
-                "X-Audio-Duration": str(estimate_duration(request.text))
-            }
+            headers=headers
         )
         
     except HTTPException:
@@ -138,6 +422,10 @@ async def synthesize_speech(request: TTSRequest):
     except Exception as e:
         logger.error(f"语音合成失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"语音合成失败: {str(e)}")
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, (request.lang,))
+        with _inflight_lock:
+            _inflight -= 1
 
 
 def estimate_duration(text: str) -> float:
@@ -154,11 +442,17 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "tts": "/tts (POST)"
+            "livez": "/livez",
+            "readyz": "/readyz",
+            "metrics": "/metrics",
+            "tts": "/tts (POST)",
+            "cancel": "/tts/{id} (DELETE)"
         },
         "usage": {
             "health": "GET /health",
-            "tts": "POST /tts with JSON body: {text: '你好', lang: 'ZH', speaker: 'ZH'}"
+            "readyz": "GET /readyz（模型加载完成前返回 503）",
+            "tts": "POST /tts with JSON body: {text: '你好', lang: 'ZH', speaker: 'ZH'}",
+            "cancel": "DELETE /tts/{id}（id 为请求头或响应头 X-Request-Id）"
         }
     }
 
@@ -5,23 +5,234 @@ MeLo TTS API 服务器 - 多语言版本
 
 使用方法:
     python3 melo-tts-server-multilang.py
+    python3 melo-tts-server-multilang.py --build-audio-bank ../../tts-services/audio-bank-melo.bin  # 预生成固定台词
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict
-import uvicorn, logging, io, traceback
+from typing import Optional, Dict, Union
+from contextlib import contextmanager
+from functools import lru_cache
+import uvicorn, logging, io, os, sys, threading, time, traceback, uuid
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 与 Piper 服务共享的磁盘音频存储（scripts/tts_audio_store.py）
+# 部署到其他机器时，把 tts_audio_store.py 放在本文件同目录或用 TTS_SHARED_MODULES_DIR 指定所在目录
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.environ.get('TTS_SHARED_MODULES_DIR') or os.path.join(_REPO_ROOT, 'scripts'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+try:
+    from tts_audio_store import AudioStore, etag_matches, open_default_store, weak_etag
+except ImportError as e:
+    logger.warning(f"⚠️  磁盘音频存储不可用，每次请求都会重新合成: {e}")
+    AudioStore = None
+try:
+    _audio_store = open_default_store(os.path.join(_REPO_ROOT, 'tts-services', 'audio-store')) if AudioStore is not None else None
+except Exception as e:
+    logger.warning(f"⚠️  磁盘音频存储不可用，每次请求都会重新合成: {e}")
+    _audio_store = None
+try:
+    from tts_audio_bank import build_bank, byte_range, fixed_vocabulary, open_default_bank
+    _audio_bank = open_default_bank(os.path.join(_REPO_ROOT, 'tts-services', 'audio-bank-melo.bin'))
+    if _audio_bank is not None:
+        logger.info(f"📦 预生成音频库: {_audio_bank.path}（{len(_audio_bank)} 条）")
+except Exception as e:
+    logger.warning(f"⚠️  预生成音频库不可用: {e}")
+    _audio_bank = None
+try:
+    import tts_audio_formats
+except ImportError as e:
+    logger.warning(f"⚠️  输出格式转换不可用，只能输出 WAV: {e}")
+    tts_audio_formats = None
+try:
+    import tts_metrics
+except ImportError as e:
+    logger.warning(f"⚠️  指标模块不可用，/metrics 将返回 503: {e}")
+    tts_metrics = None
+try:
+    from tts_singleflight import SingleFlight
+except ImportError as e:
+    logger.warning(f"⚠️  请求合并不可用，并发的相同请求会各自合成: {e}")
+    SingleFlight = None
+try:
+    from tts_scheduler import (
+        Cancellation, Cancelled, FairGate, Rejected, PRIORITY_NAMES,
+        make_schedule, parse_deadline_ms, stale_seconds_from_env
+    )
+except ImportError as e:
+    logger.warning(f"⚠️  合成调度不可用，请求按到达顺序合成，不支持截止时间和取消: {e}")
+    FairGate = None
+try:
+    from tts_clauses import ClauseSplitter
+except ImportError as e:
+    logger.warning(f"⚠️  分句模块不可用，WebSocket 接口 /tts/ws 不可用: {e}")
+    ClauseSplitter = None
+
 app = FastAPI(title="Melo TTS API Server - Multi-Language")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(
+    CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Request-Id", "ETag", "X-TTS-Cache"]
+)
 
 # 多语言模型缓存
 _tts_models: Dict[str, any] = {}
+_tts_models_lock = threading.Lock()
+
+# 启动时在后台预加载的语言（逗号分隔，留空则全部按需加载）
+PRELOAD_LANGUAGES = [l.strip() for l in os.environ.get('MELO_PRELOAD_LANGUAGES', 'ZH').split(',') if l.strip()]
+
+# 模型加载状态：{语言: 'pending' | 'loading' | 'loaded' | 'failed'}（/readyz 只读这里，不触发加载）
+_model_states: Dict[str, str] = {}
+_model_errors: Dict[str, str] = {}
+_inflight = 0  # 正在合成的请求数
+_inflight_lock = threading.Lock()
+
+class _NoMetric:
+    """tts_metrics 不可用时的占位：所有记录操作都是空操作"""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def _threadpool_waiting():
+    """等待线程池空位的请求数（/tts 是普通函数，由 anyio 线程池执行；只能在事件循环线程中调用）"""
+    import anyio.to_thread
+    return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+# 指标（GET /metrics，Prometheus 文本格式，见 scripts/tts_metrics.py）
+if tts_metrics is not None:
+    REQUESTS = tts_metrics.Counter('tts_requests_total', '合成请求数（缓存命中也计入）', ('language', 'speaker'))
+    CACHE_LOOKUPS = tts_metrics.Counter(
+        'tts_cache_lookups_total', '音频库和磁盘存储查询次数（cache: wav/encoded，result: bank/disk/miss）',
+        ('cache', 'language', 'result')
+    )
+    INFLIGHT = tts_metrics.Gauge('tts_inflight_requests', '正在处理的合成请求数', function=lambda: _inflight)
+    QUEUE_DEPTH = tts_metrics.Gauge('tts_queue_depth', '等待线程池空位的请求数', function=_threadpool_waiting)
+    PHONEMIZE_SECONDS = tts_metrics.Histogram('tts_phonemize_seconds', '文本处理（G2P + BERT 特征）耗时（每句）', ('language',))
+    INFERENCE_SECONDS = tts_metrics.Histogram('tts_inference_seconds', '模型推理耗时（每句）', ('language',))
+    REAL_TIME_FACTOR = tts_metrics.Histogram(
+        'tts_real_time_factor', '推理耗时 / 生成的音频时长（每句）', ('language',), buckets=tts_metrics.RTF_BUCKETS
+    )
+    ENCODE_SECONDS = tts_metrics.Histogram('tts_encode_seconds', 'WAV 转码为输出格式的耗时', ('format',))
+    REQUEST_SECONDS = tts_metrics.Histogram('tts_request_duration_seconds', '请求总耗时', ('language',))
+    MODEL_LOAD_SECONDS = tts_metrics.Gauge('tts_model_load_seconds', '最近一次加载该语言模型的耗时', ('language',))
+    COALESCED_FOLLOWERS = tts_metrics.Counter(
+        'tts_coalesced_followers_total', '挂到进行中的相同合成上、没有重复合成的请求数'
+    )
+    QUEUE_REJECTED = tts_metrics.Counter(
+        'tts_queue_rejected_total', '合成队列拒绝的请求数（reason: full/preempted/stale/deadline）', ('reason', 'priority')
+    )
+    CANCELLED = tts_metrics.Counter(
+        'tts_cancelled_total', '中途停止或撤出队列的合成请求数（reason: cancelled/deadline）', ('reason',)
+    )
+    CONDITIONAL_RESPONSES = tts_metrics.Counter(
+        'tts_conditional_responses_total', '条件请求与 HEAD 探测（result: not_modified/probe_hit/probe_miss）', ('result',)
+    )
+    tts_metrics.Gauge(
+        'tts_coalesced_in_flight', '正在进行、可被相同请求合并的合成数',
+        function=lambda: len(_single_flight) if _single_flight is not None else 0
+    )
+else:
+    REQUESTS = CACHE_LOOKUPS = PHONEMIZE_SECONDS = INFERENCE_SECONDS = REAL_TIME_FACTOR = _NoMetric()
+    ENCODE_SECONDS = REQUEST_SECONDS = MODEL_LOAD_SECONDS = COALESCED_FOLLOWERS = QUEUE_REJECTED = _NoMetric()
+    CANCELLED = CONDITIONAL_RESPONSES = _NoMetric()
+
+# 合并进行中的相同合成（语言、说话人、语速、文本都相同）：并发的相同请求只合成一次，见 scripts/tts_singleflight.py
+_single_flight = SingleFlight(on_follow=COALESCED_FOLLOWERS.inc) if SingleFlight is not None else None
+
+# 合成名额：同时合成的请求数有上限，等待的请求按优先级、房间和角色公平排队（见 scripts/tts_scheduler.py）
+SYNTHESIS_SLOTS = int(os.environ.get('MELO_SYNTHESIS_SLOTS', '2'))
+MAX_QUEUE = int(os.environ.get('MELO_MAX_QUEUE', '32'))
+_synthesis_gate = FairGate(SYNTHESIS_SLOTS, MAX_QUEUE, stale_seconds_from_env()) if FairGate is not None else None
+
+# 请求ID与截止时间（剩余毫秒数）请求头，与 Piper 服务相同
+REQUEST_ID_HEADER = 'X-Request-Id'
+DEADLINE_HEADER = 'X-TTS-Deadline-Ms'
+CANCELLED_STATUS = (499, 504)  # 取消 / 超过截止时间
+# HEAD /tts 探测结果：服务端是否已有这段音频（hit 时不用合成）
+CACHE_STATUS_HEADER = 'X-TTS-Cache'
+
+# 正在处理的请求：{请求ID: Cancellation}，DELETE /tts/{id} 按ID取消
+_active_requests: Dict[str, any] = {}
+_active_requests_lock = threading.Lock()
+# 当前线程正在合成的请求的取消令牌（推理钩子在每句之前检查）
+_synthesis_context = threading.local()
+
+def _cancelled_error(e):
+    CANCELLED.inc((e.reason,))
+    return HTTPException(504 if e.reason == 'deadline' else 499, str(e))
+
+@contextmanager
+def synthesis_slot(schedule, cancellation=None):
+    """占用一个合成名额；队列已满、被更高优先级的请求抢占或排队过久时返回 503，超过截止时间返回 504
+
+    合成期间 cancellation 被取消（或超过截止时间）时在下一句之前停止，返回 499 / 504。
+    """
+    if _synthesis_gate is None:
+        yield
+        return
+    try:
+        _synthesis_gate.acquire(schedule, cancellation)
+    except Rejected as e:
+        QUEUE_REJECTED.inc((e.reason, PRIORITY_NAMES[e.priority]))
+        if e.reason == 'deadline':
+            raise HTTPException(504, str(e))
+        raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+    except Cancelled as e:
+        raise _cancelled_error(e)
+    _synthesis_context.cancellation = cancellation
+    try:
+        yield
+    except Cancelled as e:
+        raise _cancelled_error(e)
+    finally:
+        _synthesis_context.cancellation = None
+        _synthesis_gate.release()
+
+def instrument_model(model, lang: str):
+    """给 Melo 模型的文本处理和推理挂上计时
+    
+    tts_to_file() 内部逐句调用 melo.utils.get_text_for_tts_infer() 和 model.model.infer()，
+    这里替换模块函数和实例属性，melo 版本不同、找不到这两个入口时跳过（只保留请求级别的指标）。
+    推理钩子同时检查当前请求是否已取消，取消后不再合成剩下的句子。
+    """
+    try:
+        from melo import utils as melo_utils
+        get_text = melo_utils.get_text_for_tts_infer
+        if not getattr(get_text, '_timed', False):
+            def timed_get_text(text, language, *args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return get_text(text, language, *args, **kwargs)
+                finally:
+                    PHONEMIZE_SECONDS.observe(time.perf_counter() - started, (language,))
+            timed_get_text._timed = True
+            melo_utils.get_text_for_tts_infer = timed_get_text
+    except (ImportError, AttributeError):
+        pass
+    
+    synthesizer = getattr(model, 'model', None)
+    if synthesizer is None or not hasattr(synthesizer, 'infer'):
+        return
+    infer = synthesizer.infer
+    sample_rate = model.hps.data.sampling_rate
+    
+    def timed_infer(*args, **kwargs):
+        # tts_to_file() 逐句推理：请求已取消时在这一句之前停止
+        cancellation = getattr(_synthesis_context, 'cancellation', None)
+        if cancellation is not None:
+            cancellation.check()
+        started = time.perf_counter()
+        result = infer(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        INFERENCE_SECONDS.observe(elapsed, (lang,))
+        samples = result[0].shape[-1]
+        if samples:
+            REAL_TIME_FACTOR.observe(elapsed * sample_rate / samples, (lang,))
+        return result
+    
+    synthesizer.infer = timed_infer
 
 # 语言映射
 LANGUAGE_MAP = {
@@ -50,27 +261,119 @@ def get_tts_model(language: str = 'ZH'):
     lang = LANGUAGE_MAP.get(language, 'ZH')
     
     if lang not in _tts_models:
-        try:
-            from melo.api import TTS
-            logger.info(f"🔄 加载 {lang} 语言模型...")
-            _tts_models[lang] = TTS(language=lang, device='auto')
-            logger.info(f"✅ {lang} 模型加载完成")
-            
-            # 打印可用的说话人
-            spk2id = _tts_models[lang].hps.data.spk2id
-            logger.info(f"📋 {lang} 可用说话人: {list(spk2id.keys())}")
-        except Exception as e:
-            logger.error(f"❌ {lang} 模型加载失败: {e}")
-            traceback.print_exc()
-            raise
+        # 同一时间只加载一个模型，避免后台预加载和请求重复加载同一语言
+        with _tts_models_lock:
+            if lang not in _tts_models:
+                _model_states[lang] = 'loading'
+                try:
+                    from melo.api import TTS
+                    logger.info(f"🔄 加载 {lang} 语言模型...")
+                    started = time.perf_counter()
+                    model = TTS(language=lang, device='auto')
+                    MODEL_LOAD_SECONDS.set(round(time.perf_counter() - started, 3), (lang,))
+                    instrument_model(model, lang)
+                    logger.info(f"✅ {lang} 模型加载完成")
+                    
+                    # 打印可用的说话人
+                    spk2id = model.hps.data.spk2id
+                    logger.info(f"📋 {lang} 可用说话人: {list(spk2id.keys())}")
+                except Exception as e:
+                    _model_states[lang] = 'failed'
+                    _model_errors[lang] = str(e)
+                    logger.error(f"❌ {lang} 模型加载失败: {e}")
+                    traceback.print_exc()
+                    raise
+                _tts_models[lang] = model
+                _model_states[lang] = 'loaded'
+                _model_errors.pop(lang, None)
     
     return _tts_models[lang]
 
+def resolve_speaker(model, lang: str, speaker: Optional[str]):
+    """说话人 ID：指定的说话人，否则该语言的默认说话人，再否则第一个可用的说话人"""
+    spk2id = model.hps.data.spk2id
+    logger.info(f"🔍 可用说话人: {list(spk2id.keys())}")
+    if speaker and speaker in spk2id:
+        logger.info(f"✅ 使用指定说话人: {speaker} -> {spk2id[speaker]}")
+        return spk2id[speaker]
+    if lang in spk2id:
+        logger.info(f"✅ 使用默认说话人: {lang} -> {spk2id[lang]}")
+        return spk2id[lang]
+    sid = list(spk2id.values())[0]
+    logger.info(f"⚠️  使用第一个可用说话人: {sid}")
+    return sid
+
+def get_stored(key):
+    """依次查预生成音频库和共享磁盘存储，返回 ((音频, 元数据), 来源 bank/disk) 或 (None, 'miss')"""
+    if key is None:
+        return None, 'miss'
+    stored = _audio_bank.get(key) if _audio_bank is not None else None
+    if stored is not None:
+        return stored, 'bank'
+    stored = _audio_store.get(key) if _audio_store is not None else None
+    return stored, 'miss' if stored is None else 'disk'
+
+@app.on_event("startup")
+def start_model_loader():
+    """启动时在后台线程预加载 PRELOAD_LANGUAGES，服务立即开始监听（加载期间 /readyz 返回 503）"""
+    languages = [LANGUAGE_MAP.get(l, 'ZH') for l in PRELOAD_LANGUAGES]
+    for lang in languages:
+        _model_states.setdefault(lang, 'pending')
+    
+    def run():
+        started = time.monotonic()
+        for lang in languages:
+            try:
+                get_tts_model(lang)
+            except Exception:
+                pass  # 错误已记录在 _model_errors 中，请求到来时会重试加载
+        logger.info(f"🔥 预加载完成: {languages}，耗时 {time.monotonic() - started:.1f} 秒")
+    
+    threading.Thread(target=run, name="melo-model-loader", daemon=True).start()
+
+@lru_cache(maxsize=None)
+def melo_model_id(lang: str) -> str:
+    """Melo 模型由 melo 包自行下载，没有固定的模型文件，用 语言 + 包版本 作为模型标识
+
+    每个请求要算好几次（存储键、ETag、音频库键），查包版本要扫描 site-packages，按语言缓存到进程结束。
+    """
+    try:
+        from importlib.metadata import version
+        melo_version = version('melotts')
+    except Exception:
+        melo_version = 'unknown'
+    return f"melo-{lang}-{melo_version}"
+
+def melo_store_key(lang: str, sid, speed: Optional[float], text: str, output_tag: Optional[str] = None):
+    """磁盘存储和预生成音频库共用的键：(引擎, 模型标识, 说话人, 语速, 文本)，转码结果再加上输出格式"""
+    key_args = ('melo', melo_model_id(lang), sid, speed or 1.0, text.strip())
+    if output_tag is not None:
+        return AudioStore.make_key(*key_args, output=output_tag)
+    return AudioStore.make_key(*key_args)
+
+def melo_etag(lang: str, speaker: Optional[str], speed: Optional[float], text: str, output_tag: Optional[str] = None):
+    """响应的弱 ETag：由请求里的说话人名字而不是说话人 ID 计算，不用加载模型就能回答 304
+
+    存储键要用模型解析出的说话人 ID，这里不能直接用存储键。
+    """
+    key_args = ('melo', melo_model_id(lang), speaker or '', speed or 1.0, text.strip())
+    if output_tag is not None:
+        return weak_etag(AudioStore.make_key(*key_args, output=output_tag))
+    return weak_etag(AudioStore.make_key(*key_args))
+
 class TTSRequest(BaseModel):
     text: str
     lang: str = "ZH"
     speaker: Optional[str] = None
     speed: Optional[float] = 1.0
+    format: Optional[str] = None  # wav / l16 / adpcm / opus，不填时按 Accept 头协商
+    rate: Optional[int] = None    # 16000 / 8000，服务端降采样
+    priority: Optional[Union[int, str]] = None  # chat / event / quarrel / announcement 或 1-4
+    room: Optional[str] = None    # 房间 ID（排队时各房间公平）
+    role: Optional[str] = None    # 角色（玩家）ID（排队时同一房间内各角色公平）
+
+# 各输出格式下载时使用的文件扩展名
+FORMAT_EXTENSIONS = {'wav': 'wav', 'l16': 'pcm', 'adpcm': 'wav', 'opus': 'ogg'}
 
 class HealthResponse(BaseModel):
     status: str
@@ -92,6 +395,75 @@ def health():
         traceback.print_exc()
         raise HTTPException(500, str(e))
 
+@app.get("/livez")
+def livez():
+    """存活检查：进程能响应即可"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """就绪检查：预加载的语言模型都加载完成后才返回 200（只读内存中的状态）"""
+    states = dict(_model_states)
+    preload = [LANGUAGE_MAP.get(l, 'ZH') for l in PRELOAD_LANGUAGES]
+    pending = [lang for lang in preload if states.get(lang) != 'loaded']
+    if not pending:
+        status = "ok"
+    elif any(states.get(lang) == 'failed' for lang in pending):
+        status = "failed"
+    else:
+        status = "loading"
+    result = {
+        "status": status,
+        "models": states,
+        "errors": dict(_model_errors),
+        "inflight": _inflight,
+    }
+    return JSONResponse(result, status_code=200 if status == "ok" else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标（异步函数：在事件循环线程中读取线程池排队数）"""
+    if tts_metrics is None:
+        raise HTTPException(503, "服务端未安装 tts_metrics")
+    return Response(content=tts_metrics.REGISTRY.render(), media_type=tts_metrics.CONTENT_TYPE)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """共享磁盘音频存储统计"""
+    return {
+        "disk": _audio_store.stats() if _audio_store is not None else None,
+        "bank": _audio_bank.stats() if _audio_bank is not None else None,
+        "coalescing": _single_flight.stats() if _single_flight is not None else None
+    }
+
+@app.get("/queue/stats")
+def queue_stats():
+    """合成名额与排队统计"""
+    return _synthesis_gate.stats() if _synthesis_gate is not None else {}
+
+@app.api_route("/audio-bank", methods=["GET", "HEAD"])
+def audio_bank_file(request: Request):
+    """下载预生成音频库文件（支持 Range，可作为音频精灵使用；HEAD 只返回大小）"""
+    if _audio_bank is None:
+        raise HTTPException(404, "没有预生成音频库")
+    if etag_matches(request.headers.get("if-none-match"), _audio_bank.etag):
+        CONDITIONAL_RESPONSES.inc(('not_modified',))
+        return Response(status_code=304, headers={"ETag": _audio_bank.etag})
+    status, start, stop, headers = byte_range(request.headers.get("range"), _audio_bank.size)
+    headers["ETag"] = _audio_bank.etag
+    if request.method == "HEAD":
+        return Response(status_code=status, media_type="application/octet-stream", headers=headers)
+    return StreamingResponse(
+        _audio_bank.read(start, stop), status_code=status, media_type="application/octet-stream", headers=headers
+    )
+
+@app.get("/audio-bank/index")
+def audio_bank_index():
+    """预生成音频库的索引：各条目的键、文本、说话人、在文件中的偏移和长度"""
+    if _audio_bank is None:
+        raise HTTPException(404, "没有预生成音频库")
+    return _audio_bank.manifest()
+
 @app.get("/languages")
 def list_languages():
     """列出支持的语言"""
@@ -106,8 +478,57 @@ def list_languages():
         ]
     }
 
+def negotiate_output(req: TTSRequest, accept: Optional[str]):
+    """确定输出格式（scripts/tts_audio_formats.py），参数不合法时返回 400"""
+    if tts_audio_formats is None:
+        if req.format not in (None, 'wav') or req.rate:
+            raise HTTPException(400, "服务端未安装 tts_audio_formats，只支持 WAV 输出")
+        return None
+    try:
+        return tts_audio_formats.negotiate(req.format, req.rate, accept)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
 @app.post("/tts")
-def tts(req: TTSRequest):
+def tts(req: TTSRequest, request: Request):
+    return render_tts(req, request.headers)
+
+@app.api_route("/tts", methods=["GET", "HEAD"])
+def tts_query(request: Request):
+    """GET /tts?text=...：参数放在查询串里，浏览器和 CDN 可以按 URL 缓存；
+    HEAD 只返回 ETag 和 X-TTS-Cache（hit/miss），不合成
+    """
+    try:
+        req = TTSRequest(**request.query_params)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return render_tts(req, request.headers, probe=request.method == "HEAD")
+
+def probe_response(headers, cached, media_type):
+    """HEAD 探测的响应：cached 为已有音频（bytes）或 None（需要合成）"""
+    CONDITIONAL_RESPONSES.inc(('probe_miss' if cached is None else 'probe_hit',))
+    headers = dict(headers, **{CACHE_STATUS_HEADER: 'miss' if cached is None else 'hit'})
+    response = Response(status_code=200, media_type=media_type, headers=headers)
+    if cached is None:
+        del response.headers["content-length"]
+    else:
+        response.headers["content-length"] = str(len(cached))
+    return response
+
+def render_tts(req: TTSRequest, request_headers, cancellation=None, probe=False):
+    """合成一句并返回 Response（/tts 和 /tts/ws 的每个子句共用）
+
+    cancellation 为空时按请求头创建取消令牌并登记（DELETE /tts/{id} 可取消）；
+    WebSocket 连接的各子句传入连接的取消令牌，由连接负责登记。
+    完整响应带弱 ETag（见 melo_etag()），If-None-Match 匹配时在加载模型之前就返回 304；
+    probe=True（HEAD）时只查缓存不合成。
+    """
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+    started = time.perf_counter()
+    lang = LANGUAGE_MAP.get(req.lang, 'ZH')
+    registered = None
     try:
         logger.info(f"📝 收到请求 - 文本: '{req.text[:50]}...', 语言: {req.lang}, 速度: {req.speed}")
         
@@ -117,51 +538,129 @@ def tts(req: TTSRequest):
         if len(req.text) > 1000:
             raise HTTPException(400, "文本长度不能超过 1000 字符")
         
-        # 标准化语言代码
-        lang = LANGUAGE_MAP.get(req.lang, 'ZH')
+        output = negotiate_output(req, request_headers.get("accept"))
+        transcoded = output is not None and output != tts_audio_formats.DEFAULT_FORMAT
+        
+        etag = None
+        if AudioStore is not None:
+            etag = melo_etag(lang, req.speaker, req.speed, req.text, output.cache_tag() if transcoded else None)
+            if etag_matches(request_headers.get("if-none-match"), etag):
+                CONDITIONAL_RESPONSES.inc(('not_modified',))
+                return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+        
+        schedule = None
+        if _synthesis_gate is not None:
+            try:
+                deadline = parse_deadline_ms(request_headers.get(DEADLINE_HEADER))
+                schedule = make_schedule(req.priority, req.room, req.role, req.text, deadline)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+            if cancellation is None:
+                cancellation = registered = Cancellation(
+                    request_headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex, deadline
+                )
+                with _active_requests_lock:
+                    _active_requests[cancellation.request_id] = cancellation
+        
         logger.info(f"🌍 使用语言: {lang}")
         
         # 获取对应语言的模型
         model = get_tts_model(lang)
         
         # 获取说话人 ID
-        spk2id = model.hps.data.spk2id
-        logger.info(f"🔍 可用说话人: {list(spk2id.keys())}")
-        
-        # 使用指定的说话人或默认说话人
-        if req.speaker and req.speaker in spk2id:
-            sid = spk2id[req.speaker]
-            logger.info(f"✅ 使用指定说话人: {req.speaker} -> {sid}")
-        elif lang in spk2id:
-            sid = spk2id[lang]
-            logger.info(f"✅ 使用默认说话人: {lang} -> {sid}")
-        else:
-            sid = list(spk2id.values())[0]
-            logger.info(f"⚠️  使用第一个可用说话人: {sid}")
-        
-        logger.info(f"🎵 开始合成语音...")
-        
-        # 生成语音
-        out = io.BytesIO()
-        model.tts_to_file(
-            req.text,
-            sid,
-            out,
-            format='wav',
-            speed=req.speed or 1.0
-        )
-        audio_data = out.getvalue()
+        sid = resolve_speaker(model, lang, req.speaker)
+        REQUESTS.inc((lang, str(sid)))
+        
+        extension = FORMAT_EXTENSIONS[output.name] if transcoded else 'wav'
+        headers = {
+            "Content-Disposition": f"attachment; filename=speech.{extension}",
+            "X-Language": lang,
+            "X-Speaker-ID": str(sid),
+            "Vary": "Accept"
+        }
+        if etag is not None:
+            headers["ETag"] = etag
+        if cancellation is not None:
+            headers[REQUEST_ID_HEADER] = cancellation.request_id
+        
+        # 先查预生成音频库和共享磁盘存储（转码结果单独存一份，命中时连 WAV 都不用读）
+        store_key = None
+        encoded_store_key = None
+        if _audio_store is not None or _audio_bank is not None:
+            store_key = melo_store_key(lang, sid, req.speed, req.text)
+            if transcoded:
+                encoded_store_key = melo_store_key(lang, sid, req.speed, req.text, output.cache_tag())
+                stored, source = get_stored(encoded_store_key)
+                CACHE_LOOKUPS.inc(('encoded', lang, source))
+                if stored is not None:
+                    logger.info(f"💾 命中{'音频库' if source == 'bank' else '磁盘缓存'}（{output.cache_tag()}）: {encoded_store_key[:12]}")
+                    if probe:
+                        return probe_response(headers, stored[0], stored[1]['mimetype'])
+                    return Response(content=stored[0], media_type=stored[1]['mimetype'], headers=headers)
+        
+        audio_data = None
+        if store_key is not None:
+            stored, source = get_stored(store_key)
+            CACHE_LOOKUPS.inc(('wav', lang, source))
+            if stored is not None:
+                logger.info(f"💾 命中{'音频库' if source == 'bank' else '磁盘缓存'}: {store_key[:12]}")
+                audio_data = stored[0]
+        
+        if probe:
+            # 转码结果没有存下来时即使有 WAV 也要重新转码，大小未知，按未命中回答
+            if audio_data is not None and not transcoded:
+                return probe_response(headers, audio_data, "audio/wav")
+            return probe_response(headers, None, None if transcoded else "audio/wav")
+        
+        def synthesize_wav():
+            logger.info(f"🎵 开始合成语音...")
+            
+            # 生成语音
+            out = io.BytesIO()
+            with synthesis_slot(schedule, cancellation):
+                model.tts_to_file(
+                    req.text,
+                    sid,
+                    out,
+                    format='wav',
+                    speed=req.speed or 1.0
+                )
+            wav = out.getvalue()
+            
+            logger.info(f"✅ 合成成功！音频大小: {len(wav)} 字节")
+            
+            if store_key is not None and _audio_store is not None:
+                _audio_store.put(store_key, wav, {'mimetype': 'audio/wav'})
+            return wav
+        
+        if audio_data is None:
+            if _single_flight is not None:
+                # 同一句话正在合成时直接等它的结果
+                flight_key = (melo_model_id(lang), sid, req.speed or 1.0, req.text.strip())
+                while audio_data is None:
+                    try:
+                        audio_data = _single_flight.do(flight_key, synthesize_wav)
+                    except HTTPException as e:
+                        # 等的那次合成被它自己的请求取消了：本请求没有取消时重新合成
+                        if e.status_code not in CANCELLED_STATUS or cancellation is None or cancellation.reason:
+                            raise
+            else:
+                audio_data = synthesize_wav()
         
-        logger.info(f"✅ 合成成功！音频大小: {len(audio_data)} 字节")
+        media_type = "audio/wav"
+        if transcoded:
+            encode_started = time.perf_counter()
+            pcm, audio_format = tts_audio_formats.wav_to_pcm(audio_data)
+            audio_data, media_type = tts_audio_formats.encode_pcm(pcm, *audio_format, output)
+            ENCODE_SECONDS.observe(time.perf_counter() - encode_started, (output.cache_tag(),))
+            logger.info(f"🔁 转码为 {output.cache_tag()}: {len(audio_data)} 字节")
+            if encoded_store_key is not None and _audio_store is not None:
+                _audio_store.put(encoded_store_key, audio_data, {'mimetype': media_type})
         
         return Response(
             content=audio_data,
-            media_type="audio/wav",
-            headers={
-                "Content-Disposition": "attachment; filename=speech.wav",
-                "X-Language": lang,
-                "X-Speaker-ID": str(sid)
-            }
+            media_type=media_type,
+            headers=headers
         )
         
     except HTTPException:
@@ -170,12 +669,219 @@ def tts(req: TTSRequest):
         logger.error(f"❌ TTS 合成失败: {e}")
         traceback.print_exc()
         raise HTTPException(500, f"TTS 失败: {str(e)}")
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, (lang,))
+        with _inflight_lock:
+            _inflight -= 1
+        if registered is not None:
+            with _active_requests_lock:
+                if _active_requests.get(registered.request_id) is registered:
+                    del _active_requests[registered.request_id]
+
+@app.websocket("/tts/ws")
+async def tts_ws(websocket: WebSocket):
+    """边收文本边合成：客户端推送大模型流式输出的文本片段，服务端每凑齐一个子句就合成并推回音频
+
+    消息协议与 Piper 服务的 /api/tts/ws 相同：
+        客户端：{"type": "start", "lang": ..., "speaker": ..., "speed": ..., ...}（可选，参数与 /tts 相同，
+                也可以放在连接URL的查询参数里）、{"type": "text", "text": "片段"}、{"type": "flush"}、{"type": "end"}
+        服务端：每个子句发 {"type": "clause", "index", "text", "content_type"}、二进制音频帧（audio/L16）、
+                {"type": "clause_end", "index", "bytes"}；子句失败发 {"type": "error", "index", "error", "status"}；
+                全部发完发 {"type": "done", "clauses"}，被取消时发 {"type": "cancelled", "reason"}
+    Melo 按整句推理，每个子句合成完后一次发出。连接断开或 DELETE /tts/{id} 取消时停止合成。
+    """
+    import asyncio
+    import json
+    from starlette.concurrency import run_in_threadpool
+
+    await websocket.accept()
+    if ClauseSplitter is None:
+        await websocket.send_json({"type": "error", "error": "服务端未安装 tts_clauses", "status": 503})
+        await websocket.close(code=1011)
+        return
+    options = {key: value for key, value in websocket.query_params.items() if key != 'id'}
+    output_format = 'l16' if tts_audio_formats is not None else 'wav'
+    cancellation = None
+    splitter = ClauseSplitter()
+    clauses = asyncio.Queue()
+    if _synthesis_gate is not None:
+        cancellation = Cancellation(
+            websocket.headers.get(REQUEST_ID_HEADER) or websocket.query_params.get('id') or uuid.uuid4().hex
+        )
+        with _active_requests_lock:
+            _active_requests[cancellation.request_id] = cancellation
+        loop = asyncio.get_running_loop()
+        # 取消时唤醒正在等下一个子句的合成任务（DELETE 在线程池中执行）
+        cancellation.on_cancel(lambda: loop.call_soon_threadsafe(clauses.put_nowait, None))
+    synthesizing = False  # 正在合成的子句被取消时已由 synthesis_slot 计入 tts_cancelled_total
+
+    def clause_request(text):
+        return TTSRequest(**dict(options, text=text, format=output_format))
+
+    async def synthesize_clauses():
+        nonlocal synthesizing
+        index = 0
+        while True:
+            text = await clauses.get()
+            if cancellation is not None and cancellation.reason:
+                CANCELLED.inc((cancellation.reason,))
+                cancellation.check()
+            if text is None:
+                return index
+            try:
+                synthesizing = True
+                response = await run_in_threadpool(render_tts, clause_request(text), {}, cancellation)
+            except HTTPException as e:
+                if e.status_code in CANCELLED_STATUS and cancellation is not None and cancellation.reason:
+                    raise Cancelled(cancellation.reason)
+                await websocket.send_json({"type": "error", "index": index, "error": e.detail, "status": e.status_code})
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "index": index, "error": str(e), "status": 400})
+            else:
+                await websocket.send_json(
+                    {"type": "clause", "index": index, "text": text, "content_type": response.media_type}
+                )
+                await websocket.send_bytes(response.body)
+                await websocket.send_json({"type": "clause_end", "index": index, "bytes": len(response.body)})
+            finally:
+                synthesizing = False
+            index += 1
+
+    synthesizer = asyncio.ensure_future(synthesize_clauses())
+    receiver = None
+    try:
+        while True:
+            receiver = asyncio.ensure_future(websocket.receive_text())
+            await asyncio.wait({receiver, synthesizer}, return_when=asyncio.FIRST_COMPLETED)
+            if not receiver.done():
+                # 合成提前结束：被取消（DELETE）或发送失败
+                receiver.cancel()
+                synthesizer.result()
+            try:
+                message = json.loads(receiver.result())
+            except ValueError:
+                message = None
+            kind = message.get('type', 'text') if isinstance(message, dict) else None
+            if kind == 'start':
+                options.update({key: value for key, value in message.items() if key != 'type'})
+                try:
+                    req = clause_request('.')
+                    negotiate_output(req, None)
+                    if _synthesis_gate is not None:
+                        make_schedule(req.priority, req.room, req.role, req.text, None)
+                except (ValueError, HTTPException) as e:
+                    error = e.detail if isinstance(e, HTTPException) else str(e)
+                    await websocket.send_json({"type": "error", "error": error, "status": 400})
+                    await websocket.close(code=1008)
+                    return
+            elif kind == 'text':
+                for clause in splitter.push(str(message.get('text') or '')):
+                    clauses.put_nowait(clause)
+            elif kind in ('flush', 'end'):
+                for clause in splitter.finish():
+                    clauses.put_nowait(clause)
+                if kind == 'end':
+                    clauses.put_nowait(None)
+                    break
+            else:
+                error = '消息必须是 JSON 对象' if kind is None else f'未知的消息类型: {kind}'
+                await websocket.send_json({"type": "error", "error": error, "status": 400})
+        count = await synthesizer
+        await websocket.send_json({"type": "done", "clauses": count})
+        await websocket.close()
+    except WebSocketDisconnect:
+        # 没有发 end 就断开：停止还没合成完的子句
+        if cancellation is not None:
+            if not synthesizing:
+                CANCELLED.inc(('disconnected',))
+            cancellation.cancel('disconnected')
+    except Cancelled as e:
+        await websocket.send_json({"type": "cancelled", "reason": e.reason})
+        await websocket.close()
+    finally:
+        synthesizer.cancel()
+        if receiver is not None:
+            receiver.cancel()
+        if cancellation is not None:
+            with _active_requests_lock:
+                if _active_requests.get(cancellation.request_id) is cancellation:
+                    del _active_requests[cancellation.request_id]
+
+@app.delete("/tts/{request_id}")
+def cancel_tts(request_id: str):
+    """取消正在处理的合成请求（排队中的直接撤下，合成中的在下一句之前停止）"""
+    with _active_requests_lock:
+        cancellation = _active_requests.get(request_id)
+    if cancellation is None:
+        raise HTTPException(404, f"没有正在处理的请求 {request_id}")
+    cancellation.cancel()
+    return {"id": request_id, "cancelled": True}
+
+def render_bank_item(item):
+    """构建音频库时在工作进程中合成一条（不经过缓存和合成名额），返回 [(存储键, WAV, 元数据)]"""
+    lang = LANGUAGE_MAP.get(item.get('lang', 'ZH'), 'ZH')
+    model = get_tts_model(lang)
+    sid = resolve_speaker(model, lang, item.get('speaker'))
+    text = item['text'].strip()
+    out = io.BytesIO()
+    model.tts_to_file(text, sid, out, format='wav', speed=1.0)
+    meta = {'mimetype': 'audio/wav', 'sample_rate': model.hps.data.sampling_rate, 'text': text, 'lang': lang}
+    if item.get('speaker'):
+        meta['speaker'] = item['speaker']
+    return [(melo_store_key(lang, sid, 1.0, text), out.getvalue(), meta)]
+
+def _init_bank_worker():
+    # 每个进程单线程推理，避免多个进程争抢 CPU；逐句的日志只保留警告
+    logger.setLevel(logging.WARNING)
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+def build_audio_bank(path: str, voice_specs, workers: int) -> int:
+    """用进程池合成固定台词并写入音频库文件，返回退出码"""
+    items = []
+    texts = fixed_vocabulary()
+    for spec in voice_specs:
+        lang, _, speaker = spec.partition(':')
+        items.extend({'text': text, 'lang': lang, 'speaker': speaker or None} for text in texts)
+    logger.info(f"📦 构建音频库: {len(items)} 条，{workers} 个进程 -> {path}")
+    started = time.monotonic()
+    
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            logger.info(f"📦 {done}/{total}")
+    
+    count, failed = build_bank(path, items, render_bank_item, workers, 'melo', progress, _init_bank_worker)
+    for item, error in failed:
+        logger.warning(f"⚠️  合成失败: {item['text']}: {error}")
+    logger.info(f"✅ 音频库已生成: {count} 条，耗时 {time.monotonic() - started:.1f} 秒")
+    return 1 if failed else 0
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="MeLo TTS API 服务器 - 多语言版本")
+    parser.add_argument(
+        "--build-audio-bank", metavar="PATH",
+        help="不启动服务，把固定台词（i18n 文案、COMMON_GAME_PHRASES、预热清单）合成为预生成音频库后退出"
+    )
+    parser.add_argument(
+        "--bank-voice", action="append", default=None,
+        help="音频库包含的语言和说话人：ZH 或 ZH:说话人（可多次指定，默认 ZH）"
+    )
+    parser.add_argument("--bank-workers", type=int, default=2, help="构建音频库的进程数（默认 2，每个进程各加载一份模型）")
+    args = parser.parse_args()
+    if args.build_audio_bank:
+        sys.exit(build_audio_bank(args.build_audio_bank, args.bank_voice or ["ZH"], args.bank_workers))
+    
     logger.info("=" * 70)
     logger.info("🎤 MeLo TTS API 服务器 - 多语言版本")
     logger.info("=" * 70)
     logger.info("📡 监听: http://0.0.0.0:7860")
+    logger.info("🔌 流式文本合成: ws://0.0.0.0:7860/tts/ws")
+    logger.info("📦 预生成音频库: http://0.0.0.0:7860/audio-bank  /audio-bank/index")
     logger.info("🌍 支持语言: ZH (中文), EN (英语), JP (日语), KR (韩语), ES (西语), FR (法语)")
     logger.info("=" * 70)
     
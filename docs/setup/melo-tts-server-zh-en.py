@@ -12,16 +12,54 @@ from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict
-import uvicorn, logging, io, traceback
+import uvicorn, logging, io, os, sys, threading, time, traceback, wave
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 与 Piper 服务共用的指标模块（scripts/tts_metrics.py），部署到其他机器时放在本文件同目录
+# 或用 TTS_SHARED_MODULES_DIR 指定所在目录
+sys.path.insert(0, os.environ.get('TTS_SHARED_MODULES_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+try:
+    import tts_metrics
+except ImportError as e:
+    logger.warning(f"⚠️  指标模块不可用，/metrics 将返回 503: {e}")
+    tts_metrics = None
+
 app = FastAPI(title="Melo TTS API Server - ZH/EN")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 # 双语模型缓存
 _tts_models: Dict[str, any] = {}
+_inflight = 0  # 正在合成的请求数
+_inflight_lock = threading.Lock()
+
+class _NoMetric:
+    """tts_metrics 不可用时的占位：所有记录操作都是空操作"""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def _threadpool_waiting():
+    """等待线程池空位的请求数（/tts 是普通函数，由 anyio 线程池执行；只能在事件循环线程中调用）"""
+    import anyio.to_thread
+    return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+# 指标（GET /metrics，Prometheus 文本格式，见 scripts/tts_metrics.py）
+# tts_to_file() 内部不区分文本处理和推理，这里只能整体计时
+if tts_metrics is not None:
+    REQUESTS = tts_metrics.Counter('tts_requests_total', '合成请求数', ('language', 'speaker'))
+    INFLIGHT = tts_metrics.Gauge('tts_inflight_requests', '正在处理的合成请求数', function=lambda: _inflight)
+    QUEUE_DEPTH = tts_metrics.Gauge('tts_queue_depth', '等待线程池空位的请求数', function=_threadpool_waiting)
+    INFERENCE_SECONDS = tts_metrics.Histogram('tts_inference_seconds', '合成耗时（含文本处理）', ('language',))
+    REAL_TIME_FACTOR = tts_metrics.Histogram(
+        'tts_real_time_factor', '合成耗时 / 生成的音频时长', ('language',), buckets=tts_metrics.RTF_BUCKETS
+    )
+    REQUEST_SECONDS = tts_metrics.Histogram('tts_request_duration_seconds', '请求总耗时', ('language',))
+    MODEL_LOAD_SECONDS = tts_metrics.Gauge('tts_model_load_seconds', '最近一次加载该语言模型的耗时', ('language',))
+else:
+    REQUESTS = INFERENCE_SECONDS = REAL_TIME_FACTOR = REQUEST_SECONDS = MODEL_LOAD_SECONDS = _NoMetric()
 
 def get_tts_model(language: str = 'ZH'):
     """获取或加载 TTS 模型（仅支持 ZH 和 EN）"""
@@ -38,7 +76,9 @@ def get_tts_model(language: str = 'ZH'):
         try:
             from melo.api import TTS
             logger.info(f"🔄 加载 {lang} 语言模型...")
+            started = time.perf_counter()
             _tts_models[lang] = TTS(language=lang, device='auto')
+            MODEL_LOAD_SECONDS.set(round(time.perf_counter() - started, 3), (lang,))
             logger.info(f"✅ {lang} 模型加载完成")
             
             spk2id = _tts_models[lang].hps.data.spk2id
@@ -86,8 +126,28 @@ def list_languages():
         ]
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标（只读内存中的计数，不触发模型加载）"""
+    if tts_metrics is None:
+        raise HTTPException(503, "服务端未安装 tts_metrics")
+    return Response(content=tts_metrics.REGISTRY.render(), media_type=tts_metrics.CONTENT_TYPE)
+
+def wav_duration(audio_data: bytes) -> float:
+    """WAV 数据的时长（秒），无法解析时返回 0"""
+    try:
+        with wave.open(io.BytesIO(audio_data), 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    except Exception:
+        return 0.0
+
 @app.post("/tts")
 def tts(req: TTSRequest):
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+    started = time.perf_counter()
+    lang = 'ZH'
     try:
         logger.info(f"📝 收到请求 - 文本: '{req.text[:50]}...', 语言: {req.lang}")
         
@@ -115,8 +175,10 @@ def tts(req: TTSRequest):
         
         logger.info(f"🎤 使用 {lang} 说话人 (ID: {sid})")
         logger.info(f"🎵 开始合成...")
+        REQUESTS.inc((lang, str(sid)))
         
         # 生成语音
+        synth_started = time.perf_counter()
         out = io.BytesIO()
         model.tts_to_file(
             req.text,
@@ -126,6 +188,11 @@ def tts(req: TTSRequest):
             speed=req.speed or 1.0
         )
         audio_data = out.getvalue()
+        elapsed = time.perf_counter() - synth_started
+        INFERENCE_SECONDS.observe(elapsed, (lang,))
+        duration = wav_duration(audio_data)
+        if duration > 0:
+            REAL_TIME_FACTOR.observe(elapsed / duration, (lang,))
         
         logger.info(f"✅ 合成成功！大小: {len(audio_data)} 字节")
         
@@ -144,6 +211,10 @@ def tts(req: TTSRequest):
         logger.error(f"❌ TTS 失败: {e}")
         traceback.print_exc()
         raise HTTPException(500, str(e))
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, (lang,))
+        with _inflight_lock:
+            _inflight -= 1
 
 if __name__ == "__main__":
     logger.info("=" * 60)
@@ -152,6 +223,7 @@ if __name__ == "__main__":
     logger.info("📡 监听: http://0.0.0.0:7860")
     logger.info("🇨🇳 支持中文（ZH）")
     logger.info("🇺🇸 支持英文（EN）")
+    logger.info("📊 指标: http://0.0.0.0:7860/metrics")
     logger.info("=" * 60)
     
     uvicorn.run(app, host="0.0.0.0", port=7860, log_level="info")
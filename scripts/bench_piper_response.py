@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 服务响应路径的内存复制基准
+
+不加载模型：用预先生成好的 PCM 片段代替 Piper 的合成结果，只测量从合成结果到
+WSGI 服务器拿到响应字节这一段（收集片段、写缓存、拼 WAV、生成响应体）。
+每个请求测量 tracemalloc 的峰值增量，换算成 "相当于多少份 PCM"：
+0 表示整条路径没有复制 PCM，1 表示完整复制了一次，以此类推。
+
+使用方法：
+    python scripts/bench_piper_response.py
+    python scripts/bench_piper_response.py --sentences 6 --seconds 3 --requests 50
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'piper-tts-server.py')
+
+
+class BenchChunk:
+    """与 piper.AudioChunk 相同的字段，PCM 预先生成"""
+
+    def __init__(self, pcm, sample_rate):
+        self.audio_int16_bytes = pcm
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.sample_channels = 1
+
+
+class BenchVoice:
+    """每次 synthesize() 都返回同一组预先生成的片段，不产生新的 PCM 分配"""
+
+    def __init__(self, sentences, seconds, sample_rate=22050):
+        self.chunks = [
+            BenchChunk(bytes([i + 1]) * (int(seconds * sample_rate) * 2), sample_rate)
+            for i in range(sentences)
+        ]
+        self.pcm_bytes = sum(len(chunk.audio_int16_bytes) for chunk in self.chunks)
+
+    def synthesize(self, text, syn_config=None):
+        return iter(self.chunks)
+
+
+def load_server():
+    # 基准只测内存缓存，不写磁盘存储
+    os.environ.setdefault('TTS_AUDIO_STORE_MB', '0')
+    spec = importlib.util.spec_from_file_location('piper_tts_server', SERVER_PATH)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    return server
+
+
+def run_request(server, path, body):
+    """直接调用 WSGI 应用并读完响应体（不保留响应数据），返回响应字节数"""
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(path=path, method='POST', json=body).get_environ()
+    status = []
+    app_iter = server.app.wsgi_app(environ, lambda s, headers, exc_info=None: status.append(s))
+    size = 0
+    try:
+        for data in app_iter:
+            if not isinstance(data, bytes):
+                raise TypeError(f'WSGI 响应体必须是 bytes，实际是 {type(data).__name__}')
+            size += len(data)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    if not status or not status[0].startswith('200'):
+        raise RuntimeError(f'请求失败: {status}')
+    return size
+
+
+def measure(server, voice, name, path, body, requests, clear_cache):
+    peaks = []
+    durations = []
+    for _ in range(requests):
+        if clear_cache:
+            server.audio_cache = server.AudioCache(server.AUDIO_CACHE_MAX_BYTES)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        size = run_request(server, path, body)
+        durations.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+
+    peaks.sort()
+    durations.sort()
+    median_peak = peaks[len(peaks) // 2]
+    print(f'响应 {size:>9d} 字节  峰值增量 {median_peak:>9d} 字节 '
+          f'≈ {median_peak / voice.pcm_bytes:4.2f} 份PCM  '
+          f'耗时中位数 {durations[len(durations) // 2] * 1000:6.2f} ms  {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Piper 服务响应路径内存复制基准')
+    parser.add_argument('--sentences', type=int, default=3, help='每条请求的句子（PCM 片段）数')
+    parser.add_argument('--seconds', type=float, default=2.0, help='每句音频时长（秒）')
+    parser.add_argument('--requests', type=int, default=20, help='每种场景的请求数')
+    args = parser.parse_args()
+
+    server = load_server()
+    voice = BenchVoice(args.sentences, args.seconds)
+    model = types.SimpleNamespace(name='bench.onnx', path='bench.onnx', sha256='bench', language='zh_CN')
+    server.resolve_model = lambda gender='female', index=None: model
+    server.voices[model.sha256] = voice
+    print(f'PCM: {args.sentences} 段 × {args.seconds} 秒 = {voice.pcm_bytes} 字节')
+
+    tracemalloc.start()
+    body = {'text': '基准测试。'}
+    measure(server, voice, '未命中', '/api/tts', body, args.requests, clear_cache=True)
+    run_request(server, '/api/tts', body)
+    measure(server, voice, '命中缓存', '/api/tts', body, args.requests, clear_cache=False)
+    measure(server, voice, '流式', '/api/tts?stream=1', body, args.requests, clear_cache=True)
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
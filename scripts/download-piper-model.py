@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import requests
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 def download_file(url, output_path):
     print(f'正在下载: {url}')
@@ -50,3 +53,24 @@ for filename, url in models_to_try:
 print('=' * 60)
 print('下载完成！')
 print('=' * 60)
+
+# 转换为 ORT 格式，Piper 服务启动和多进程模式下创建会话时可跳过图优化
+# （piper_ort_format 在转换时才导入 onnxruntime，这里先确认它已安装，否则每个模型都会报转换失败）
+try:
+    import onnxruntime
+    import piper_ort_format
+except ImportError as e:
+    print(f' 跳过 ORT 格式转换（{e}），安装 onnxruntime 后可运行: python scripts/piper_ort_format.py')
+else:
+    print('正在转换为 ORT 格式...')
+    piper_ort_format.main([])
+
+# 预编译游戏词表（i18n 文案、预热清单、南昌话词表的音素），服务加载模型时读入，常用台词不再做音素化
+try:
+    import piper
+    import piper_lexicon
+except ImportError as e:
+    print(f' 跳过词表预编译（{e}），可稍后运行: python scripts/piper_lexicon.py')
+else:
+    print('正在预编译游戏词表...')
+    piper_lexicon.main([])
@@ -14,143 +14,359 @@ Piper TTS HTTP 服务
     http://localhost:5000
 """
 
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
-import io
+from collections import OrderedDict
 import os
 import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tts_audio_store import AudioStore, etag_matches, file_sha256, open_default_store, weak_etag
+from tts_audio_bank import build_bank, byte_range, fixed_vocabulary, open_default_bank
+from piper_cli_pool import PiperProcessPool
+from piper_model_registry import ModelRegistry
+from piper_lexicon import PhonemeCache, cached_phonemes, load_lexicon, phonemize_entry, split_sentences
+from piper_batching import MicroBatcher, has_durations
+from tts_clauses import ClauseSplitter
+from tts_singleflight import SingleFlight
+from tts_scheduler import (
+    Cancellation, Cancelled, FairExecutor, Rejected, PRIORITY_NAMES,
+    make_schedule, parse_deadline_ms, stale_seconds_from_env
+)
+import piper_ort_tuning
+import piper_ort_format
+import tts_audio_formats
+import tts_metrics
+from tts_audio_formats import wav_header
 
 app = Flask(__name__)
-CORS(app)  # 允许跨域请求
+CORS(app, expose_headers=['X-Request-Id', 'ETag', 'X-TTS-Cache'])  # 允许跨域请求（前端可读取请求ID用于取消）
 
 # 全局变量
-voices = {}  # 缓存多个模型：{'male': voice, 'female': voice}
-MODEL_PATHS = {}  # 缓存模型路径：{'male': path, 'female': path}
+voices = {}  # 已加载的模型：{模型文件哈希: voice}，同一文件只加载一次
+_voices_lock = threading.Lock()
+
+# 模型搜索目录（按优先级）和各声音的模型文件名优先级
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'models')
+MODEL_SEARCH_DIRS = [
+    MODEL_DIR,
+    os.path.expanduser('~/piper-models'),
+    os.path.join(os.getcwd(), 'models'),
+]
+MODEL_PREFERENCES = {
+    # 女声模型（xiaoyan 是女声）
+    'female': [
+        'zh_CN-huayan-medium.onnx',  # 优先使用已下载的模型
+        'xiaoyan-medium.onnx',
+        'zh_CN-xiaoyan-medium.onnx',
+    ],
+    # 男声模型（xiaoyi 是男声）
+    'male': [
+        'zh_CN-xiaoyi-medium.onnx',
+        'xiaoyi-medium.onnx',
+        'zh_CN-huayan-medium.onnx',  # 备用
+        'xiaoyan-medium.onnx',  # 如果男声模型不存在，使用女声作为备用
+    ],
+}
+model_registry = ModelRegistry(MODEL_SEARCH_DIRS)
+# 模型目录轮询间隔（秒），发现新增/修改的模型后在后台加载并切换，0 表示关闭
+MODEL_POLL_SECONDS = float(os.environ.get('PIPER_TTS_MODEL_POLL_SECONDS', '5'))
+
+# 每个模型的音素缓存条目数（规范化文本 -> 各句音素和音素ID），0 表示只用预编译词表
+PHONEME_CACHE_ENTRIES = int(os.environ.get('PIPER_TTS_PHONEME_CACHE_ENTRIES', '4096'))
+
+# 推理动态微批处理（piper_batching.py）：同一会话上并发的句子在窗口内凑成一批推理，
+# 窗口随负载在 0 到 PIPER_TTS_MICROBATCH_MS 之间自适应，0 表示关闭（默认关闭，需要模型带时长输出）
+MICROBATCH_MAX_WINDOW = float(os.environ.get('PIPER_TTS_MICROBATCH_MS', '0')) / 1000
+MICROBATCH_MAX_SIZE = int(os.environ.get('PIPER_TTS_MICROBATCH_MAX', '8'))
+MICROBATCH_LENGTH_RATIO = float(os.environ.get('PIPER_TTS_MICROBATCH_LENGTH_RATIO', '1.5'))
+MICROBATCH_WORKERS = int(os.environ.get('PIPER_TTS_MICROBATCH_WORKERS', '2'))
+MICROBATCH_ENABLED = MICROBATCH_MAX_WINDOW > 0 and MICROBATCH_MAX_SIZE > 1
+
+# 服务端音频缓存上限（PCM字节数），可用环境变量 PIPER_TTS_CACHE_MB 调整，0 表示关闭
+AUDIO_CACHE_MAX_BYTES = int(float(os.environ.get('PIPER_TTS_CACHE_MB', '64')) * 1024 * 1024)
+# 转码后（L16/降采样/ADPCM/Opus）的音频缓存上限，可用环境变量 PIPER_TTS_ENCODED_CACHE_MB 调整
+ENCODED_CACHE_MAX_BYTES = int(float(os.environ.get('PIPER_TTS_ENCODED_CACHE_MB', '16')) * 1024 * 1024)
+
+# 磁盘音频存储默认目录（与 Melo 服务共享，可用 TTS_AUDIO_STORE_DIR / TTS_AUDIO_STORE_MB 调整）
+AUDIO_STORE_DEFAULT_DIR = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'audio-store')
+_audio_store = None
+_audio_store_lock = threading.Lock()
+
+# 预生成音频库（scripts/tts_audio_bank.py，--build-audio-bank 构建），可用 TTS_AUDIO_BANK 指定其他文件
+AUDIO_BANK_DEFAULT_PATH = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'audio-bank.bin')
+_audio_bank = None
+
+# ONNX Runtime 会话参数自动校准：'auto' 每台主机每个模型校准一次并保存，'recalibrate' 强制重新校准，'off' 关闭
+ORT_TUNING = os.environ.get('PIPER_TTS_ORT_TUNING', 'off')
+ORT_PROFILES_PATH = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'ort-calibration.json')
+_recalibrated = set()  # 本进程已重新校准过的模型哈希
+# 创建会话时默认使用的会话配置（返回 SessionOptions 的函数）；多进程模式下为 fork_safe_session_options，
+# 热更新和按需加载的模型也按每个工作进程单线程推理，不会各自占满所有核
+DEFAULT_SESSION_OPTIONS = None
+
+# piper 命令行模式下每个模型常驻的进程数，可用环境变量 PIPER_CLI_WORKERS 调整
+PIPER_CLI_WORKERS = int(os.environ.get('PIPER_CLI_WORKERS', min(4, os.cpu_count() or 1)))
+cli_pools = {}  # {(piper命令, 模型路径, 合成参数): PiperProcessPool}
+_cli_pools_lock = threading.Lock()
+
+# 客户端可以调整的合成参数（对应 piper.SynthesisConfig 字段）
+# 多说话人模型的 speaker_id 不在其中：由请求的 speaker 字段按模型的 speaker_id_map 换算后加入合成参数
+SYNTHESIS_PARAMS = ('length_scale', 'noise_scale', 'noise_w_scale', 'volume')
+
+# 批量合成接口单次最多的条目数，以及 Flask 模式下批量合成的并行线程数
+BATCH_MAX_ITEMS = int(os.environ.get('PIPER_TTS_BATCH_MAX_ITEMS', '200'))
+BATCH_THREADS = int(os.environ.get('PIPER_TTS_BATCH_THREADS', os.cpu_count() or 1))
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+# 长文本按句并行合成：文本字数达到 PIPER_TTS_LONG_TEXT_CHARS 且不止一句时，各句分给线程池同时合成，
+# 按原顺序拼接；句间可插入静音（PIPER_TTS_SENTENCE_GAP_MS）或交叉淡化（PIPER_TTS_CROSSFADE_MS）
+LONG_TEXT_CHARS = int(os.environ.get('PIPER_TTS_LONG_TEXT_CHARS', '40'))
+SENTENCE_THREADS = int(os.environ.get('PIPER_TTS_SENTENCE_THREADS', os.cpu_count() or 1))
+SENTENCE_GAP_MS = float(os.environ.get('PIPER_TTS_SENTENCE_GAP_MS', '0'))
+SENTENCE_CROSSFADE_MS = float(os.environ.get('PIPER_TTS_CROSSFADE_MS', '0'))
+_sentence_executor = None
+_sentence_executor_lock = threading.Lock()
+
+# 启动预热状态（/readyz 在预热完成前返回 503）
+warmup_state = {'total': 0, 'done': 0, 'failed': 0, 'finished': True, 'seconds': None}
 
-def find_model_path(gender='female'):
-    """查找可用的模型文件
+# 启动时后台加载模型的状态（/readyz 在模型加载完成前返回 503）
+# models: {声音: 'pending' | 'loading' | 'loaded' | 'failed'}
+loader_state = {'models': {}, 'errors': {}, 'finished': False, 'seconds': None}
+
+# 请求ID与截止时间（剩余毫秒数）请求头；没有请求ID时服务端生成一个，随响应头返回
+REQUEST_ID_HEADER = 'X-Request-Id'
+DEADLINE_HEADER = 'X-TTS-Deadline-Ms'
+# HEAD 探测的响应头：服务端是否已有这段音频（hit / miss），命中时不需要合成
+CACHE_STATUS_HEADER = 'X-TTS-Cache'
+
+# 正在处理的合成请求：{请求ID: Cancellation}，DELETE /api/tts/<id> 按ID取消
+# （prefork 模式下每个工作进程各有一份，只能取消本进程正在处理的请求）
+active_requests = {}
+active_requests_lock = threading.Lock()
+
+# 指标（GET /metrics，Prometheus 文本格式，见 tts_metrics.py）
+REQUESTS = tts_metrics.Counter('tts_requests_total', '合成请求数（缓存命中也计入）', ('endpoint', 'voice', 'language'))
+CACHE_LOOKUPS = tts_metrics.Counter(
+    'tts_cache_lookups_total', '缓存查询次数（cache: pcm/encoded，result: memory/bank/disk/miss）',
+    ('cache', 'voice', 'language', 'result')
+)
+INFLIGHT = tts_metrics.Gauge('tts_inflight_requests', '正在处理的合成请求数')
+QUEUE_DEPTH = tts_metrics.Gauge(
+    'tts_queue_depth', 'ASGI 合成队列中排队等待的请求数',
+    function=lambda: synthesis_queue.queued if synthesis_queue is not None else 0
+)
+QUEUE_RUNNING = tts_metrics.Gauge(
+    'tts_queue_running', 'ASGI 合成线程池中正在执行的任务数',
+    function=lambda: synthesis_queue.running if synthesis_queue is not None else 0
+)
+QUEUE_WAIT_SECONDS = tts_metrics.Histogram('tts_queue_wait_seconds', '在 ASGI 合成队列中的排队时间', ('priority',))
+QUEUE_REJECTED = tts_metrics.Counter(
+    'tts_queue_rejected_total', 'ASGI 合成队列拒绝的任务数（reason: full/preempted/stale）', ('reason', 'priority')
+)
+PHONEMIZE_SECONDS = tts_metrics.Histogram('tts_phonemize_seconds', '文本转音素耗时（每次调用）', ('model',))
+INFERENCE_SECONDS = tts_metrics.Histogram('tts_inference_seconds', '模型推理耗时（每句）', ('model',))
+REAL_TIME_FACTOR = tts_metrics.Histogram(
+    'tts_real_time_factor', '推理耗时 / 生成的音频时长（每句）', ('model',), buckets=tts_metrics.RTF_BUCKETS
+)
+ENCODE_SECONDS = tts_metrics.Histogram('tts_encode_seconds', 'PCM 转码为输出格式的耗时', ('format',))
+REQUEST_SECONDS = tts_metrics.Histogram(
+    'tts_request_duration_seconds', '请求总耗时（流式响应算到最后一段发出）', ('endpoint',)
+)
+PHONEME_CACHE_LOOKUPS = tts_metrics.Counter(
+    'tts_phoneme_cache_lookups_total', '音素缓存查询次数（result: lexicon/memory/miss）', ('model', 'result')
+)
+INFERENCE_BATCH_SIZE = tts_metrics.Histogram(
+    'tts_inference_batch_size', '每次推理的句数（微批处理）', ('model',), buckets=(1, 2, 3, 4, 6, 8, 12, 16)
+)
+MODEL_LOAD_SECONDS = tts_metrics.Gauge('tts_model_load_seconds', '最近一次加载该模型的耗时', ('model',))
+CANCELLED = tts_metrics.Counter(
+    'tts_cancelled_total', '中途停止或撤出队列的合成请求数（reason: cancelled/disconnected/deadline）', ('reason',)
+)
+COALESCED_FOLLOWERS = tts_metrics.Counter(
+    'tts_coalesced_followers_total', '挂到进行中的相同合成上、没有重复合成的请求数'
+)
+
+# 合并进行中的相同合成（按PCM缓存键）：并发的相同请求只合成一次，见 tts_singleflight.py
+single_flight = SingleFlight(on_follow=COALESCED_FOLLOWERS.inc)
+COALESCED_IN_FLIGHT = tts_metrics.Gauge(
+    'tts_coalesced_in_flight', '正在进行、可被相同请求合并的合成数', function=lambda: len(single_flight)
+)
+CONDITIONAL_RESPONSES = tts_metrics.Counter(
+    'tts_conditional_responses_total', '条件请求和探测（result: not_modified/probe_hit/probe_miss）', ('result',)
+)
+
+def parse_bool(value):
+    """解析请求中的布尔参数（JSON布尔值或 '1'/'true'/'yes' 字符串）"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+def resolve_model(gender='female', index=None, speaker=None):
+    """从模型索引中选出该声音使用的模型，找不到时用另一种声音的模型作为备用
     Args:
         gender: 'male' 或 'female'，用于选择不同的模型
+        index: 指定的模型索引（默认使用当前索引）
+        speaker: 说话人名称（可选）；该声音的模型里没有这个说话人时，改用索引中含有它的多说话人模型
+    Returns:
+        ModelInfo 或 None
     """
-    model_dir = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'models')
+    fallback = 'female' if gender == 'male' else 'male'
+    model = (model_registry.find(MODEL_PREFERENCES.get(gender, MODEL_PREFERENCES['female']), index)
+             or model_registry.find(MODEL_PREFERENCES[fallback], index))
+    if isinstance(speaker, str) and (model is None or speaker not in model.speaker_id_map):
+        index = model_registry.index if index is None else index
+        for candidate in index.values():
+            if speaker in candidate.speaker_id_map:
+                return candidate
+    return model
+
+def speaker_id_for(model, speaker):
+    """把请求中的 speaker（说话人名称或编号）换算为模型的 speaker_id，不指定时返回 None
     
-    # 根据性别选择模型列表
-    if gender == 'male':
-        # 男声模型（xiaoyi 是男声）
-        possible_models = [
-            'zh_CN-xiaoyi-medium.onnx',
-            'xiaoyi-medium.onnx',
-            'zh_CN-huayan-medium.onnx',  # 备用
-            'xiaoyan-medium.onnx',  # 如果男声模型不存在，使用女声作为备用
-        ]
-    else:
-        # 女声模型（xiaoyan 是女声）
-        possible_models = [
-            'zh_CN-huayan-medium.onnx',  # 优先使用已下载的模型
-            'xiaoyan-medium.onnx',
-            'zh_CN-xiaoyan-medium.onnx',
-        ]
+    单说话人模型忽略 speaker（与无效的 gender 一样退回默认声音）；
+    多说话人模型中不存在的名称或超出范围的编号抛出 ValueError。
+    """
+    if speaker is None or speaker == '' or model is None or model.num_speakers <= 1:
+        return None
+    if isinstance(speaker, str) and speaker in model.speaker_id_map:
+        return model.speaker_id_map[speaker]
+    try:
+        speaker_id = int(speaker)
+    except (TypeError, ValueError):
+        raise ValueError(f'模型 {model.name} 中没有说话人 {speaker}')
+    if isinstance(speaker, bool) or not 0 <= speaker_id < model.num_speakers:
+        raise ValueError(f'说话人编号 {speaker} 超出范围（模型 {model.name} 共 {model.num_speakers} 个说话人）')
+    return speaker_id
+
+class PCMData:
+    """一次合成的完整PCM，按合成顺序保存各段 bytes，不拼接
     
-    for model_name in possible_models:
-        model_path = os.path.join(model_dir, model_name)
-        if os.path.exists(model_path) and os.path.getsize(model_path) > 0:
-            return model_path
-    
-    # 尝试其他路径
-    if gender == 'male':
-        other_paths = [
-            os.path.expanduser('~/piper-models/xiaoyi-medium.onnx'),
-            os.path.join(os.getcwd(), 'models', 'xiaoyi-medium.onnx'),
-            os.path.expanduser('~/piper-models/xiaoyan-medium.onnx'),  # 备用
-        ]
-    else:
-        other_paths = [
-            os.path.expanduser('~/piper-models/xiaoyan-medium.onnx'),
-            os.path.join(os.getcwd(), 'models', 'xiaoyan-medium.onnx'),
-        ]
+    缓存、磁盘存储和响应共用同一组 bytes 对象：响应体是 (WAV头, 第1段, 第2段, ...)，
+    由服务器逐段写出（类似 writev），整个响应路径上PCM不再复制。
+    只有需要连续内存的地方（转码、base64）才调用 bytes() 拼接。
+    """
     
-    for path in other_paths:
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            return path
-    
-    return None
-
-def pcm_to_wav(pcm_data, sample_rate=22050, channels=1, sample_width=2):
-    """将PCM数据转换为WAV格式"""
-    import struct
-    
-    # WAV文件头
-    # RIFF header
-    wav_header = b'RIFF'
-    # 文件大小（稍后填充）
-    wav_header += struct.pack('<I', 0)
-    # WAVE标识
-    wav_header += b'WAVE'
-    
-    # fmt chunk
-    wav_header += b'fmt '
-    # fmt chunk大小
-    wav_header += struct.pack('<I', 16)
-    # 音频格式（1=PCM）
-    wav_header += struct.pack('<H', 1)
-    # 声道数
-    wav_header += struct.pack('<H', channels)
-    # 采样率
-    wav_header += struct.pack('<I', sample_rate)
-    # 字节率
-    byte_rate = sample_rate * channels * sample_width
-    wav_header += struct.pack('<I', byte_rate)
-    # 块对齐
-    block_align = channels * sample_width
-    wav_header += struct.pack('<H', block_align)
-    # 位深度
-    wav_header += struct.pack('<H', sample_width * 8)
-    
-    # data chunk
-    wav_header += b'data'
-    # data chunk大小
-    data_size = len(pcm_data)
-    wav_header += struct.pack('<I', data_size)
-    
-    # 更新文件大小（RIFF chunk大小 = 文件大小 - 8）
-    file_size = len(wav_header) + data_size - 8
-    wav_header = wav_header[:4] + struct.pack('<I', file_size) + wav_header[8:]
-    
-    # 合并WAV头和PCM数据
-    return wav_header + pcm_data
-
-def load_voice(gender='female'):
-    """加载Piper TTS模型
-    Args:
-        gender: 'male' 或 'female'，用于选择不同的模型
+    __slots__ = ('segments', 'nbytes')
+    
+    def __init__(self, segments):
+        self.segments = tuple(segments)
+        self.nbytes = sum(len(segment) for segment in self.segments)
+    
+    def __len__(self):
+        return self.nbytes
+    
+    def __bytes__(self):
+        return b''.join(self.segments)
+    
+    def wav_parts(self, sample_rate=22050, channels=1, sample_width=2):
+        """WAV响应体的各个部分：文件头 + PCM各段"""
+        return (wav_header(sample_rate, channels, sample_width, self.nbytes),) + self.segments
+
+def chunk_to_pcm(chunk):
+    """从Piper AudioChunk中取出int16 PCM字节"""
+    # AudioChunk对象有audio_int16_bytes属性，包含PCM音频数据
+    if hasattr(chunk, 'audio_int16_bytes'):
+        return chunk.audio_int16_bytes
+    if hasattr(chunk, 'audio_int16_array'):
+        # 如果是数组，转换为字节
+        return chunk.audio_int16_array.tobytes()
+    if isinstance(chunk, bytes):
+        return chunk
+    return bytes(chunk)
+
+def chunk_format(chunk):
+    """读取AudioChunk的音频参数：(采样率, 声道数, 采样宽度)"""
+    return (
+        getattr(chunk, 'sample_rate', 22050),
+        getattr(chunk, 'sample_channels', 1),
+        getattr(chunk, 'sample_width', 2),
+    )
+
+def fork_safe_session_options():
+    """多进程模式下主进程加载模型使用的ONNX Runtime会话配置
+    
+    ONNX Runtime 的线程池线程在 fork 后不会出现在子进程里，
+    因此主进程里的会话只用调用线程做推理（intra/inter-op 线程数为1、顺序执行），
+    fork 之后子进程可以直接使用，并以写时复制的方式共享模型权重。
+    进程数按CPU核数配置，总体仍能用满所有核。
+    """
+    import onnxruntime
+    
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    return options
+
+def create_piper_voice(model_path, session_options=None):
+    """用指定的ONNX Runtime会话配置创建PiperVoice（PiperVoice.load 不支持传入会话配置）
+    
+    同目录下有转换好的 ORT 格式模型（scripts/piper_ort_format.py）时优先使用，跳过图优化。
+    开启推理批处理时才给 .onnx 加上时长输出，否则按路径加载。
+    session_options 会被修改，每个会话需要单独创建一份。
     """
-    global voices, MODEL_PATHS
+    import json
+    import onnxruntime
+    from piper import PiperVoice
+    from piper.config import PiperConfig
     
-    # 如果已经加载过该性别的模型，直接返回
-    if gender in voices and voices[gender] is not None:
-        return voices[gender]
+    if session_options is None:
+        session_options = onnxruntime.SessionOptions()
+    with open(f'{model_path}.json', 'r', encoding='utf-8') as f:
+        config = PiperConfig.from_dict(json.load(f))
+    session = onnxruntime.InferenceSession(
+        piper_ort_format.session_model_source(model_path, session_options, durations=MICROBATCH_ENABLED),
+        sess_options=session_options,
+        providers=['CPUExecutionProvider']
+    )
+    return PiperVoice(session=session, config=config)
+
+def load_tuned_voice(model_path):
+    """按校准结果创建 TunedVoice（短文本/长文本各用一个会话）；未开启校准时返回 None
     
-    # 先查找模型路径
-    model_path = find_model_path(gender)
-    if not model_path:
-        # 如果找不到指定性别的模型，尝试使用另一个性别作为备用
-        fallback_gender = 'female' if gender == 'male' else 'male'
-        model_path = find_model_path(fallback_gender)
-        if not model_path:
-            raise FileNotFoundError(f'未找到Piper TTS模型文件（{gender}），请下载模型到 tts-services/models/ 目录')
-        print(f'[Piper TTS] ⚠️ 未找到{gender}模型，使用{fallback_gender}模型作为备用')
+    没有该主机、该模型的校准结果时先运行一次校准（耗时数十秒），结果保存到 ORT_PROFILES_PATH。
+    """
+    if ORT_TUNING == 'off':
+        return None
     
-    MODEL_PATHS[gender] = model_path
+    model_hash = file_sha256(model_path)
+    profile = piper_ort_tuning.load_profile(ORT_PROFILES_PATH, model_hash)
+    if profile is None or (ORT_TUNING == 'recalibrate' and model_hash not in _recalibrated):
+        print(f'[Piper TTS] ⏱️ 校准ONNX Runtime会话参数: {model_path}')
+        profile = piper_ort_tuning.calibrate(lambda options: create_piper_voice(model_path, options))
+        piper_ort_tuning.save_profile(ORT_PROFILES_PATH, model_hash, profile)
+        _recalibrated.add(model_hash)
     
+    print(f'[Piper TTS] ⚙️ 会话参数: 短文本 {profile["short"]}，长文本 {profile["long"]}')
+    return piper_ort_tuning.TunedVoice.from_profile(lambda options: create_piper_voice(model_path, options), profile)
+
+def create_voice(model, session_options=None):
+    """为模型文件创建 voice：优先使用 piper-tts Python 包，不可用时退回 piper 命令行工具
+    Args:
+        model: ModelInfo
+        session_options: ONNX Runtime会话配置（可选，默认使用校准结果或 PiperVoice.load 的配置）
+    """
+    model_path = model.path
     try:
         # 尝试使用piper-tts Python包
         try:
             from piper import PiperVoice
             
-            print(f'[Piper TTS] 加载{gender}模型: {model_path}')
-            voice = PiperVoice.load(model_path)
-            voices[gender] = voice
-            print(f'[Piper TTS] ✅ {gender}模型加载成功')
+            if session_options is not None:
+                voice = create_piper_voice(model_path, session_options)
+            else:
+                voice = load_tuned_voice(model_path)
+                if voice is None and piper_ort_format.find_ort_model(model_path):
+                    print(f'[Piper TTS] 使用ORT格式模型: {piper_ort_format.ort_path_for(model_path)}')
+                    voice = create_piper_voice(model_path)
+                elif voice is None:
+                    voice = create_piper_voice(model_path)
             return voice
             
         except ImportError:
@@ -176,9 +392,7 @@ def load_voice(gender='female'):
             if piper_cmd:
                 print(f'[Piper TTS] ✅ 找到piper命令行工具: {piper_cmd}')
                 # 使用命令行工具模式（需要修改synthesize方法）
-                voice = {'type': 'command', 'cmd': piper_cmd, 'model_path': model_path}
-                voices[gender] = voice
-                return voice
+                return {'type': 'command', 'cmd': piper_cmd, 'model_path': model_path, 'model_hash': model.sha256}
             else:
                 raise ImportError('未找到piper-tts包或piper命令行工具')
         
@@ -193,203 +407,2139 @@ def load_voice(gender='female'):
         print(f'[Piper TTS] ❌ 加载模型失败: {e}')
         raise
 
-@app.route('/api/tts', methods=['POST'])
+def attach_phoneme_cache(voice, model, cache=None):
+    """给 PiperVoice 挂上音素缓存（piper_lexicon.py），命中时跳过 espeak-ng 音素化和音素ID查表
+    
+    同一模型的多个会话（TunedVoice）共用一份缓存；模型旁边有预编译词表时一并载入。
+    """
+    if isinstance(voice, piper_ort_tuning.TunedVoice):
+        cache = cache or PhonemeCache(PHONEME_CACHE_ENTRIES, load_lexicon(model.path))
+        attach_phoneme_cache(voice.short_voice, model, cache)
+        attach_phoneme_cache(voice.long_voice, model, cache)
+        return voice
+    if not hasattr(voice, 'phonemes_to_ids') or 'phoneme_cache' in vars(voice):
+        return voice
+    
+    if cache is None:
+        cache = PhonemeCache(PHONEME_CACHE_ENTRIES, load_lexicon(model.path))
+    if cache.lexicon:
+        print(f'[Piper TTS] 📖 已载入预编译词表: {len(cache.lexicon)} 条（{model.name}）')
+    labels = (model.name,)
+    phonemize = voice.phonemize
+    phonemes_to_ids = voice.phonemes_to_ids
+    
+    def cached_phonemize(text):
+        # 按句查缓存：长台词中与其他台词相同的句子也不用重新音素化
+        return cached_phonemes(
+            cache, text,
+            lambda sentence: phonemize_entry(phonemize, phonemes_to_ids, sentence),
+            lambda source: PHONEME_CACHE_LOOKUPS.inc(labels + (source,))
+        )
+    
+    def cached_phonemes_to_ids(phonemes):
+        # 缓存里的每句音素都带着算好的ID
+        ids = getattr(phonemes, 'ids', None)
+        return ids if ids is not None else phonemes_to_ids(phonemes)
+    
+    voice.phonemize = cached_phonemize
+    voice.phonemes_to_ids = cached_phonemes_to_ids
+    voice.phoneme_cache = cache
+    return voice
+
+def attach_batcher(voice, model):
+    """给 PiperVoice 挂上推理批处理器（piper_batching.py），phoneme_ids_to_audio 改为排队凑批推理
+    
+    TunedVoice 的两个会话各有一个批处理器；需要时长对齐信息的调用和命令行模式不经过批处理。
+    """
+    if isinstance(voice, piper_ort_tuning.TunedVoice):
+        attach_batcher(voice.short_voice, model)
+        attach_batcher(voice.long_voice, model)
+        return voice
+    if not MICROBATCH_ENABLED:
+        return voice
+    if getattr(voice, 'session', None) is None or 'batcher' in vars(voice):
+        return voice
+    if not has_durations(voice.session):
+        print(f'[Piper TTS] ⚠️ 模型没有时长输出，不做推理批处理（{model.name}）：'
+              f'安装 onnx 包，或用 python scripts/piper_ort_format.py --force --durations 重新转换 ORT 格式')
+        return voice
+    
+    labels = (model.name,)
+    batcher = MicroBatcher(
+        voice.session,
+        voice.config,
+        max_window=MICROBATCH_MAX_WINDOW,
+        max_batch=MICROBATCH_MAX_SIZE,
+        length_ratio=MICROBATCH_LENGTH_RATIO,
+        workers=MICROBATCH_WORKERS,
+        on_batch=lambda size: INFERENCE_BATCH_SIZE.observe(size, labels)
+    )
+    phoneme_ids_to_audio = voice.phoneme_ids_to_audio
+    
+    def batched_phoneme_ids_to_audio(phoneme_ids, syn_config=None, include_alignments=False):
+        if include_alignments:
+            return phoneme_ids_to_audio(phoneme_ids, syn_config, include_alignments=True)
+        return batcher.infer(phoneme_ids, syn_config)
+    
+    voice.phoneme_ids_to_audio = batched_phoneme_ids_to_audio
+    voice.batcher = batcher
+    return voice
+
+def instrument_voice(voice, model_name):
+    """给 PiperVoice 的音素化和推理挂上计时（实例属性覆盖方法，piper.synthesize() 照常调用）
+    
+    TunedVoice 对内部的两个会话分别处理；命令行模式的 voice 在 synthesize_pcm 里整体计时。
+    """
+    if isinstance(voice, piper_ort_tuning.TunedVoice):
+        instrument_voice(voice.short_voice, model_name)
+        instrument_voice(voice.long_voice, model_name)
+        return voice
+    if not hasattr(voice, 'phoneme_ids_to_audio') or 'instrumented' in vars(voice):
+        return voice
+    
+    labels = (model_name,)
+    sample_rate = voice.config.sample_rate
+    phonemize = voice.phonemize
+    phoneme_ids_to_audio = voice.phoneme_ids_to_audio
+    
+    def timed_phonemize(text):
+        started = time.perf_counter()
+        try:
+            return phonemize(text)
+        finally:
+            PHONEMIZE_SECONDS.observe(time.perf_counter() - started, labels)
+    
+    def timed_phoneme_ids_to_audio(phoneme_ids, *args, **kwargs):
+        started = time.perf_counter()
+        result = phoneme_ids_to_audio(phoneme_ids, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        audio = result[0] if isinstance(result, tuple) else result
+        INFERENCE_SECONDS.observe(elapsed, labels)
+        if len(audio):
+            REAL_TIME_FACTOR.observe(elapsed * sample_rate / len(audio), labels)
+        return result
+    
+    voice.phonemize = timed_phonemize
+    voice.phoneme_ids_to_audio = timed_phoneme_ids_to_audio
+    voice.instrumented = True
+    return voice
+
+def open_voice(model, session_options=None):
+    """创建 voice，挂上音素缓存和推理批处理器，记录加载耗时并挂上分阶段计时
+    
+    计时在外层：缓存命中时音素化耗时接近 0，推理耗时包含在批处理器中的等待。
+    没有传入 session_options 时使用 DEFAULT_SESSION_OPTIONS（多进程模式下的热更新、按需加载）。
+    """
+    started = time.perf_counter()
+    if session_options is None and DEFAULT_SESSION_OPTIONS is not None:
+        session_options = DEFAULT_SESSION_OPTIONS()
+    voice = attach_batcher(attach_phoneme_cache(create_voice(model, session_options), model), model)
+    MODEL_LOAD_SECONDS.set(round(time.perf_counter() - started, 3), (model.name,))
+    return instrument_voice(voice, model.name)
+
+def get_voice(gender='female', session_options=None, speaker=None):
+    """返回该声音当前使用的 (ModelInfo, voice)，模型未加载时先加载
+    
+    按模型文件哈希缓存：男声缺失而退回女声模型时，两种声音共用同一个会话；
+    多说话人模型的各个说话人也共用同一个会话（说话人只是每次合成的参数）。
+    """
+    model = resolve_model(gender, speaker=speaker)
+    if model is None:
+        raise FileNotFoundError(f'未找到Piper TTS模型文件（{gender}），请下载模型到 tts-services/models/ 目录')
+    
+    voice = voices.get(model.sha256)
+    if voice is None:
+        with _voices_lock:
+            voice = voices.get(model.sha256)
+            if voice is None:
+                if speaker is None and model.name not in MODEL_PREFERENCES.get(gender, ()):
+                    print(f'[Piper TTS] ⚠️ 未找到{gender}模型，使用 {model.name} 作为备用')
+                print(f'[Piper TTS] 加载{gender}模型: {model.path}')
+                voice = open_voice(model, session_options)
+                voices[model.sha256] = voice
+                print(f'[Piper TTS] ✅ {gender}模型加载成功')
+    return model, voice
+
+def load_voice(gender='female', session_options=None):
+    """加载Piper TTS模型
+    Args:
+        gender: 'male' 或 'female'，用于选择不同的模型
+        session_options: ONNX Runtime会话配置（可选，默认使用校准结果或 PiperVoice.load 的配置）
+    """
+    return get_voice(gender, session_options)[1]
+
+def prepare_model_swap(index):
+    """模型目录有变化、切换索引之前调用：在后台线程里把已在使用的声音新对应的模型先加载好
+    
+    切换后新请求直接用新会话；正在进行的请求仍持有旧会话，合成完成后旧会话随引用释放。
+    """
+    for gender in MODEL_PREFERENCES:
+        current = resolve_model(gender)
+        updated = resolve_model(gender, index)
+        if current is None or current.sha256 not in voices:
+            continue  # 该声音还没被使用过，按需加载即可
+        if updated is None or updated.sha256 in voices:
+            continue
+        print(f'[Piper TTS] 🔄 模型有更新，后台加载{gender}模型: {updated.path}')
+        voice = open_voice(updated)
+        with _voices_lock:
+            voices.setdefault(updated.sha256, voice)
+
+def release_unused_models():
+    """切换索引之后调用：释放不再被任何声音使用的会话和 piper 常驻进程（仍在索引中的多说话人模型保留）"""
+    in_use = {model.sha256 for model in map(resolve_model, MODEL_PREFERENCES) if model is not None}
+    in_use.update(model.sha256 for model in (model_registry.current or {}).values() if model.num_speakers > 1)
+    with _voices_lock:
+        for model_hash in [h for h in voices if h not in in_use]:
+            print(f'[Piper TTS] 🗑️ 释放不再使用的模型: {model_hash[:12]}')
+            del voices[model_hash]
+    with _cli_pools_lock:
+        for key in [k for k in cli_pools if k[2] not in in_use]:
+            cli_pools.pop(key).close()
+
+def start_model_watcher():
+    """启动模型目录轮询（多进程模式下在每个工作进程里启动）"""
+    if MODEL_POLL_SECONDS > 0:
+        model_registry.watch(MODEL_POLL_SECONDS, prepare_model_swap, release_unused_models)
+
+def load_models(genders, session_options=None):
+    """依次加载各个声音的模型，进度记录在 loader_state 中（单个模型失败不影响其他模型）
+    Args:
+        session_options: 返回 ONNX Runtime 会话配置的函数（可选，每个模型调用一次）
+    """
+    started = time.monotonic()
+    loader_state.update(models={gender: 'pending' for gender in genders}, errors={}, finished=False, seconds=None)
+    for gender in genders:
+        loader_state['models'][gender] = 'loading'
+        try:
+            load_voice(gender, session_options() if session_options else None)
+            loader_state['models'][gender] = 'loaded'
+        except Exception as e:
+            loader_state['models'][gender] = 'failed'
+            loader_state['errors'][gender] = str(e)
+            print(f'[Piper TTS] ⚠️ {gender}模型加载失败: {e}')
+    loader_state['seconds'] = round(time.monotonic() - started, 3)
+    loader_state['finished'] = True
+    if loader_state['errors']:
+        print('[Piper TTS] 💡 服务仍在运行，但TTS功能可能不可用，请参考安装指南下载模型')
+
+def start_model_loader(genders, then=None):
+    """在后台线程中建立模型索引并加载模型，服务不必等模型加载完才开始监听
+    
+    加载期间 /livez 正常返回，/readyz 返回 503；then 在加载完成后于同一线程中调用
+    （启动模型目录轮询、预热等依赖模型的工作）。
+    """
+    loader_state.update(models={gender: 'pending' for gender in genders}, errors={}, finished=False, seconds=None)
+    
+    def run():
+        load_models(genders)
+        if then is not None:
+            then()
+    
+    thread = threading.Thread(target=run, name='piper-model-loader', daemon=True)
+    thread.start()
+    return thread
+
+class AudioCache:
+    """按PCM总字节数限额的LRU音频缓存（线程安全）
+    
+    游戏里"要不起"、"我跟一手"这类短句会被反复请求，命中时直接返回PCM，跳过ONNX推理。
+    条目为 (pcm字节, (采样率, 声道数, 采样宽度))；转码结果的缓存条目为 (编码后字节, Content-Type)。
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, pcm, audio_format):
+        size = len(pcm)
+        # 单条超过总预算的不缓存，避免把整个缓存挤空
+        if size == 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (pcm, audio_format)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+audio_cache = AudioCache(AUDIO_CACHE_MAX_BYTES)
+encoded_cache = AudioCache(ENCODED_CACHE_MAX_BYTES)
+
+def normalize_text(text):
+    """规范化缓存键中的文本：去掉首尾空白并合并连续空白"""
+    return ' '.join(text.split())
+
+def parse_synthesis_params(data):
+    """从请求中取出合成参数，只保留合法的数值字段"""
+    params = {}
+    for name in SYNTHESIS_PARAMS:
+        value = data.get(name)
+        if value is None:
+            continue
+        try:
+            params[name] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'参数 {name} 必须是数字')
+    return params
+
+def audio_cache_key(text, model_hash, params, output_format='wav'):
+    """缓存键：(规范化文本, 模型文件哈希, 合成参数, 输出格式)
+    
+    用文件哈希而不是路径：模型文件被替换（热更新）后旧的缓存自然失效。
+    """
+    return (
+        normalize_text(text),
+        model_hash,
+        tuple(sorted(params.items())),
+        output_format,
+    )
+
+def get_audio_store():
+    """打开共享磁盘存储（首次调用时打开，关闭或打开失败时返回 None）"""
+    global _audio_store
+    if _audio_store is None:
+        with _audio_store_lock:
+            if _audio_store is None:
+                try:
+                    _audio_store = open_default_store(AUDIO_STORE_DEFAULT_DIR) or False
+                except Exception as e:
+                    print(f'[Piper TTS] ⚠️ 磁盘音频存储打开失败，仅使用内存缓存: {e}')
+                    _audio_store = False
+    return _audio_store or None
+
+def get_audio_bank():
+    """打开预生成音频库（首次调用时打开，没有音频库或打开失败时返回 None）"""
+    global _audio_bank
+    if _audio_bank is None:
+        with _audio_store_lock:
+            if _audio_bank is None:
+                try:
+                    _audio_bank = open_default_bank(AUDIO_BANK_DEFAULT_PATH) or False
+                    if _audio_bank:
+                        print(f'[Piper TTS] 📦 预生成音频库: {_audio_bank.path}（{len(_audio_bank)} 条）')
+                except Exception as e:
+                    print(f'[Piper TTS] ⚠️ 预生成音频库打开失败: {e}')
+                    _audio_bank = False
+    return _audio_bank or None
+
+def get_stored(store_key):
+    """依次查预生成音频库和磁盘存储，返回 ((音频 bytes, 元数据), 来源 bank/disk) 或 (None, 'miss')"""
+    if store_key is None:
+        return None, 'miss'
+    bank = get_audio_bank()
+    stored = bank.get(store_key) if bank is not None else None
+    if stored is not None:
+        return stored, 'bank'
+    store = get_audio_store()
+    stored = store.get(store_key) if store is not None else None
+    return stored, 'miss' if stored is None else 'disk'
+
+def audio_store_key(text, model_hash, params, output_format=None):
+    """磁盘存储键：(引擎, 模型文件哈希, 说话人, 语速, 文本) 的哈希，转码结果再加上输出格式"""
+    extra = {name: value for name, value in params.items() if name not in ('length_scale', 'speaker_id')}
+    if output_format is not None:
+        extra['output'] = output_format
+    return AudioStore.make_key(
+        'piper',
+        model_hash,
+        params.get('speaker_id'),
+        params.get('length_scale'),
+        normalize_text(text),
+        **extra
+    )
+
+def lookup_audio(key, store_key, labels=None):
+    """依次查内存缓存、预生成音频库和磁盘存储，返回 (pcm, (采样率, 声道数, 采样宽度)) 或 None
+    Args:
+        labels: (声音, 语言)，给出时计入 tts_cache_lookups_total
+    """
+    cached = audio_cache.get(key)
+    if cached is not None:
+        if labels is not None:
+            CACHE_LOOKUPS.inc(('pcm',) + labels + ('memory',))
+        return cached
+    stored, source = get_stored(store_key)
+    if labels is not None:
+        CACHE_LOOKUPS.inc(('pcm',) + labels + (source,))
+    if stored is None:
+        return None
+    pcm = PCMData([stored[0]])
+    meta = stored[1]
+    audio_format = (meta['sample_rate'], meta['channels'], meta['sample_width'])
+    if source == 'disk':
+        # 音频库的数据本来就在映射的页缓存里，不再占内存缓存
+        audio_cache.put(key, pcm, audio_format)
+    return pcm, audio_format
+
+def remember_audio(key, store_key, pcm, audio_format):
+    """合成结果写入内存缓存，并交给后台线程写入磁盘存储"""
+    audio_cache.put(key, pcm, audio_format)
+    store = get_audio_store()
+    if store is not None and store_key is not None:
+        sample_rate, channels, sample_width = audio_format
+        store.put(store_key, pcm.segments, {
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'sample_width': sample_width,
+        })
+
+def lookup_encoded(key, store_key, labels=None):
+    """查转码结果的内存缓存、预生成音频库和磁盘存储，返回 (编码后字节, Content-Type) 或 None"""
+    cached = encoded_cache.get(key)
+    if cached is not None:
+        if labels is not None:
+            CACHE_LOOKUPS.inc(('encoded',) + labels + ('memory',))
+        return cached
+    stored, source = get_stored(store_key)
+    if labels is not None:
+        CACHE_LOOKUPS.inc(('encoded',) + labels + (source,))
+    if stored is None:
+        return None
+    data, meta = stored
+    if source == 'disk':
+        encoded_cache.put(key, data, meta['content_type'])
+    return data, meta['content_type']
+
+def remember_encoded(key, store_key, data, content_type):
+    """转码结果写入内存缓存和磁盘存储"""
+    encoded_cache.put(key, data, content_type)
+    store = get_audio_store()
+    if store is not None and store_key is not None:
+        store.put(store_key, data, {'content_type': content_type})
+
+def cache_when_complete(pcm_chunks, key, store_key):
+    """透传PCM片段，全部合成完成后写入缓存（客户端中途断开则不缓存）"""
+    collected = []
+    audio_format = None
+    for pcm, chunk_format_ in pcm_chunks:
+        if audio_format is None:
+            audio_format = chunk_format_
+        collected.append(pcm)
+        yield pcm, chunk_format_
+    if audio_format is not None:
+        remember_audio(key, store_key, PCMData(collected), audio_format)
+
+def cli_args_for_params(params):
+    """把合成参数转换为piper命令行参数"""
+    args = []
+    if 'length_scale' in params:
+        args += ['--length_scale', str(params['length_scale'])]
+    if 'noise_scale' in params:
+        args += ['--noise_scale', str(params['noise_scale'])]
+    if 'noise_w_scale' in params:
+        args += ['--noise_w', str(params['noise_w_scale'])]
+    if 'speaker_id' in params:
+        args += ['--speaker', str(params['speaker_id'])]
+    return args
+
+def get_cli_pool(voice, params):
+    """获取（或创建）该模型和合成参数对应的piper常驻进程池"""
+    key = (voice['cmd'], voice['model_path'], voice.get('model_hash'), tuple(sorted(params.items())))
+    pool = cli_pools.get(key)
+    if pool is None:
+        with _cli_pools_lock:
+            pool = cli_pools.get(key)
+            if pool is None:
+                print(f'[Piper TTS] 启动 {PIPER_CLI_WORKERS} 个piper常驻进程: {voice["model_path"]}')
+                pool = PiperProcessPool(voice['cmd'], voice['model_path'], cli_args_for_params(params), PIPER_CLI_WORKERS)
+                cli_pools[key] = pool
+    return pool
+
+def synthesize_pcm(voice, text, params):
+    """调用Piper合成，逐段产出 (pcm字节, (采样率, 声道数, 采样宽度))"""
+    # 根据voice类型选择合成方式
+    if isinstance(voice, dict) and voice.get('type') == 'command':
+        # 使用命令行工具
+        if os.name != 'nt':
+            # 常驻进程池：请求通过stdin发送，PCM通过管道返回（音素化在 piper 进程内，整体计为推理耗时）
+            started = time.perf_counter()
+            pcm, audio_format = get_cli_pool(voice, params).synthesize(text)
+            elapsed = time.perf_counter() - started
+            labels = (os.path.basename(voice['model_path']),)
+            INFERENCE_SECONDS.observe(elapsed, labels)
+            if pcm:
+                REAL_TIME_FACTOR.observe(elapsed * audio_format[0] * audio_format[1] * audio_format[2] / len(pcm), labels)
+            yield pcm, audio_format
+            return
+        
+        # Windows 下没有可用于管道的 select，每个请求启动一次piper
+        import subprocess
+        import tempfile
+        import wave
+        
+        piper_cmd = voice['cmd']
+        model_path = voice['model_path']
+        
+        # 创建临时文件
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+        
+        args = [piper_cmd, '--model', model_path, '--output_file', tmp_path] + cli_args_for_params(params)
+        
+        try:
+            # 调用piper命令行工具
+            subprocess.run(
+                args,
+                input=text.encode('utf-8'),
+                capture_output=True,
+                check=True
+            )
+            
+            # 读取生成的音频文件
+            with wave.open(tmp_path, 'rb') as wav_file:
+                audio_format = (wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth())
+                pcm = wav_file.readframes(wav_file.getnframes())
+        except subprocess.CalledProcessError as e:
+            raise Exception(f'piper命令行工具执行失败: {e.stderr.decode()}')
+        finally:
+            # 删除临时文件
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        
+        yield pcm, audio_format
+        return
+    
+    # 使用Python包
+    syn_config = None
+    if params:
+        from piper import SynthesisConfig
+        syn_config = SynthesisConfig(**params)
+    
+    # synthesize() 返回AudioChunk对象的生成器
+    for chunk in voice.synthesize(text, syn_config=syn_config):
+        yield chunk_to_pcm(chunk), chunk_format(chunk)
+
+def get_sentence_executor():
+    """长文本分句合成使用的线程池（首次使用时创建，多进程模式下在子进程里创建）
+    
+    与批量合成线程池分开：批量合成的任务会再把长文本分句提交到这里，共用一个池会互相等待。
+    """
+    global _sentence_executor
+    if _sentence_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with _sentence_executor_lock:
+            if _sentence_executor is None:
+                _sentence_executor = ThreadPoolExecutor(SENTENCE_THREADS, thread_name_prefix='piper-sentence')
+    return _sentence_executor
+
+def synthesize_sentence(voice, sentence, params):
+    """合成一句，返回 (pcm字节, 音频参数)"""
+    pcm_chunks = list(synthesize_pcm(voice, sentence, params))
+    if not pcm_chunks:
+        return b'', None
+    return b''.join(pcm for pcm, _ in pcm_chunks), pcm_chunks[0][1]
+
+def join_sentences(results, gap_ms=0, crossfade_ms=0):
+    """按顺序拼接各句PCM，产出 (pcm, 音频参数)
+    
+    gap_ms > 0 时句间插入静音；否则 crossfade_ms > 0 时相邻两句首尾重叠并线性淡入淡出。
+    """
+    import numpy as np
+    
+    first = True
+    held = None  # 交叉淡化时暂存的上一句结尾 (pcm, 音频参数)
+    for pcm, audio_format in results:
+        if not pcm:
+            continue
+        sample_rate, channels, sample_width = audio_format
+        frame = channels * sample_width
+        
+        if gap_ms > 0:
+            if not first:
+                yield bytes(int(sample_rate * gap_ms / 1000) * frame), audio_format
+            first = False
+            yield pcm, audio_format
+            continue
+        
+        overlap = int(sample_rate * crossfade_ms / 1000) * frame
+        if overlap <= 0 or sample_width != 2 or len(pcm) < 2 * overlap:
+            # 不淡化（或这一句太短）：先发出暂存的结尾，整句原样输出
+            if held is not None:
+                yield held
+                held = None
+            yield pcm, audio_format
+            continue
+        
+        head = pcm[:overlap]
+        if held is not None and held[1] == audio_format:
+            fade = np.linspace(0.0, 1.0, overlap // sample_width, dtype=np.float32)
+            mixed = (np.frombuffer(held[0], dtype='<i2') * (1 - fade)
+                     + np.frombuffer(head, dtype='<i2') * fade)
+            head = np.clip(np.round(mixed), -32768, 32767).astype('<i2').tobytes()
+        elif held is not None:
+            yield held
+        yield head + pcm[overlap:-overlap], audio_format
+        held = (pcm[-overlap:], audio_format)
+    
+    if held is not None:
+        yield held
+
+def synthesize_parallel(voice, sentences, params):
+    """各句同时提交到线程池合成，按原顺序产出
+    
+    第一句合成完立即产出（流式模式下首包延迟约等于第一句的耗时），
+    整体耗时约等于最长一句，而不是各句之和。客户端断开时取消尚未开始的句子。
+    """
+    executor = get_sentence_executor()
+    futures = [executor.submit(synthesize_sentence, voice, sentence, params) for sentence in sentences]
+    try:
+        yield from join_sentences(
+            (future.result() for future in futures),
+            SENTENCE_GAP_MS,
+            SENTENCE_CROSSFADE_MS
+        )
+    finally:
+        for future in futures:
+            future.cancel()
+
+def synthesize_text(voice, text, params):
+    """合成整段文本：长文本按句并行，其余交给 Piper 逐句合成"""
+    if len(text) >= LONG_TEXT_CHARS and SENTENCE_THREADS > 1:
+        sentences = split_sentences(text)
+        if len(sentences) > 1:
+            return synthesize_parallel(voice, sentences, params)
+    return synthesize_pcm(voice, text, params)
+
+class TTSJob:
+    """解析后的一次合成请求，Flask 和 ASGI 两种服务模式共用"""
+    
+    def __init__(self, text, gender, stream, params, output=tts_audio_formats.DEFAULT_FORMAT, schedule=None,
+                 speaker=None):
+        self.text = text
+        self.gender = gender
+        self.speaker = speaker
+        self.stream = stream
+        self.params = params
+        self.output = output
+        self.schedule = schedule or make_schedule(text=text)
+        self.cancellation = Cancellation()
+        self.model = None
+        self.voice = None
+        self.key = None
+        self.store_key = None
+        self.encoded_key = None
+        self.encoded_store_key = None
+        self.etag = None
+        self.pcm_source = None
+    
+    @property
+    def transcoded(self):
+        """是否需要把模型输出的PCM转码为其他格式"""
+        return self.output != tts_audio_formats.DEFAULT_FORMAT
+    
+    @property
+    def labels(self):
+        """指标标签 (声音, 语言)，prepare() 之后可用"""
+        return self.gender, self.model.language or ''
+    
+    def prepare(self):
+        """加载模型（如果还没有加载）并计算缓存键和 ETag"""
+        model, self.voice = get_voice(self.gender, speaker=self.speaker)
+        self.model = model
+        # ETag 与存储键同样由 (模型哈希, 合成参数, 文本, 输出格式) 计算，不用先合成（弱 ETag，见 weak_etag()）
+        self.etag = weak_etag(
+            audio_store_key(self.text, model.sha256, self.params, self.output.cache_tag() if self.transcoded else None)
+        )
+        self.key = audio_cache_key(self.text, model.sha256, self.params, 'wav')
+        if self.transcoded:
+            self.encoded_key = self.output_key(model)
+        if get_audio_store() or get_audio_bank():
+            self.store_key = audio_store_key(self.text, model.sha256, self.params)
+            if self.transcoded:
+                self.encoded_store_key = audio_store_key(self.text, model.sha256, self.params, self.output.cache_tag())
+    
+    def output_key(self, model):
+        """按 model 合成时最终输出的缓存键（转码时即转码结果的键），不用加载模型
+        
+        多说话人模型按说话人名称选模型，模型哈希和说话人编号都在键里，不同说话人不会相同。
+        """
+        return audio_cache_key(
+            self.text, model.sha256 if model else None, self.params, self.output.cache_tag() if self.transcoded else 'wav'
+        )
+    
+    def lookup(self):
+        """查内存缓存和磁盘存储，返回 (pcm, 音频参数) 或 None"""
+        return lookup_audio(self.key, self.store_key, self.labels)
+    
+    def lookup_response(self):
+        """查缓存，命中时返回 (响应体各部分, Content-Type)，否则返回 None
+        
+        先查转码结果；没有时用缓存的PCM现场转码（不需要重新合成）。
+        """
+        if self.transcoded:
+            encoded = lookup_encoded(self.encoded_key, self.encoded_store_key, self.labels)
+            if encoded is not None:
+                return (encoded[0],), encoded[1]
+        cached = self.lookup()
+        if cached is None:
+            return None
+        return self.encode(*cached)
+    
+    def encode(self, pcm_data, audio_format):
+        """把PCM编码为请求的输出格式，返回 (响应体各部分, Content-Type)，转码结果写入缓存
+        
+        WAV 输出直接引用 PCMData 的各段，不复制。
+        """
+        if not self.transcoded:
+            return pcm_data.wav_parts(*audio_format), 'audio/wav'
+        started = time.perf_counter()
+        data, content_type = tts_audio_formats.encode_pcm(bytes(pcm_data), *audio_format, self.output)
+        ENCODE_SECONDS.observe(time.perf_counter() - started, (self.output.cache_tag(),))
+        remember_encoded(self.encoded_key, self.encoded_store_key, data, content_type)
+        return (data,), content_type
+    
+    def render(self):
+        """完整合成并编码，返回 (响应体各部分, Content-Type)"""
+        return self.encode(*collect_pcm(self.cancellation.guard(self.pcm_chunks())))
+    
+    def follow(self):
+        """已有相同的合成正在进行时挂到它上面并返回 True，之后 render()/stream_chunks() 读取它的结果"""
+        self.pcm_source = single_flight.stream(self.key, None, follow_only=True)
+        return self.pcm_source is not None
+    
+    def pcm_chunks(self):
+        """开始合成，逐段产出PCM，完成后自动写入缓存
+        
+        相同的合成（缓存键相同）正在进行时不再重复合成，而是逐段读取它的结果。
+        """
+        if self.pcm_source is not None:
+            source, self.pcm_source = self.pcm_source, None
+            return source
+        return single_flight.stream(
+            self.key,
+            lambda: cache_when_complete(synthesize_text(self.voice, self.text, self.params), self.key, self.store_key)
+        )
+    
+    def stream_chunks(self):
+        """流式输出的字节片段（只用于 output.streamable 的格式）"""
+        return tts_audio_formats.stream_chunks(self.cancellation.guard(self.pcm_chunks()), self.output)
+    
+    def not_modified(self, if_none_match):
+        """客户端缓存的版本仍然有效（If-None-Match 与 ETag 匹配）时返回 True，prepare() 之后可用"""
+        if not etag_matches(if_none_match, self.etag):
+            return False
+        CONDITIONAL_RESPONSES.inc(('not_modified',))
+        return True
+    
+    def probe_headers(self, cached):
+        """HEAD 探测的响应头和 Content-Type：ETag、服务端是否已有这段音频，命中时带上大小
+        Args:
+            cached: lookup_response() 的结果
+        """
+        CONDITIONAL_RESPONSES.inc(('probe_miss' if cached is None else 'probe_hit',))
+        headers = {'ETag': self.etag, 'Vary': 'Accept', CACHE_STATUS_HEADER: 'miss' if cached is None else 'hit'}
+        if cached is None:
+            if self.output.streamable:
+                return headers, self.stream_content_type()
+            return headers, 'audio/ogg; codecs=opus' if self.output.name == 'opus' else 'audio/wav'
+        headers['Content-Length'] = str(sum(len(part) for part in cached[0]))
+        return headers, cached[1]
+    
+    def stream_content_type(self):
+        if self.output.name == 'l16':
+            # 响应头要先于音频发出，采样率取模型配置（命令行模式下按 Piper 默认的 22050）
+            sample_rate = getattr(getattr(self.voice, 'config', None), 'sample_rate', 22050)
+            return tts_audio_formats.l16_content_type(self.output.rate or sample_rate)
+        return 'audio/wav'
+
+def parse_tts_request(data, query_args, accept=None):
+    """校验请求参数并创建 TTSJob；参数不合法时抛出 ValueError
+    Args:
+        accept: 请求的 Accept 头，没有显式的 format 参数时用于协商输出格式
+    """
+    data = data or {}
+    if not isinstance(data, dict):
+        raise ValueError('请求体必须是 JSON 对象')
+    text = data.get('text', '')
+    gender = data.get('gender', 'female')  # 默认使用女声
+    stream = parse_bool(data.get('stream', query_args.get('stream')))
+    
+    if not text:
+        raise ValueError('缺少 text 参数')
+    
+    params = parse_synthesis_params(data)
+    output = tts_audio_formats.negotiate(
+        data.get('format', query_args.get('format')),
+        data.get('rate', query_args.get('rate')),
+        accept
+    )
+    
+    # 调度信息（ASGI 模式下的合成队列按优先级、房间和角色排队，见 tts_scheduler.py）
+    schedule = make_schedule(
+        data.get('priority', query_args.get('priority')),
+        data.get('room', query_args.get('room')),
+        data.get('role', query_args.get('role')),
+        text
+    )
+    
+    # 验证 gender 参数
+    if gender not in ['male', 'female']:
+        gender = 'female'  # 无效值使用默认值
+    
+    # 多说话人模型：speaker 为 speaker_id_map 中的名称或说话人编号，换算后作为合成参数
+    # （也因此进入缓存键和合并键，不同说话人共用一个会话）
+    speaker = data.get('speaker', query_args.get('speaker'))
+    speaker_id = speaker_id_for(resolve_model(gender, speaker=speaker), speaker)
+    if speaker_id is not None:
+        params['speaker_id'] = speaker_id
+    
+    return TTSJob(text, gender, stream, params, output, schedule, speaker)
+
+def collect_pcm(pcm_chunks):
+    """收集所有PCM片段并获取音频参数（从第一个片段）"""
+    audio_chunks = []
+    audio_format = None
+    for pcm, chunk_format_ in pcm_chunks:
+        if audio_format is None:
+            audio_format = chunk_format_
+        audio_chunks.append(pcm)
+    return PCMData(audio_chunks), audio_format or (22050, 1, 2)
+
+def begin_request(job, headers):
+    """登记请求以便取消：读取请求ID和截止时间请求头（截止时间也用于排队），请求头不合法时抛出 ValueError"""
+    deadline = parse_deadline_ms(headers.get(DEADLINE_HEADER))
+    job.cancellation = Cancellation(headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex, deadline)
+    job.schedule = job.schedule._replace(deadline=deadline)
+    with active_requests_lock:
+        active_requests[job.cancellation.request_id] = job.cancellation
+
+def cancel_request(request_id):
+    """取消正在处理的请求，找不到时返回 False"""
+    with active_requests_lock:
+        cancellation = active_requests.get(request_id)
+    if cancellation is None:
+        return False
+    cancellation.cancel()
+    return True
+
+def cancelled_status(reason):
+    """合成被取消时的状态码：超过截止时间 504，其余（取消、断开）499"""
+    return 504 if reason == 'deadline' else 499
+
+def finish_request(endpoint, started, cancellation=None):
+    """请求结束：记录总耗时，减少正在处理的请求数，注销取消令牌"""
+    REQUEST_SECONDS.observe(time.perf_counter() - started, (endpoint,))
+    INFLIGHT.dec()
+    if cancellation is not None:
+        with active_requests_lock:
+            if active_requests.get(cancellation.request_id) is cancellation:
+                del active_requests[cancellation.request_id]
+
+def finish_after_stream(chunks, endpoint, started, cancellation=None):
+    """透传流式响应的片段，最后一段发出（或客户端断开）时才算请求结束；被取消时提前结束响应"""
+    try:
+        yield from chunks
+    except Cancelled as e:
+        CANCELLED.inc((e.reason,))
+    finally:
+        finish_request(endpoint, started, cancellation)
+
+def audio_response(parts, content_type, request_id=None, etag=None):
+    """返回音频数据：parts 是 bytes 的元组，逐个交给WSGI服务器写出，不拼接
+    
+    输出格式可能由 Accept 头决定，所以带上 Vary。
+    """
+    headers = {
+        'Content-Length': str(sum(len(part) for part in parts)),
+        'Vary': 'Accept',
+    }
+    if request_id is not None:
+        headers[REQUEST_ID_HEADER] = request_id
+    if etag is not None:
+        headers['ETag'] = etag
+    return Response(parts, mimetype=content_type, headers=headers)
+
+@app.route('/api/tts', methods=['GET', 'POST', 'HEAD'])
 def synthesize():
-    """TTS合成接口
+    """TTS合成接口（POST JSON；GET / HEAD 用查询参数传相同的字段）
     支持通过 gender 参数选择模型：
     {
         "text": "要合成的文本",
-        "gender": "male" 或 "female" (可选，默认 "female")
+        "gender": "male" 或 "female" (可选，默认 "female"),
+        "speaker": 说话人名称或编号 (可选，多说话人模型，名称见 GET /models 的 speakers),
+        "stream": true (可选，边合成边返回WAV，也可用 ?stream=1),
+        "length_scale" / "noise_scale" / "noise_w_scale" / "volume": 数字 (可选，合成参数),
+        "format": "wav" | "l16" | "adpcm" | "opus" (可选，也可用 ?format= 或 Accept 头协商),
+        "rate": 16000 或 8000 (可选，服务端降采样),
+        "priority": "chat" | "event" | "quarrel" | "announcement" (可选，ASGI 模式下排队用),
+        "room" / "role": 房间和角色ID (可选，ASGI 模式下排队用)
+    }
+    请求头 X-Request-Id（可选）标识请求，可用 DELETE /api/tts/<id> 取消；
+    X-TTS-Deadline-Ms（可选）为剩余毫秒数，超过后合成在句子之间停止（504）。
+    相同 (文本, 模型, 合成参数, 输出格式) 的结果会缓存在服务端内存中，
+    并写入与 Melo 服务共享的磁盘存储（tts_audio_store.py），重启后仍可命中。
+    
+    完整（非流式）的响应带弱 ETag，由 (模型文件哈希, 合成参数, 文本, 输出格式) 计算；
+    请求头 If-None-Match 与之匹配时直接返回 304，不查缓存也不合成（模型更新后 ETag 随之变化）。
+    HEAD 只查缓存不合成：响应头有 ETag 和 X-TTS-Cache: hit/miss，命中时还有 Content-Length。
+    """
+    started = time.perf_counter()
+    INFLIGHT.inc()
+    streaming = False
+    job = None
+    try:
+        try:
+            data = request.json if request.method == 'POST' else request.args.to_dict()
+            job = parse_tts_request(data, request.args, request.headers.get('Accept'))
+            begin_request(job, request.headers)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        request_id = job.cancellation.request_id
+        
+        job.prepare()
+        REQUESTS.inc(('tts',) + job.labels)
+        if job.not_modified(request.headers.get('If-None-Match')):
+            return Response(status=304, headers={'ETag': job.etag, 'Vary': 'Accept'})
+        cached = job.lookup_response()
+        if request.method == 'HEAD':
+            headers, content_type = job.probe_headers(cached)
+            response = Response(status=200, mimetype=content_type, headers=headers)
+            # 未命中时大小未知，不让 Werkzeug 按空响应体补上 Content-Length: 0
+            response.automatically_set_content_length = False
+            return response
+        if cached is not None:
+            return audio_response(*cached, request_id, job.etag)
+        
+        if job.stream and job.output.streamable:
+            # 流式模式：逐句发出PCM，首包延迟约等于第一句的合成时间；客户端断开时停止合成
+            streaming = True
+            return Response(
+                stream_with_context(finish_after_stream(job.stream_chunks(), 'tts', started, job.cancellation)),
+                mimetype=job.stream_content_type(),
+                headers={'Vary': 'Accept', REQUEST_ID_HEADER: request_id}
+            )
+        
+        # 将所有chunk合并为PCM数据，再编码为请求的输出格式
+        return audio_response(*job.render(), request_id, job.etag)
+    except Cancelled as e:
+        CANCELLED.inc((e.reason,))
+        return {'error': str(e), 'reason': e.reason}, cancelled_status(e.reason)
+    except Exception as e:
+        print(f'[Piper TTS] ❌ 合成失败: {e}')
+        return {'error': str(e)}, 500
+    finally:
+        if not streaming:
+            finish_request('tts', started, job.cancellation if job is not None else None)
+
+@app.route('/api/tts/<request_id>', methods=['DELETE'])
+def cancel_synthesis(request_id):
+    """取消正在处理的合成请求（排队中的直接撤下，合成中的在下一句之前停止）"""
+    if not cancel_request(request_id):
+        return {'error': f'没有正在处理的请求 {request_id}'}, 404
+    return {'id': request_id, 'cancelled': True}
+
+def parse_batch_request(data):
+    """解析批量合成请求，缓存键相同（模型、说话人、合成参数、文本、输出格式都相同）的条目合并为一次合成
+    
+    返回 (groups, errors)：groups 为 [{'job': TTSJob, 'ids': [条目id, ...]}]，
+    errors 为参数不合法的条目 [(条目id, 错误信息)]。整个请求不合法时抛出 ValueError。
+    """
+    if not isinstance(data, dict):
+        raise ValueError('请求体必须是 JSON 对象')
+    items = data.get('items')
+    # 批次级的调度信息作为各条目的默认值
+    defaults = {key: data[key] for key in ('priority', 'room', 'role') if key in data}
+    if not isinstance(items, list) or not items:
+        raise ValueError('缺少 items 参数')
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f'items 最多 {BATCH_MAX_ITEMS} 条')
+    
+    groups = OrderedDict()
+    errors = []
+    for index, item in enumerate(items):
+        item_id = item.get('id', index) if isinstance(item, dict) else index
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('条目必须是对象')
+            job = parse_tts_request(dict(defaults, **item), {})
+        except ValueError as e:
+            errors.append((item_id, str(e)))
+            continue
+        job.stream = False
+        # 与 TTSJob 的缓存键相同：说话人可能换用另一个模型，只比较性别和参数会把不同说话人的条目合并
+        dedupe_key = job.output_key(resolve_model(job.gender, speaker=job.speaker))
+        group = groups.setdefault(dedupe_key, {'job': job, 'ids': []})
+        group['ids'].append(item_id)
+    return list(groups.values()), errors
+
+def render_job(job, endpoint='batch'):
+    """完整合成一条请求（优先命中缓存），返回 (响应体各部分, Content-Type)"""
+    job.prepare()
+    REQUESTS.inc((endpoint,) + job.labels)
+    return job.lookup_response() or job.render()
+
+def batch_lines(ids, audio=None, error=None):
+    """为合并后的每个条目id生成一行NDJSON结果
+    Args:
+        audio: render_job 的返回值 (响应体各部分, Content-Type)
+    """
+    import base64
+    import json
+    
+    if error is None:
+        parts, content_type = audio
+        result = {'status': 'ok', 'mimetype': content_type, 'audio': base64.b64encode(b''.join(parts)).decode('ascii')}
+    else:
+        result = {'status': 'error', 'error': error}
+    for item_id in ids:
+        yield json.dumps({'id': item_id, **result}, ensure_ascii=False) + '\n'
+
+def iter_batch(groups, errors, submit, parallelism):
+    """并行合成批量请求，按完成顺序逐行产出NDJSON
+    Args:
+        submit: submit(fn, *args) -> concurrent.futures.Future
+        parallelism: 同一批次同时进行的合成数
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    
+    for item_id, error in errors:
+        yield from batch_lines([item_id], error=error)
+    
+    waiting = list(groups)
+    running = {}
+    while waiting or running:
+        while waiting and len(running) < parallelism:
+            group = waiting.pop(0)
+            running[submit(render_job, group['job'])] = group
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            group = running.pop(future)
+            try:
+                yield from batch_lines(group['ids'], audio=future.result())
+            except Exception as e:
+                print(f'[Piper TTS] ❌ 批量合成失败: {e}')
+                yield from batch_lines(group['ids'], error=str(e))
+
+def get_batch_executor():
+    """Flask 模式下批量合成使用的线程池（首次使用时创建，多进程模式下在子进程里创建）"""
+    global _batch_executor
+    if _batch_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(BATCH_THREADS, thread_name_prefix='piper-batch')
+    return _batch_executor
+
+@app.route('/api/tts/batch', methods=['POST'])
+def synthesize_batch():
+    """批量合成接口（用于游戏开始时预加载常用台词）
+    {
+        "items": [
+            {"id": "p0-pass", "text": "要不起", "gender": "male", ...与 /api/tts 相同的参数},
+            ...
+        ]
     }
+    返回 application/x-ndjson，每合成完一条就输出一行（mimetype 随条目的 format 变化）：
+        {"id": ..., "status": "ok", "mimetype": "audio/wav", "audio": "<base64 WAV>"}
+        {"id": ..., "status": "error", "error": "..."}
+    结果按完成顺序返回，不保证与请求顺序一致；相同文本/声音/参数的条目只合成一次。
     """
     try:
-        data = request.json
-        text = data.get('text', '')
-        gender = data.get('gender', 'female')  # 默认使用女声
+        groups, errors = parse_batch_request(request.json)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    started = time.perf_counter()
+    INFLIGHT.inc()
+    lines = iter_batch(groups, errors, get_batch_executor().submit, BATCH_THREADS)
+    return Response(
+        stream_with_context(finish_after_stream(lines, 'batch', started)),
+        mimetype='application/x-ndjson',
+        headers={'X-Batch-Unique': str(len(groups))}
+    )
+
+def load_warmup_manifest(path):
+    """读取预热清单
+    
+    支持两种格式：
+        JSON：[{"text": "要不起", "gender": "male", ...与 /api/tts 相同的参数}, ["我跟一手", "female"], ...]
+        文本：每行一句，可写成 "male<TAB>要不起"；空行和 # 开头的行会被忽略
+    "voice" 可以代替 "gender" 字段。
+    """
+    import json
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    items = []
+    if path.endswith('.json'):
+        for entry in json.loads(content):
+            if isinstance(entry, str):
+                entry = {'text': entry}
+            elif isinstance(entry, (list, tuple)):
+                entry = {'text': entry[0], 'gender': entry[1] if len(entry) > 1 else 'female'}
+            else:
+                entry = dict(entry)
+            if 'voice' in entry and 'gender' not in entry:
+                entry['gender'] = entry.pop('voice')
+            items.append(entry)
+    else:
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            voice, sep, text = line.partition('\t')
+            items.append({'text': text, 'gender': voice} if sep else {'text': line})
+    return items
+
+def run_warmup(items):
+    """逐条合成预热清单，结果写入内存缓存和磁盘存储"""
+    started = time.monotonic()
+    for item in items:
+        try:
+            render_job(parse_tts_request(item, {}), 'warmup')
+            warmup_state['done'] += 1
+        except Exception as e:
+            warmup_state['failed'] += 1
+            print(f'[Piper TTS] ⚠️ 预热失败: {item.get("text")}: {e}')
+    warmup_state['seconds'] = round(time.monotonic() - started, 3)
+    warmup_state['finished'] = True
+    print(f'[Piper TTS] 🔥 预热完成: {warmup_state["done"]}/{warmup_state["total"]} 条，耗时 {warmup_state["seconds"]} 秒')
+
+def render_bank_item(item, formats=()):
+    """构建音频库时在工作进程中合成一条（不经过缓存和队列），返回 [(存储键, 音频, 元数据)]
+    
+    键与 TTSJob.prepare() 计算的存储键相同，服务查询时直接命中。formats 为额外预生成的输出格式（如 opus）。
+    """
+    job = parse_tts_request(item, {})
+    model, voice = get_voice(job.gender, fork_safe_session_options(), job.speaker)
+    pcm_data, audio_format = collect_pcm(synthesize_text(voice, job.text, job.params))
+    pcm = bytes(pcm_data)
+    sample_rate, channels, sample_width = audio_format
+    label = {'text': normalize_text(job.text), 'voice': job.gender}
+    if job.speaker is not None:
+        label['speaker'] = job.speaker
+    entries = [(
+        audio_store_key(job.text, model.sha256, job.params),
+        pcm,
+        dict(label, sample_rate=sample_rate, channels=channels, sample_width=sample_width),
+    )]
+    for name in formats:
+        output = tts_audio_formats.negotiate(name, None, None)
+        data, content_type = tts_audio_formats.encode_pcm(pcm, *audio_format, output)
+        entries.append((
+            audio_store_key(job.text, model.sha256, job.params, output.cache_tag()),
+            data,
+            dict(label, content_type=content_type),
+        ))
+    return entries
+
+def audio_bank_items(voice_specs, manifest_items=()):
+    """音频库的合成清单：固定台词 × 各个声音（"female"、"male" 或 "female:说话人"），再加上预热清单的条目"""
+    items = []
+    texts = fixed_vocabulary()
+    for spec in voice_specs:
+        gender, _, speaker = spec.partition(':')
+        extra = {'speaker': speaker} if speaker else {}
+        items.extend(dict(extra, text=text, gender=gender) for text in texts)
+    return items + list(manifest_items)
+
+def build_audio_bank(path, voice_specs, formats=(), workers=None, manifest_items=()):
+    """用进程池合成固定台词并写入音频库文件（--build-audio-bank），返回退出码"""
+    from functools import partial
+    
+    items = audio_bank_items(voice_specs, manifest_items)
+    print(f'[Piper TTS] 📦 构建音频库: {len(items)} 条，{workers or os.cpu_count()} 个进程 -> {path}')
+    started = time.monotonic()
+    
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f'[Piper TTS] 📦 {done}/{total}')
+    
+    count, failed = build_bank(
+        path, items, partial(render_bank_item, formats=tuple(formats)), workers, 'piper', progress
+    )
+    for item, error in failed:
+        print(f'[Piper TTS] ⚠️ 合成失败: {item.get("text")}: {error}')
+    print(f'[Piper TTS] ✅ 音频库已生成: {count} 条，耗时 {time.monotonic() - started:.1f} 秒')
+    return 1 if failed else 0
+
+def start_warmup(items):
+    """在后台线程中预热（单线程执行，不与正常请求争抢太多CPU）"""
+    warmup_state.update(total=len(items), done=0, failed=0, finished=not items, seconds=None)
+    if items:
+        threading.Thread(target=run_warmup, args=(items,), name='piper-warmup', daemon=True).start()
+
+@app.route('/livez', methods=['GET'])
+def livez():
+    """存活检查：进程能响应即可"""
+    return {'status': 'ok'}
+
+def loaded_models():
+    """各声音当前使用的模型及是否已加载（只读内存中的索引，索引尚未建立时为空）"""
+    index = model_registry.current or {}
+    models = {}
+    for gender in MODEL_PREFERENCES:
+        model = resolve_model(gender, index)
+        if model is not None:
+            models[gender] = {'name': model.name, 'loaded': model.sha256 in voices}
+    return models
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪检查：模型加载完成且预热完成后才返回 200
+    
+    只读内存中的状态，不访问磁盘、不加载模型、不做推理。
+    """
+    models = loaded_models()
+    result = {
+        'models': models,
+        'loader': {
+            'models': dict(loader_state['models']),
+            'errors': dict(loader_state['errors']),
+            'finished': loader_state['finished'],
+            'seconds': loader_state['seconds'],
+        },
+        'warmup': dict(warmup_state),
+        'queue': synthesis_queue.stats() if synthesis_queue is not None else None,
+    }
+    if not loader_state['finished']:
+        return dict(result, status='loading'), 503
+    if not any(model['loaded'] for model in models.values()):
+        return dict(result, status='no_models'), 503
+    if not warmup_state['finished']:
+        return dict(result, status='warming_up'), 503
+    return dict(result, status='ok')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """服务端音频缓存统计（命中/未命中/淘汰次数、占用字节数）"""
+    store = get_audio_store()
+    stats = audio_cache.stats()
+    stats['encoded'] = encoded_cache.stats()
+    stats['disk'] = store.stats() if store is not None else None
+    stats['phonemes'] = {
+        model_hash[:12]: voice.phoneme_cache.stats()
+        for model_hash, voice in list(voices.items())
+        if getattr(voice, 'phoneme_cache', None) is not None
+    }
+    bank = get_audio_bank()
+    stats['bank'] = bank.stats() if bank is not None else None
+    stats['coalescing'] = single_flight.stats()
+    stats['batching'] = {
+        model_hash[:12]: voice.batcher.stats()
+        for model_hash, voice in list(voices.items())
+        if getattr(voice, 'batcher', None) is not None
+    }
+    return stats
+
+@app.route('/audio-bank', methods=['GET'])
+def audio_bank_file():
+    """下载预生成音频库文件（支持 Range，可作为音频精灵使用；HEAD 只返回大小）"""
+    bank = get_audio_bank()
+    if bank is None:
+        return {'error': '没有预生成音频库'}, 404
+    if etag_matches(request.headers.get('If-None-Match'), bank.etag):
+        return Response(status=304, headers={'ETag': bank.etag})
+    status, start, stop, headers = byte_range(request.headers.get('Range'), bank.size)
+    headers['ETag'] = bank.etag
+    return Response(bank.read(start, stop), status=status, mimetype='application/octet-stream', headers=headers)
+
+@app.route('/audio-bank/index', methods=['GET'])
+def audio_bank_index():
+    """预生成音频库的索引：各条目的键、文本、声音、在文件中的偏移和长度、采样率"""
+    bank = get_audio_bank()
+    if bank is None:
+        return {'error': '没有预生成音频库'}, 404
+    return bank.manifest()
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标（只读内存中的计数，不访问磁盘）"""
+    return Response(tts_metrics.REGISTRY.render(), content_type=tts_metrics.CONTENT_TYPE)
+
+@app.route('/health', methods=['GET'])
+def health():
+    """健康检查接口（只读内存中的模型索引和加载状态，不加载模型）"""
+    models = loaded_models()
+    if models:
+        result = {
+            'status': 'ok',
+            'service': 'piper-tts',
+            'models': {gender: {'name': model['name']} for gender, model in models.items()},
+            'loaded_models': [gender for gender, model in models.items() if model['loaded']],
+            'loading': not loader_state['finished'],
+            'cache': audio_cache.stats(),
+        }
+        if loader_state['errors']:
+            result['warning'] = f'部分模型加载失败但文件存在: {"; ".join(loader_state["errors"].values())}'
+        return result
+    if model_registry.current is None and not loader_state['finished']:
+        return {'status': 'starting', 'service': 'piper-tts'}, 503
+    return {
+        'status': 'error',
+        'service': 'piper-tts',
+        'error': '未找到模型文件',
+        'suggested_path': os.path.abspath(MODEL_DIR),
+        'note': '请下载模型文件，男声: xiaoyi-medium.onnx, 女声: xiaoyan-medium.onnx'
+    }, 500
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """列出可用的模型（来自模型索引，含语言、采样率、说话人等信息）"""
+    models = model_registry.models()
+    voices_in_use = {}
+    for gender in MODEL_PREFERENCES:
+        model = resolve_model(gender)
+        if model is not None:
+            voices_in_use[gender] = model.name
+    return {
+        'models': [model.name for model in models],
+        'details': [dict(model.to_dict(), loaded=model.sha256 in voices) for model in models],
+        'voices': voices_in_use,
+    }
+
+class QueueFullError(Exception):
+    """合成队列已满"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f'合成队列已满，请 {retry_after} 秒后重试')
+        self.retry_after = retry_after
+
+class SynthesisQueue:
+    """ASGI 模式下的合成准入队列
+    
+    合成在固定数量的合成线程里执行，排队的请求数超过 max_queue 时直接拒绝（503），
+    而不是无限堆积线程让所有请求一起变慢。Retry-After 按当前排队长度和平均合成耗时估算。
+    
+    排队顺序见 tts_scheduler.py：优先级之间严格优先，同一优先级内按房间和角色公平；
+    队列满时高优先级请求可以挤掉排队中的低优先级请求，排队过久的低优先级请求被丢弃。
+    """
+    
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = FairExecutor(workers, thread_name_prefix='piper-synth', stale_seconds=stale_seconds_from_env())
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.completed = 0
+        self.avg_service = 0.5  # 平均合成耗时（秒，指数滑动平均）
+        self.avg_wait = 0.0     # 平均排队时间（秒，指数滑动平均）
+    
+    def estimated_wait(self):
+        """新请求预计的排队时间（秒）"""
+        with self._lock:
+            backlog = self.queued + max(0, self.running - self.workers + 1)
+            return max(self.avg_wait, backlog * self.avg_service / self.workers)
+    
+    def admit(self, schedule=None, force=False):
+        """占用一个排队名额；队列已满时先尝试挤掉一个优先级更低的排队任务，不行则抛出 QueueFullError
+        Args:
+            schedule: 请求的调度信息（为空时不抢占）
+            force: 不检查队列长度（批量请求整体准入后，其中的条目用这种方式排队）
+        """
+        import math
         
-        if not text:
-            return {'error': '缺少 text 参数'}, 400
+        with self._lock:
+            full = not force and self.queued >= self.max_queue
+            if not full:
+                self.queued += 1
+        if full and schedule is not None and self.executor.preempt(schedule.priority):
+            # 被挤掉的任务在 _finished 中归还了名额
+            with self._lock:
+                self.queued += 1
+            full = False
+        if full:
+            with self._lock:
+                self.rejected += 1
+            QUEUE_REJECTED.inc(('full', PRIORITY_NAMES[schedule.priority] if schedule else ''))
+            raise QueueFullError(max(1, math.ceil(self.estimated_wait())))
+    
+    def check_capacity(self):
+        """只检查队列是否已满（不占用名额、不抢占），已满时抛出 QueueFullError"""
+        self.admit()
+        with self._lock:
+            self.queued -= 1
+    
+    def _submit(self, fn, schedule):
+        """按调度信息提交任务，返回 concurrent.futures.Future"""
+        future = self.executor.submit(self._wrap(fn, schedule), schedule or make_schedule())
+        future.add_done_callback(self._finished)
+        return future
+    
+    def _finished(self, future):
+        """没有执行就结束的任务（被抢占、排队过久或已取消）归还排队名额"""
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or isinstance(error, Rejected):
+            with self._lock:
+                self.queued -= 1
+        if isinstance(error, Rejected):
+            QUEUE_REJECTED.inc((error.reason, PRIORITY_NAMES[error.priority]))
+    
+    def _wrap(self, fn, schedule=None):
+        """包装任务：统计排队时间和合成耗时，并维护排队/执行计数"""
+        submitted = time.monotonic()
+        priority = PRIORITY_NAMES[schedule.priority] if schedule else ''
         
-        # 验证 gender 参数
-        if gender not in ['male', 'female']:
-            gender = 'female'  # 无效值使用默认值
+        def run():
+            started = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(started - submitted, (priority,))
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.avg_wait = 0.8 * self.avg_wait + 0.2 * (started - submitted)
+            try:
+                return fn()
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.avg_service = 0.8 * self.avg_service + 0.2 * (finished - started)
+        return run
+    
+    async def run(self, fn, schedule=None, cancellation=None):
+        """在合成线程中执行 fn（调用前必须已经 admit）
         
-        # 加载指定性别的语音模型（如果还没有加载）
-        voice = load_voice(gender)
+        被抢占或排队过久时抛出 Rejected；排队中被取消（cancellation）时撤下任务并抛出 Cancelled。
+        """
+        import asyncio
         
-        # 根据voice类型选择合成方式
-        if isinstance(voice, dict) and voice.get('type') == 'command':
-            # 使用命令行工具
-            import subprocess
-            import tempfile
+        future = self._submit(fn, schedule)
+        if cancellation is not None:
+            cancellation.on_cancel(future.cancel)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and cancellation is not None:
+                cancellation.check()
+            raise
+    
+    async def stream(self, make_iter, schedule=None, cancellation=None):
+        """在合成线程中迭代 make_iter()，把产出的数据逐个交给事件循环（调用前必须已经 admit）
+        
+        迭代方（客户端）提前离开时，合成线程在下一段之前停止；其余同 run()。
+        """
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        done = object()
+        stopped = threading.Event()
+        
+        def produce():
+            chunks = None
+            try:
+                # make_iter() 出错也要交给迭代方，否则迭代方一直等不到 done
+                chunks = make_iter()
+                for item in chunks:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(items.put_nowait, e)
+            finally:
+                if chunks is not None:
+                    chunks.close()
+                loop.call_soon_threadsafe(items.put_nowait, done)
+        
+        def not_run(future):
+            # produce 正常执行完时已经放入了 done；没有执行（被抢占、排队过久、被取消）
+            # 或执行器本身出错时，这里放入错误和 done，迭代方不会一直等下去
+            if future.cancelled():
+                reason = cancellation.reason if cancellation is not None else None
+                error = Cancelled(reason or 'cancelled')
+            else:
+                error = future.exception()
+                if error is None:
+                    return
+                if not isinstance(error, Exception):
+                    error = RuntimeError(f'合成任务异常结束: {error!r}')
+            loop.call_soon_threadsafe(items.put_nowait, error)
+            loop.call_soon_threadsafe(items.put_nowait, done)
+        
+        future = self._submit(produce, schedule)
+        future.add_done_callback(not_run)
+        if cancellation is not None:
+            cancellation.on_cancel(future.cancel)
+        try:
+            while True:
+                item = await items.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            future.cancel()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'running': self.running,
+                'rejected': self.rejected,
+                'preempted': self.executor.preempted,
+                'dropped': self.executor.dropped,
+                'queued_by_priority': self.executor.counts(),
+                'completed': self.completed,
+                'avg_service_seconds': round(self.avg_service, 4),
+                'avg_wait_seconds': round(self.avg_wait, 4),
+            }
+
+synthesis_queue = None  # ASGI 模式下的 SynthesisQueue
+
+def create_asgi_app(synthesis_threads, max_queue):
+    """创建 ASGI 应用（需要 fastapi 和 uvicorn：pip install fastapi uvicorn）
+    
+    合成走有界的 SynthesisQueue；/health、/models 等轻量接口不经过合成线程池，
+    合成满载时仍能及时响应。
+    """
+    global synthesis_queue
+    from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+    from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+    
+    synthesis_queue = SynthesisQueue(synthesis_threads, max_queue)
+    asgi_app = FastAPI(title='Piper TTS')
+    asgi_app.add_middleware(
+        CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+        expose_headers=[REQUEST_ID_HEADER, 'ETag', CACHE_STATUS_HEADER]
+    )
+    
+    def audio_result(parts, content_type, request_id=None, etag=None):
+        # 逐段发送响应体（带 Content-Length），与 Flask 模式一样不拼接PCM
+        async def body():
+            for part in parts:
+                yield part
+        
+        headers = {'Content-Length': str(sum(len(part) for part in parts)), 'Vary': 'Accept'}
+        if request_id is not None:
+            headers[REQUEST_ID_HEADER] = request_id
+        if etag is not None:
+            headers['ETag'] = etag
+        return StreamingResponse(body(), media_type=content_type, headers=headers)
+    
+    async def prefetch(chunks):
+        # 等到第一段数据再发送响应头：排队中被抢占或过期的流式请求也能返回 503
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+        
+        async def rest():
+            if first is not None:
+                yield first
+            async for chunk in chunks:
+                yield chunk
+        return rest()
+    
+    def rejected_result(e):
+        # 排队中被抢占或过期：与队列已满一样返回 503；超过请求的截止时间返回 504
+        import math
+        
+        if e.reason == 'deadline':
+            CANCELLED.inc(('deadline',))
+            return JSONResponse({'error': str(e), 'reason': e.reason}, status_code=504)
+        retry_after = max(1, math.ceil(synthesis_queue.estimated_wait()))
+        return JSONResponse(
+            {'error': str(e), 'reason': e.reason, 'retry_after': retry_after},
+            status_code=503,
+            headers={'Retry-After': str(retry_after)}
+        )
+    
+    async def finish_after_async_stream(chunks, endpoint, started, cancellation=None):
+        # 与 Flask 模式的 finish_after_stream 相同：最后一段发出（或客户端断开）时才算请求结束
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Cancelled as e:
+            CANCELLED.inc((e.reason,))
+        finally:
+            finish_request(endpoint, started, cancellation)
+    
+    async def cancel_on_disconnect(http_request, cancellation):
+        # 请求体读完后 receive() 只在客户端断开时返回 http.disconnect：取消合成（下一句之前停止）
+        while (await http_request.receive())['type'] != 'http.disconnect':
+            pass
+        cancellation.cancel('disconnected')
+    
+    def json_result(result):
+        # 复用 Flask 视图函数的返回值：dict 或 (dict, 状态码)
+        if isinstance(result, tuple):
+            return JSONResponse(result[0], status_code=result[1])
+        return JSONResponse(result)
+    
+    @asgi_app.api_route('/api/tts', methods=['GET', 'POST', 'HEAD'])
+    async def asgi_synthesize(http_request: Request):
+        import asyncio
+        
+        started = time.perf_counter()
+        INFLIGHT.inc()
+        streaming = False
+        job = None
+        watcher = None
+        try:
+            try:
+                if http_request.method == 'POST':
+                    data = await http_request.json()
+                else:
+                    data = dict(http_request.query_params)
+                job = parse_tts_request(
+                    data,
+                    http_request.query_params,
+                    http_request.headers.get('accept')
+                )
+                begin_request(job, http_request.headers)
+            except ValueError as e:
+                return JSONResponse({'error': str(e)}, status_code=400)
+            request_id = job.cancellation.request_id
+            stream_headers = {'Vary': 'Accept', REQUEST_ID_HEADER: request_id}
+            watcher = asyncio.ensure_future(cancel_on_disconnect(http_request, job.cancellation))
             
-            piper_cmd = voice['cmd']
-            # 使用已找到的模型路径
-            model_path = voice.get('model_path')
-            if not model_path:
-                model_path = find_model_path(gender)
-                if not model_path:
-                    raise FileNotFoundError(f'未找到Piper TTS模型文件（{gender}）')
-                voice['model_path'] = model_path
+            # 模型加载、缓存查询和缓存命中后的转码在默认线程池完成，不占用合成队列
+            await run_in_threadpool(job.prepare)
+            REQUESTS.inc(('tts',) + job.labels)
+            if job.not_modified(http_request.headers.get('if-none-match')):
+                return Response(status_code=304, headers={'ETag': job.etag, 'Vary': 'Accept'})
+            cached = await run_in_threadpool(job.lookup_response)
+            if http_request.method == 'HEAD':
+                headers, content_type = job.probe_headers(cached)
+                response = Response(status_code=200, media_type=content_type, headers=headers)
+                if cached is None:
+                    del response.headers['content-length']  # 未命中时大小未知
+                return response
+            if cached is not None:
+                return audio_result(*cached, request_id, job.etag)
             
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
+            if job.follow():
+                # 相同的合成已在合成队列中进行：在默认线程池里等它的结果，不再占用合成队列
+                if job.stream and job.output.streamable:
+                    streaming = True
+                    return StreamingResponse(
+                        finish_after_async_stream(
+                            iterate_in_threadpool(job.stream_chunks()), 'tts', started, job.cancellation
+                        ),
+                        media_type=job.stream_content_type(),
+                        headers=stream_headers
+                    )
+                return audio_result(*await run_in_threadpool(job.render), request_id, job.etag)
             
             try:
-                # 调用piper命令行工具
-                result = subprocess.run(
-                    [piper_cmd, '--model', model_path, '--output_file', tmp_path],
-                    input=text.encode('utf-8'),
-                    capture_output=True,
-                    check=True
-                )
-                
-                # 读取生成的音频文件
-                with open(tmp_path, 'rb') as f:
-                    audio_data = f.read()
-                
-                # 删除临时文件
-                os.unlink(tmp_path)
-                
-                return send_file(
-                    io.BytesIO(audio_data),
-                    mimetype='audio/wav',
-                    as_attachment=False
+                synthesis_queue.admit(job.schedule)
+            except QueueFullError as e:
+                return JSONResponse(
+                    {'error': str(e), 'retry_after': e.retry_after},
+                    status_code=503,
+                    headers={'Retry-After': str(e.retry_after)}
                 )
-            except subprocess.CalledProcessError as e:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-                raise Exception(f'piper命令行工具执行失败: {e.stderr.decode()}')
-        else:
-            # 使用Python包
-            # synthesize() 返回AudioChunk对象的生成器
-            audio_generator = voice.synthesize(text)
             
-            # 收集所有AudioChunk并获取音频参数
-            audio_chunks = []
-            sample_rate = None
-            sample_channels = None
-            sample_width = None
+            if job.stream and job.output.streamable:
+                chunks = await prefetch(synthesis_queue.stream(job.stream_chunks, job.schedule, job.cancellation))
+                streaming = True
+                return StreamingResponse(
+                    finish_after_async_stream(chunks, 'tts', started, job.cancellation),
+                    media_type=job.stream_content_type(),
+                    headers=stream_headers
+                )
             
-            for chunk in audio_generator:
-                # 获取音频参数（从第一个chunk）
-                if sample_rate is None:
-                    sample_rate = getattr(chunk, 'sample_rate', 22050)
-                    sample_channels = getattr(chunk, 'sample_channels', 1)
-                    sample_width = getattr(chunk, 'sample_width', 2)
-                
-                # AudioChunk对象有audio_int16_bytes属性，包含PCM音频数据
-                if hasattr(chunk, 'audio_int16_bytes'):
-                    audio_chunks.append(chunk.audio_int16_bytes)
-                elif hasattr(chunk, 'audio_int16_array'):
-                    # 如果是数组，转换为字节
-                    import numpy as np
-                    audio_chunks.append(chunk.audio_int16_array.tobytes())
-                elif isinstance(chunk, bytes):
-                    audio_chunks.append(chunk)
-                else:
-                    audio_chunks.append(bytes(chunk))
+            return audio_result(
+                *await synthesis_queue.run(job.render, job.schedule, job.cancellation), request_id, job.etag
+            )
+        except Rejected as e:
+            return rejected_result(e)
+        except Cancelled as e:
+            CANCELLED.inc((e.reason,))
+            return JSONResponse({'error': str(e), 'reason': e.reason}, status_code=cancelled_status(e.reason))
+        except Exception as e:
+            print(f'[Piper TTS] ❌ 合成失败: {e}')
+            return JSONResponse({'error': str(e)}, status_code=500)
+        finally:
+            if watcher is not None:
+                # 流式响应由 StreamingResponse 自己感知客户端断开
+                watcher.cancel()
+            if not streaming:
+                finish_request('tts', started, job.cancellation if job is not None else None)
+    
+    @asgi_app.delete('/api/tts/{request_id}')
+    async def asgi_cancel_synthesis(request_id: str):
+        return json_result(cancel_synthesis(request_id))
+    
+    @asgi_app.post('/api/tts/batch')
+    async def asgi_synthesize_batch(http_request: Request):
+        import asyncio
+        
+        try:
+            groups, errors = parse_batch_request(await http_request.json())
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        
+        # 整个批次按一个请求做准入检查；条目逐个进入合成队列，同一批次最多占用全部合成线程
+        try:
+            synthesis_queue.check_capacity()
+        except QueueFullError as e:
+            return JSONResponse(
+                {'error': str(e), 'retry_after': e.retry_after},
+                status_code=503,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+        
+        async def lines():
+            for item_id, error in errors:
+                for line in batch_lines([item_id], error=error):
+                    yield line
             
-            # 将所有chunk合并为PCM数据
-            pcm_data = b''.join(audio_chunks)
+            parallel = asyncio.Semaphore(synthesis_queue.workers)
             
-            # 将PCM数据包装成WAV格式
-            audio_data = pcm_to_wav(pcm_data, sample_rate, sample_channels, sample_width)
+            async def render(group):
+                async with parallel:
+                    synthesis_queue.admit(force=True)
+                    try:
+                        return group, await synthesis_queue.run(lambda: render_job(group['job']), group['job'].schedule), None
+                    except Exception as e:
+                        print(f'[Piper TTS] ❌ 批量合成失败: {e}')
+                        return group, None, str(e)
             
-            # 返回音频数据
-            return send_file(
-                io.BytesIO(audio_data),
-                mimetype='audio/wav',
-                as_attachment=False
+            for finished in asyncio.as_completed([render(group) for group in groups]):
+                group, audio, error = await finished
+                for line in batch_lines(group['ids'], audio=audio, error=error):
+                    yield line
+        
+        started = time.perf_counter()
+        INFLIGHT.inc()
+        return StreamingResponse(
+            finish_after_async_stream(lines(), 'batch', started),
+            media_type='application/x-ndjson',
+            headers={'X-Batch-Unique': str(len(groups))}
+        )
+    
+    @asgi_app.websocket('/api/tts/ws')
+    async def asgi_synthesize_ws(websocket: WebSocket):
+        """边收文本边合成：客户端推送大模型流式输出的文本片段，服务端每凑齐一个子句就合成并推回音频
+        
+        客户端消息（JSON）：
+            {"type": "start", "gender": ..., "speaker": ..., "priority": ..., ...}  可选，参数与 /api/tts 相同，
+                                                                                  也可以放在连接URL的查询参数里
+            {"type": "text", "text": "片段"}   追加文本，在句子/子句边界切开（tts_clauses.py）
+            {"type": "flush"}                 不再等后续文本，把缓冲区里剩下的合成掉
+            {"type": "end"}                   同 flush，全部子句发完后回复 done 并关闭连接
+        服务端消息：每个子句先发 {"type": "clause", "index", "text", "content_type"}，
+        再发若干二进制帧（audio/L16，可用 rate 降采样），最后发 {"type": "clause_end", "index", "bytes"}；
+        单个子句失败时发 {"type": "error", "index", "error", "status"} 并继续下一个子句。
+        子句按顺序逐个合成，与客户端继续推送文本同时进行。连接断开或 DELETE /api/tts/<id> 取消时停止合成。
+        """
+        import asyncio
+        import json
+        
+        await websocket.accept()
+        started = time.perf_counter()
+        INFLIGHT.inc()
+        options = {key: value for key, value in websocket.query_params.items() if key != 'id'}
+        cancellation = Cancellation(
+            websocket.headers.get(REQUEST_ID_HEADER) or websocket.query_params.get('id') or uuid.uuid4().hex
+        )
+        with active_requests_lock:
+            active_requests[cancellation.request_id] = cancellation
+        splitter = ClauseSplitter()
+        clauses = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        # 取消时唤醒正在等下一个子句的合成任务（DELETE 可能来自其他线程）
+        cancellation.on_cancel(lambda: loop.call_soon_threadsafe(clauses.put_nowait, None))
+        
+        def clause_job(text):
+            # 每个子句是一次独立的合成（各自命中缓存、合并相同的合成），共用连接的取消令牌
+            job = parse_tts_request(dict(options, text=text, format='l16'), {})
+            job.cancellation = cancellation
+            return job
+        
+        async def send_clause(index, text):
+            job = clause_job(text)
+            await run_in_threadpool(job.prepare)
+            REQUESTS.inc(('ws',) + job.labels)
+            cached = await run_in_threadpool(job.lookup)
+            if cached is not None:
+                pcm_data, audio_format = cached
+                chunks = iterate_in_threadpool(
+                    tts_audio_formats.stream_chunks(((segment, audio_format) for segment in pcm_data.segments), job.output)
+                )
+            elif job.follow():
+                chunks = iterate_in_threadpool(job.stream_chunks())
+            else:
+                synthesis_queue.admit(job.schedule)
+                chunks = synthesis_queue.stream(job.stream_chunks, job.schedule, cancellation)
+            await websocket.send_json(
+                {'type': 'clause', 'index': index, 'text': text, 'content_type': job.stream_content_type()}
             )
-    except Exception as e:
-        print(f'[Piper TTS] ❌ 合成失败: {e}')
-        return {'error': str(e)}, 500
-
-@app.route('/health', methods=['GET'])
-def health():
-    """健康检查接口"""
-    try:
-        # 检查模型文件是否存在（不强制加载）
-        model_dir = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'models')
-        possible_models = [
-            'xiaoyan-medium.onnx',
-            'zh_CN-huayan-medium.onnx',
-            'zh_CN-xiaoyan-medium.onnx',
-        ]
+            sent = 0
+            async for chunk in chunks:
+                await websocket.send_bytes(chunk)
+                sent += len(chunk)
+            await websocket.send_json({'type': 'clause_end', 'index': index, 'bytes': sent})
+        
+        async def synthesize_clauses():
+            index = 0
+            while True:
+                text = await clauses.get()
+                cancellation.check()
+                if text is None:
+                    return index
+                try:
+                    await send_clause(index, text)
+                except QueueFullError as e:
+                    await websocket.send_json(
+                        {'type': 'error', 'index': index, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+                    )
+                except Rejected as e:
+                    await websocket.send_json({
+                        'type': 'error', 'index': index, 'error': str(e), 'reason': e.reason,
+                        'status': 504 if e.reason == 'deadline' else 503
+                    })
+                except ValueError as e:
+                    await websocket.send_json({'type': 'error', 'index': index, 'error': str(e), 'status': 400})
+                except (Cancelled, WebSocketDisconnect):
+                    raise
+                except Exception as e:
+                    print(f'[Piper TTS] ❌ 合成失败: {e}')
+                    await websocket.send_json({'type': 'error', 'index': index, 'error': str(e), 'status': 500})
+                index += 1
         
-        found_models = {}
-        for gender in ['male', 'female']:
-            model_path = find_model_path(gender)
-            if model_path:
-                model_name = os.path.basename(model_path)
-                found_models[gender] = {
-                    'name': model_name,
-                    'path': model_path
-                }
-        
-        if found_models:
-            # 尝试加载模型以检查服务是否正常
+        synthesizer = asyncio.ensure_future(synthesize_clauses())
+        receiver = None
+        try:
+            while True:
+                receiver = asyncio.ensure_future(websocket.receive_text())
+                await asyncio.wait({receiver, synthesizer}, return_when=asyncio.FIRST_COMPLETED)
+                if not receiver.done():
+                    # 合成提前结束：被取消（DELETE）或发送失败
+                    receiver.cancel()
+                    synthesizer.result()
+                try:
+                    message = json.loads(receiver.result())
+                except ValueError:
+                    message = None
+                kind = message.get('type', 'text') if isinstance(message, dict) else None
+                if kind == 'start':
+                    options.update({key: value for key, value in message.items() if key != 'type'})
+                    try:
+                        parse_tts_request(dict(options, text='.'), {})
+                    except ValueError as e:
+                        await websocket.send_json({'type': 'error', 'error': str(e), 'status': 400})
+                        await websocket.close(code=1008)
+                        return
+                elif kind == 'text':
+                    for clause in splitter.push(str(message.get('text') or '')):
+                        clauses.put_nowait(clause)
+                elif kind in ('flush', 'end'):
+                    for clause in splitter.finish():
+                        clauses.put_nowait(clause)
+                    if kind == 'end':
+                        clauses.put_nowait(None)
+                        break
+                else:
+                    error = '消息必须是 JSON 对象' if kind is None else f'未知的消息类型: {kind}'
+                    await websocket.send_json({'type': 'error', 'error': error, 'status': 400})
+            count = await synthesizer
+            await websocket.send_json({'type': 'done', 'clauses': count})
+            await websocket.close()
+        except WebSocketDisconnect:
+            # 没有发 end 就断开：停止还没合成完的子句
+            CANCELLED.inc(('disconnected',))
+            cancellation.cancel('disconnected')
+        except Cancelled as e:
+            CANCELLED.inc((e.reason,))
+            await websocket.send_json({'type': 'cancelled', 'reason': e.reason})
+            await websocket.close()
+        finally:
+            synthesizer.cancel()
+            if receiver is not None:
+                receiver.cancel()
+            finish_request('ws', started, cancellation)
+    
+    @asgi_app.get('/health')
+    async def asgi_health():
+        return json_result(health())
+    
+    @asgi_app.get('/livez')
+    async def asgi_livez():
+        return json_result(livez())
+    
+    @asgi_app.get('/readyz')
+    async def asgi_readyz():
+        return json_result(readyz())
+    
+    @asgi_app.get('/models')
+    async def asgi_list_models():
+        return json_result(list_models())
+    
+    # 以下三个接口第一次调用时打开 SQLite 索引（校验、崩溃恢复）或映射音频库文件，统计也要查 SQLite，
+    # 用普通函数让 FastAPI 放到线程池执行，不阻塞事件循环
+    @asgi_app.get('/cache/stats')
+    def asgi_cache_stats():
+        return json_result(cache_stats())
+    
+    @asgi_app.api_route('/audio-bank', methods=['GET', 'HEAD'])
+    def asgi_audio_bank_file(request: Request):
+        bank = get_audio_bank()
+        if bank is None:
+            return JSONResponse({'error': '没有预生成音频库'}, status_code=404)
+        if etag_matches(request.headers.get('if-none-match'), bank.etag):
+            return Response(status_code=304, headers={'ETag': bank.etag})
+        status, start, stop, headers = byte_range(request.headers.get('range'), bank.size)
+        headers['ETag'] = bank.etag
+        if request.method == 'HEAD':
+            return Response(status_code=status, media_type='application/octet-stream', headers=headers)
+        return StreamingResponse(
+            iterate_in_threadpool(bank.read(start, stop)), status_code=status,
+            media_type='application/octet-stream', headers=headers
+        )
+    
+    @asgi_app.get('/audio-bank/index')
+    def asgi_audio_bank_index():
+        return json_result(audio_bank_index())
+    
+    @asgi_app.get('/metrics')
+    async def asgi_metrics():
+        return PlainTextResponse(tts_metrics.REGISTRY.render(), media_type=tts_metrics.CONTENT_TYPE)
+    
+    @asgi_app.get('/queue/stats')
+    async def asgi_queue_stats():
+        return synthesis_queue.stats()
+    
+    return asgi_app
+
+def run_asgi(asgi_app, host=None, port=None, fd=None):
+    """用 uvicorn 运行 ASGI 应用（fd 为已监听的socket，多进程模式使用）"""
+    import uvicorn
+    
+    if fd is not None:
+        config = uvicorn.Config(asgi_app, fd=fd, log_level='info')
+    else:
+        config = uvicorn.Config(asgi_app, host=host, port=port, log_level='info')
+    uvicorn.Server(config).run()
+
+def serve_prefork(host, port, workers, reuse_port=False, asgi_options=None, warmup_items=()):
+    """多进程（prefork）服务模式
+    
+    调用前主进程已加载好模型；这里 fork 出 workers 个子进程，每个子进程用多线程 WSGI 服务处理请求。
+    默认所有子进程共用主进程创建的监听socket；reuse_port=True 时每个子进程各自用 SO_REUSEPORT 绑定端口，
+    由内核在进程间分配连接。子进程意外退出会被主进程重新拉起。
+    asgi_options 不为空时子进程运行 ASGI 模式（参数传给 create_asgi_app）。
+    预热清单按编号分给各个子进程，结果经共享磁盘存储互相可见。
+    """
+    import gc
+    import signal
+    import socket
+    from werkzeug.serving import make_server
+    
+    listener = None
+    if not reuse_port:
+        listener = socket.create_server((host, port), backlog=1024)
+    
+    # 把主进程已有的对象移出GC跟踪范围，避免子进程GC扫描时触发写时复制
+    gc.freeze()
+    
+    children = {}  # {pid: 子进程编号}
+    stopping = False
+    
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
             try:
-                for gender in found_models.keys():
-                    load_voice(gender)
-                return {
-                    'status': 'ok',
-                    'service': 'piper-tts',
-                    'models': found_models,
-                    'loaded_models': list(MODEL_PATHS.keys())
-                }
+                sock = listener
+                if sock is None:
+                    sock = socket.create_server((host, port), backlog=1024, reuse_port=True)
+                print(f'[Piper TTS] 👷 工作进程 #{index} 已启动 (pid {os.getpid()})')
+                tts_metrics.REGISTRY.const_labels['worker'] = str(index)
+                start_model_watcher()
+                start_warmup(list(warmup_items)[index::workers])
+                if asgi_options is not None:
+                    # 合成线程池必须在 fork 之后创建
+                    run_asgi(create_asgi_app(**asgi_options), fd=sock.fileno())
+                else:
+                    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+                    server.serve_forever()
             except Exception as e:
-                # 即使加载失败，如果模型文件存在，也认为服务可用
-                return {
-                    'status': 'ok',
-                    'service': 'piper-tts',
-                    'models': found_models,
-                    'warning': f'部分模型加载失败但文件存在: {str(e)}'
-                }
-        else:
-            return {
-                'status': 'error',
-                'service': 'piper-tts',
-                'error': '未找到模型文件',
-                'suggested_path': model_dir,
-                'note': '请下载模型文件，男声: xiaoyi-medium.onnx, 女声: xiaoyan-medium.onnx'
-            }, 500
-    except Exception as e:
-        return {
-            'status': 'error',
-            'service': 'piper-tts',
-            'error': str(e)
-        }, 500
+                print(f'[Piper TTS] ❌ 工作进程 #{index} 异常退出: {e}')
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = index
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f'[Piper TTS] ⚠️ 工作进程 #{index} 已退出 (状态 {status})，1秒后重启')
+            time.sleep(1)
+            spawn(index)
+    print('[Piper TTS] 👋 服务已停止')
 
-@app.route('/models', methods=['GET'])
-def list_models():
-    """列出可用的模型"""
-    models_dir = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'models')
-    if os.path.exists(models_dir):
-        models = [f for f in os.listdir(models_dir) if f.endswith('.onnx')]
-        return {'models': models}
-    return {'models': []}
+def parse_args():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Piper TTS HTTP 服务')
+    parser.add_argument('--host', default=os.environ.get('PIPER_TTS_HOST', '0.0.0.0'), help='监听地址（默认 0.0.0.0）')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PIPER_TTS_PORT', '5000')), help='监听端口（默认 5000）')
+    parser.add_argument(
+        '--workers', type=int, default=int(os.environ.get('PIPER_TTS_WORKERS', '1')),
+        help='工作进程数；大于1时启用多进程模式，模型在主进程加载后 fork 共享（默认 1）'
+    )
+    parser.add_argument(
+        '--reuse-port', action='store_true',
+        help='多进程模式下每个工作进程用 SO_REUSEPORT 各自监听，而不是共用一个监听socket'
+    )
+    parser.add_argument(
+        '--asgi', action='store_true',
+        help='使用 ASGI（uvicorn）服务：合成在有界线程池中执行，队列满时返回 503 + Retry-After'
+    )
+    parser.add_argument(
+        '--synthesis-threads', type=int, default=int(os.environ.get('PIPER_TTS_SYNTHESIS_THREADS', os.cpu_count() or 1)),
+        help='ASGI 模式下每个进程的合成线程数（默认 CPU 核数）'
+    )
+    parser.add_argument(
+        '--max-queue', type=int, default=int(os.environ.get('PIPER_TTS_MAX_QUEUE', '16')),
+        help='ASGI 模式下每个进程最多排队的合成请求数，超过后返回 503（默认 16）'
+    )
+    parser.add_argument(
+        '--ort-tuning', choices=['off', 'auto', 'recalibrate'], default=ORT_TUNING,
+        help='ONNX Runtime 会话参数校准：auto 每台主机每个模型校准一次并保存，recalibrate 强制重新校准（默认 off；多进程模式下不生效）'
+    )
+    parser.add_argument(
+        '--warmup-manifest', default=os.environ.get('PIPER_TTS_WARMUP_MANIFEST'),
+        help='启动后在后台预先合成的语句清单（JSON 或文本，例如 tts-services/warmup-manifest.json）'
+    )
+    parser.add_argument(
+        '--build-audio-bank', metavar='PATH',
+        help='不启动服务，把固定台词（i18n 文案、COMMON_GAME_PHRASES、预热清单）合成为预生成音频库后退出'
+    )
+    parser.add_argument(
+        '--bank-voice', action='append', default=None,
+        help='音频库包含的声音：female、male 或 female:说话人（可多次指定，默认 female 和 male）'
+    )
+    parser.add_argument(
+        '--bank-format', action='append', default=[],
+        help='音频库额外包含的输出格式，如 opus、adpcm（可多次指定，PCM 总是包含）'
+    )
+    parser.add_argument(
+        '--bank-workers', type=int, default=os.cpu_count() or 1, help='构建音频库的进程数（默认 CPU 核数）'
+    )
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
+    if args.build_audio_bank:
+        manifest_items = load_warmup_manifest(args.warmup_manifest) if args.warmup_manifest else []
+        sys.exit(build_audio_bank(
+            args.build_audio_bank, args.bank_voice or ['female', 'male'], args.bank_format, args.bank_workers,
+            manifest_items
+        ))
+    ORT_TUNING = args.ort_tuning
+    prefork = args.workers > 1
+    if prefork and not hasattr(os, 'fork'):
+        print('[Piper TTS] ⚠️ 当前系统不支持 fork，改用单进程模式')
+        prefork = False
+    
     print('=' * 60)
     print('[Piper TTS] 🚀 启动服务...')
     print('[Piper TTS] 📖 安装指南: docs/setup/piper-tts-setup.md')
     print('=' * 60)
     
-    try:
-        # 尝试加载模型
-        load_voice()
-    except Exception as e:
-        print(f'[Piper TTS] ⚠️ 模型加载失败: {e}')
-        print('[Piper TTS] 💡 服务仍会启动，但TTS功能可能不可用')
-        print('[Piper TTS] 💡 请参考安装指南下载模型')
+    if prefork:
+        # 多进程模式：fork 前在主进程加载所有模型，子进程共享（加载状态随 fork 继承）
+        if ORT_TUNING != 'off':
+            print('[Piper TTS] 💡 多进程模式下每个工作进程单线程推理，忽略 --ort-tuning')
+        DEFAULT_SESSION_OPTIONS = fork_safe_session_options
+        load_models(['female', 'male'])
+    
+    print(f'[Piper TTS] ✅ 服务已启动: http://localhost:{args.port}')
+    print(f'[Piper TTS] 📍 健康检查: http://localhost:{args.port}/health')
+    print(f'[Piper TTS] 📍 存活/就绪: http://localhost:{args.port}/livez  /readyz')
+    print(f'[Piper TTS] 📍 TTS接口: http://localhost:{args.port}/api/tts')
+    print(f'[Piper TTS] 📍 批量接口: http://localhost:{args.port}/api/tts/batch')
+    if args.asgi:
+        print(f'[Piper TTS] 📍 流式文本接口: ws://localhost:{args.port}/api/tts/ws')
+    print(f'[Piper TTS] 📍 缓存统计: http://localhost:{args.port}/cache/stats')
+    print(f'[Piper TTS] 📍 预生成音频库: http://localhost:{args.port}/audio-bank  /audio-bank/index')
+    print(f'[Piper TTS] 📍 指标: http://localhost:{args.port}/metrics')
+    if prefork:
+        print(f'[Piper TTS] 👷 多进程模式: {args.workers} 个工作进程')
+    warmup_items = []
+    if args.warmup_manifest:
+        try:
+            warmup_items = load_warmup_manifest(args.warmup_manifest)
+            print(f'[Piper TTS] 🔥 预热清单: {len(warmup_items)} 条（{args.warmup_manifest}）')
+        except Exception as e:
+            print(f'[Piper TTS] ⚠️ 预热清单读取失败: {e}')
     
-    print(f'[Piper TTS] ✅ 服务已启动: http://localhost:5000')
-    print(f'[Piper TTS] 📍 健康检查: http://localhost:5000/health')
-    print(f'[Piper TTS] 📍 TTS接口: http://localhost:5000/api/tts')
+    asgi_options = None
+    if args.asgi:
+        asgi_options = {'synthesis_threads': args.synthesis_threads, 'max_queue': args.max_queue}
+        print(f'[Piper TTS] ⚡ ASGI 模式: {args.synthesis_threads} 个合成线程，最多排队 {args.max_queue} 个请求')
     print('=' * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=False)
-
+    if prefork:
+        serve_prefork(args.host, args.port, args.workers, args.reuse_port, asgi_options, warmup_items)
+    else:
+        # 单进程模式：先开始监听，模型在后台加载（含 ORT 校准），加载完成后再轮询模型目录和预热
+        warmup_state.update(total=len(warmup_items), finished=not warmup_items)
+        
+        def after_load():
+            start_model_watcher()
+            start_warmup(warmup_items)
+        
+        start_model_loader(['female', 'male'], then=after_load)
+        if asgi_options is not None:
+            run_asgi(create_asgi_app(**asgi_options), args.host, args.port)
+        else:
+            app.run(host=args.host, port=args.port, debug=False, threaded=True)
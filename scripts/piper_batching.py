@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 推理的动态微批处理（micro-batching）
+
+并发的请求各自以 batch=1 调用 ONNX Runtime 会话，游戏台词又短，SIMD 和线程池都吃不满。
+这里给每个会话挂一个批处理器：各请求线程把一句的音素ID交给它，
+批处理线程把同时到达、合成参数相同（scales 一致，说话人可以不同）且音素长度相近的句子
+补齐成一个批次推理一次，再按每条的有效长度切开，交还给各自的请求线程。
+
+输出长度：按模型预测的各音素时长（w_ceil）求和再乘 hop_length。补齐部分经过解码器后并不为零，
+不能靠找最后的非零帧来切，因此只有带时长输出的会话（开启批处理时由 piper_ort_format.with_durations()
+加载时加上，需要 onnx 包；.ort 文件要用 --durations 转换）才做批处理，见 has_durations()。
+
+等待窗口自适应：空闲时到达的请求立即推理，不增加延迟；上一批凑到了多条（有并发）时窗口加倍，
+直到上限；只有一条时减半，负载下降后很快回到 0。
+
+批处理线程在第一次推理时启动（多进程模式下在子进程里启动，fork 之前加载的模型也能用）。
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+# 窗口小于该值（秒）时视为 0
+MIN_WINDOW = 0.0002
+
+
+class _Pending:
+    """一句等待推理的音素ID"""
+
+    __slots__ = ('phoneme_ids', 'scales', 'speaker_id', 'future', 'arrived')
+
+    def __init__(self, phoneme_ids, scales, speaker_id):
+        self.phoneme_ids = phoneme_ids
+        self.scales = scales
+        self.speaker_id = speaker_id
+        self.future = Future()
+        self.arrived = time.monotonic()
+
+
+def has_durations(session):
+    """会话是否输出各音素的时长（第二个输出）：没有时无法切开批内各句的音频，不能批处理"""
+    return len(session.get_outputs()) > 1
+
+
+class MicroBatcher:
+    """一个 ONNX Runtime 会话的推理批处理器（线程安全）
+
+    Args:
+        session: onnxruntime.InferenceSession（必须带时长输出，见 has_durations()）
+        config: PiperConfig（取默认 scales、说话人数和 hop_length）
+        max_window: 等待窗口上限（秒）
+        max_batch: 每批最多的句数
+        length_ratio: 同一批中最长与最短句子的音素数之比上限（限制补齐浪费）
+        workers: 批处理线程数（一个在推理时另一个可以继续收集下一批）
+        on_batch: on_batch(批大小)，每次推理后调用（用于指标）
+    """
+
+    def __init__(self, session, config, max_window=0.005, max_batch=8, length_ratio=1.5, workers=1,
+                 on_batch=None):
+        self.session = session
+        self.config = config
+        self.max_window = max_window
+        self.max_batch = max(1, max_batch)
+        self.length_ratio = max(1.0, length_ratio)
+        self.workers = max(1, workers)
+        self.on_batch = on_batch
+        self.hop_length = getattr(config, 'hop_length', 256)
+        self.has_sid = any(item.name == 'sid' for item in session.get_inputs())
+        self.window = 0.0
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._pid = None
+        self._idle_since = time.monotonic()
+        self._running = 0
+
+    def scales_for(self, syn_config):
+        """与 PiperVoice.phoneme_ids_to_audio 相同的参数取值：(noise_scale, length_scale, noise_w_scale)"""
+        config = self.config
+        length_scale = getattr(syn_config, 'length_scale', None)
+        noise_scale = getattr(syn_config, 'noise_scale', None)
+        noise_w_scale = getattr(syn_config, 'noise_w_scale', None)
+        return (
+            config.noise_scale if noise_scale is None else noise_scale,
+            config.length_scale if length_scale is None else length_scale,
+            config.noise_w_scale if noise_w_scale is None else noise_w_scale,
+        )
+
+    def speaker_for(self, syn_config):
+        if not self.has_sid or self.config.num_speakers <= 1:
+            return None
+        speaker_id = getattr(syn_config, 'speaker_id', None)
+        return self.config.default_speaker_id if speaker_id is None else speaker_id
+
+    def infer(self, phoneme_ids, syn_config=None):
+        """推理一句，返回 float 音频数组（与 PiperVoice.phoneme_ids_to_audio 相同）；阻塞到所在批次完成"""
+        item = _Pending(list(phoneme_ids), self.scales_for(syn_config), self.speaker_for(syn_config))
+        with self._cond:
+            self._ensure_workers()
+            self._pending.append(item)
+            self._cond.notify()
+        return item.future.result()
+
+    def _ensure_workers(self):
+        # fork 出的子进程里没有父进程的线程：按进程号判断，需要时重新启动
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._running = 0
+        for index in range(self.workers):
+            threading.Thread(target=self._loop, name=f'piper-batch-{index}', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            self._run(batch)
+
+    def _collect(self):
+        """取下一批：没有并发时立即返回最早的一句，有并发时在窗口内等待更多的句子"""
+        with self._cond:
+            while True:
+                while not self._pending:
+                    self._cond.wait()
+                # 空闲了一个窗口以上时到达的请求不等待
+                idle = self._running == 0 and time.monotonic() - self._idle_since > self.max_window
+                if self.window > 0 and not idle:
+                    deadline = self._pending[0].arrived + self.window
+                    while 0 < len(self._pending) < self.max_batch:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                # 等待期间可能被另一个批处理线程取走
+                if self._pending:
+                    break
+            batch = self._take()
+            self._running += 1
+            # 凑到了多条说明有并发，窗口加倍；否则减半
+            if len(batch) > 1:
+                self.window = min(self.max_window, max(self.window * 2, MIN_WINDOW))
+            else:
+                self.window = self.window / 2 if self.window / 2 >= MIN_WINDOW else 0.0
+            return batch
+
+    def _take(self):
+        """从等待的句子中取出一批：以最早到达的一句为准，取参数相同、长度相近的句子（最接近的优先）"""
+        first = self._pending[0]
+        length = len(first.phoneme_ids)
+        low, high = length / self.length_ratio, length * self.length_ratio
+        candidates = [
+            item for item in self._pending[1:]
+            if item.scales == first.scales and low <= len(item.phoneme_ids) <= high
+        ]
+        candidates.sort(key=lambda item: abs(len(item.phoneme_ids) - length))
+        batch = [first] + candidates[:self.max_batch - 1]
+        taken = set(map(id, batch))
+        self._pending = [item for item in self._pending if id(item) not in taken]
+        return batch
+
+    def _run(self, batch):
+        try:
+            outputs = self._infer_batch(batch)
+        except BaseException as e:
+            for item in batch:
+                item.future.set_exception(e)
+        else:
+            for item, audio in zip(batch, outputs):
+                item.future.set_result(audio)
+        finally:
+            with self._cond:
+                self._running -= 1
+                self.batches += 1
+                self.items += len(batch)
+                if self._running == 0:
+                    self._idle_since = time.monotonic()
+            if self.on_batch is not None:
+                self.on_batch(len(batch))
+
+    def _infer_batch(self, batch):
+        import numpy as np
+        
+        lengths = [len(item.phoneme_ids) for item in batch]
+        phoneme_ids = np.zeros((len(batch), max(lengths)), dtype=np.int64)
+        for row, item in enumerate(batch):
+            phoneme_ids[row, :lengths[row]] = item.phoneme_ids
+        args = {
+            'input': phoneme_ids,
+            'input_lengths': np.array(lengths, dtype=np.int64),
+            'scales': np.array(batch[0].scales, dtype=np.float32),
+        }
+        if batch[0].speaker_id is not None:
+            args['sid'] = np.array([item.speaker_id for item in batch], dtype=np.int64)
+
+        result = self.session.run(None, args)
+        audio = result[0].reshape(len(batch), -1)
+        if len(batch) == 1:
+            return [audio[0]]
+        durations = result[1].reshape(len(batch), -1)
+        outputs = []
+        for row, length in enumerate(lengths):
+            # 与模型内部一致：输出帧数为时长之和（至少 1 帧）
+            frames = max(1, int(round(float(durations[row, :length].sum()))))
+            outputs.append(audio[row, :frames * self.hop_length])
+        return outputs
+
+    def stats(self):
+        with self._cond:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'average_batch': round(self.items / self.batches, 3) if self.batches else 0.0,
+                'window_ms': round(self.window * 1000, 3),
+                'pending': len(self._pending),
+            }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+piper 命令行工具常驻进程池
+
+piper-tts Python 包不可用时，Piper 服务会退回到 piper 命令行工具。
+原来每个请求都要启动一次 piper、重新加载 ONNX 模型、写临时 WAV 再读回来；
+这里改为每个模型常驻若干个 piper 进程：
+
+    piper --model <模型> --json-input --output_file -
+
+每行 stdin 输入一个 JSON（{"text": ...}），piper 把对应的完整 WAV 写到 stdout。
+WAV 头里带有数据长度，据此从管道里切出每条请求的 PCM，不经过磁盘。
+进程崩溃或超时会被杀掉并重启，后台线程定期检查空闲进程的存活状态。
+
+仅支持 POSIX（依赖 select 读取管道）；Windows 下服务继续使用逐请求启动进程的方式。
+"""
+
+import collections
+import json
+import os
+import queue
+import select
+import struct
+import subprocess
+import threading
+import time
+
+# 单条请求的默认超时（秒）
+DEFAULT_TIMEOUT = 60
+# 后台健康检查间隔（秒）
+HEALTH_CHECK_INTERVAL = 10
+
+
+class PiperProcessError(Exception):
+    """piper 进程崩溃、超时或输出格式不对"""
+
+
+class PiperProcess:
+    """一个常驻的 piper 进程，一次处理一条请求"""
+
+    def __init__(self, args):
+        self.args = args
+        self.proc = None
+        self.stderr_tail = collections.deque(maxlen=20)
+        self.restarts = -1
+        self.start()
+
+    def start(self):
+        self.stop()
+        self.proc = subprocess.Popen(
+            self.args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.restarts += 1
+        # piper 的日志写在 stderr，必须持续读走，否则管道写满后进程会卡住
+        threading.Thread(target=self._drain_stderr, args=(self.proc,), daemon=True).start()
+
+    def _drain_stderr(self, proc):
+        for line in iter(proc.stderr.readline, b''):
+            self.stderr_tail.append(line.decode('utf-8', 'replace').rstrip())
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.proc = None
+
+    def synthesize(self, text, speaker_id=None, timeout=DEFAULT_TIMEOUT):
+        """合成一条文本，返回 (pcm字节, (采样率, 声道数, 采样宽度))"""
+        request = {'text': text.replace('\n', ' ')}
+        if speaker_id is not None:
+            request['speaker_id'] = speaker_id
+        deadline = time.monotonic() + timeout
+        try:
+            self.proc.stdin.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.proc.stdin.flush()
+            return self._read_wav(deadline)
+        except (OSError, ValueError, PiperProcessError) as e:
+            detail = ' | '.join(self.stderr_tail)
+            # 进程状态未知（可能还在输出上一条的数据），直接重启
+            self.start()
+            raise PiperProcessError(f'{e}{"：" + detail if detail else ""}') from e
+
+    def _read_exact(self, size, deadline):
+        fd = self.proc.stdout.fileno()
+        parts = []
+        remaining = size
+        while remaining > 0:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                raise PiperProcessError('piper 进程响应超时')
+            ready, _, _ = select.select([fd], [], [], wait)
+            if not ready:
+                continue
+            data = os.read(fd, min(remaining, 1 << 16))
+            if not data:
+                raise PiperProcessError(f'piper 进程已退出（退出码 {self.proc.poll()}）')
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+
+    def _read_wav(self, deadline):
+        riff = self._read_exact(12, deadline)
+        if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise PiperProcessError('piper 输出不是 WAV 数据')
+
+        audio_format = None
+        while True:
+            chunk_id, chunk_size = struct.unpack('<4sI', self._read_exact(8, deadline))
+            if chunk_id == b'fmt ':
+                fmt = self._read_exact(chunk_size, deadline)
+                _, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                audio_format = (sample_rate, channels, bits // 8)
+            elif chunk_id == b'data':
+                if audio_format is None:
+                    raise PiperProcessError('piper 输出缺少 fmt 块')
+                return self._read_exact(chunk_size, deadline), audio_format
+            else:
+                self._read_exact(chunk_size + (chunk_size & 1), deadline)
+
+
+class PiperProcessPool:
+    """同一模型、同一组合成参数的 piper 常驻进程池"""
+
+    def __init__(self, piper_cmd, model_path, extra_args=(), size=2, timeout=DEFAULT_TIMEOUT):
+        self.args = [piper_cmd, '--model', model_path, '--json-input', '--output_file', '-', *extra_args]
+        self.timeout = timeout
+        self.workers = [PiperProcess(self.args) for _ in range(size)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._closed = threading.Event()
+        threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def synthesize(self, text, speaker_id=None):
+        worker = self._idle.get()
+        try:
+            if not worker.alive():
+                worker.start()
+            return worker.synthesize(text, speaker_id, self.timeout)
+        finally:
+            self._idle.put(worker)
+
+    def _health_loop(self):
+        """定期重启已经退出的空闲进程，避免请求到来时才发现"""
+        while not self._closed.wait(HEALTH_CHECK_INTERVAL):
+            checked = []
+            try:
+                while True:
+                    checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                pass
+            for worker in checked:
+                if not worker.alive():
+                    print(f'[Piper TTS] ⚠️ piper 进程已退出，重新启动: {" | ".join(worker.stderr_tail)}')
+                    try:
+                        worker.start()
+                    except OSError as e:
+                        print(f'[Piper TTS] ❌ piper 进程重启失败: {e}')
+                self._idle.put(worker)
+
+    def stats(self):
+        return {
+            'workers': len(self.workers),
+            'alive': sum(1 for worker in self.workers if worker.alive()),
+            'idle': self._idle.qsize(),
+            'restarts': sum(worker.restarts for worker in self.workers),
+        }
+
+    def close(self):
+        self._closed.set()
+        for worker in self.workers:
+            worker.stop()
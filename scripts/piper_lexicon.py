@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 音素缓存与游戏词表（lexicon）预编译
+
+每次合成 Piper 都要先用 espeak-ng（或 g2pW）把文本转成音素，再查表得到音素ID。
+游戏里的台词很少且反复出现，这里把 (规范化文本 -> 各句音素和音素ID) 缓存起来：
+    1. 运行时缓存：PhonemeCache，按模型各一份的 LRU，按句（split_sentences）存放，
+       未见过的句子第一次合成后写入；长台词中与其他台词相同的句子也能命中。
+    2. 预编译词表：离线把 i18n-resources 的中文文案、预热清单和南昌话词表逐条音素化，
+       保存为模型旁边的 <模型>.lexicon.json，服务加载模型时读入，这些句子连第一次也不用音素化。
+
+词表记录了生成时模型配置文件（.onnx.json）的哈希和 piper-tts 版本，两者有变化时词表作废，
+服务退回运行时缓存，重新运行本脚本即可。
+
+使用方法：
+    python scripts/piper_lexicon.py                        # 为 tts-services/models 下所有模型生成词表
+    python scripts/piper_lexicon.py path/to/model.onnx     # 只生成指定模型的词表
+    python scripts/piper_lexicon.py --text-file lines.txt  # 额外加入文本文件中的句子（每行一句）
+scripts/download-piper-model.py 下载完成后也会自动调用。
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tts_audio_store import file_sha256
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_MODEL_DIR = os.path.join(REPO_ROOT, 'tts-services', 'models')
+I18N_DIR = os.path.join(REPO_ROOT, 'i18n-resources')
+I18N_LOCALE = 'zh-CN'
+WARMUP_MANIFEST = os.path.join(REPO_ROOT, 'tts-services', 'warmup-manifest.json')
+NANCHANG_RULES = os.path.join(REPO_ROOT, 'src', 'ai', 'dialect', 'nanchang_rules.ts')
+
+LEXICON_VERSION = 1
+
+
+def normalize_text(text):
+    """缓存键中的文本：去掉首尾空白并合并连续空白（与服务的音频缓存键一致）"""
+    return ' '.join(text.split())
+
+
+def lexicon_path_for(model_path):
+    """.onnx 对应的词表文件路径"""
+    return f'{model_path}.lexicon.json'
+
+
+def piper_version():
+    try:
+        from importlib.metadata import version
+        return version('piper-tts')
+    except Exception:
+        return 'unknown'
+
+
+class PhonemeList(list):
+    """一句的音素，附带已经算好的音素ID（ids），phonemes_to_ids 可以直接返回"""
+
+    __slots__ = ('ids',)
+
+    def __init__(self, phonemes, ids):
+        super().__init__(phonemes)
+        self.ids = ids
+
+
+class PhonemeCache:
+    """一个模型的音素缓存：预编译词表（只读）+ 运行时 LRU（线程安全）
+
+    条目为 [PhonemeList, ...]（每句一个），合成时原样交给 piper，调用方不得修改。
+    词表的键是整段台词及其各句，运行时缓存的键是单句，见 cached_phonemes()。
+    """
+
+    def __init__(self, max_entries, lexicon=None):
+        self.max_entries = max_entries
+        self.lexicon = lexicon or {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.lexicon_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """返回 (条目, 来源)，来源为 'lexicon' / 'memory' / 'miss'"""
+        entry = self.lexicon.get(key)
+        if entry is not None:
+            self.lexicon_hits += 1
+            return entry, 'lexicon'
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, 'miss'
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, 'memory'
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'lexicon_entries': len(self.lexicon),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'lexicon_hits': self.lexicon_hits,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# 句末标点（可带后引号/括号）、英文句号后跟空白、换行处断句
+SENTENCE_END = re.compile(r'[。！？!?；;…]+[”’"」』）)]*|\.(?=\s)|\n+')
+
+
+def split_sentences(text):
+    """按中英文句末标点切分文本，标点保留在句尾；没有文字的片段并入相邻的句子
+
+    Piper 服务的长文本分句合成也用这个函数，预编译词表和运行时查表的句子切分保持一致。
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    sentences.append(text[start:])
+
+    merged = []
+    prefix = ''
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if not any(ch.isalnum() for ch in sentence):
+            if merged:
+                merged[-1] += sentence
+            else:
+                prefix += sentence
+            continue
+        merged.append(prefix + sentence)
+        prefix = ''
+    return merged or ([prefix] if prefix else [])
+
+
+def cached_phonemes(cache, text, phonemize_text, on_lookup=None):
+    """查缓存音素化一段文本，返回 [PhonemeList, ...]
+
+    整段在词表里时直接取出；否则按 split_sentences 逐句查缓存，缺的句子单独音素化后写入。
+    Args:
+        phonemize_text: phonemize_text(句子) -> [PhonemeList, ...]
+        on_lookup: on_lookup(来源)，每查一次缓存调用一次（用于指标）
+    """
+    key = normalize_text(text)
+    if key in cache.lexicon:
+        sentences = [key]
+    else:
+        sentences = [normalize_text(sentence) for sentence in split_sentences(key)] or [key]
+    entry = []
+    for sentence in sentences:
+        phonemes, source = cache.get(sentence)
+        if on_lookup is not None:
+            on_lookup(source)
+        if phonemes is None:
+            phonemes = phonemize_text(sentence)
+            cache.put(sentence, phonemes)
+        entry.extend(phonemes)
+    return entry
+
+
+def phonemize_entry(phonemize, phonemes_to_ids, text):
+    """音素化一段文本，返回 [PhonemeList, ...]
+    Args:
+        phonemize, phonemes_to_ids: PiperVoice 原本的两个方法（挂上缓存之前取出）
+    """
+    return [PhonemeList(phonemes, phonemes_to_ids(phonemes)) for phonemes in phonemize(text)]
+
+
+def load_lexicon(model_path):
+    """读取模型的预编译词表，返回 {规范化文本: [PhonemeList, ...]}
+
+    文件不存在时返回空词表；模型配置或 piper-tts 版本与生成时不同则视为作废，同样返回空词表。
+    """
+    path = lexicon_path_for(model_path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if (data.get('version') != LEXICON_VERSION
+            or data.get('config_sha256') != file_sha256(f'{model_path}.json')
+            or data.get('piper_version') != piper_version()):
+        print(f'[Piper TTS] ⚠️ 词表已过期（模型配置或 piper-tts 版本有变化），请重新运行 scripts/piper_lexicon.py: {path}')
+        return {}
+    return {
+        text: [PhonemeList(phonemes, ids) for phonemes, ids in sentences]
+        for text, sentences in data['entries'].items()
+    }
+
+
+def iter_strings(value):
+    """递归取出 JSON 里的所有字符串"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_strings(item)
+
+
+def i18n_texts(i18n_dir=I18N_DIR, locale=I18N_LOCALE):
+    """i18n-resources 中该语言的所有文案（跳过带 {{变量}} 插值的模板）"""
+    for path in sorted(glob.glob(os.path.join(i18n_dir, '**', f'{locale}.json'), recursive=True)):
+        with open(path, 'r', encoding='utf-8') as f:
+            for text in iter_strings(json.load(f)):
+                if '{' not in text:
+                    yield text
+
+
+def warmup_texts(path=WARMUP_MANIFEST):
+    """预热清单中的台词"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for entry in json.load(f):
+            if isinstance(entry, str):
+                yield entry
+            elif isinstance(entry, (list, tuple)) and entry:
+                yield entry[0]
+            elif isinstance(entry, dict) and entry.get('text'):
+                yield entry['text']
+
+
+def nanchang_texts(path=NANCHANG_RULES):
+    """南昌话词表（convertToNanchang 的改写结果）和南昌话特有表达
+
+    直接从 nanchang_rules.ts 里取出 nanchangCardGameDict 的值和 nanchangIdioms 的元素，
+    只取两个字以上的词句（单字语气词不会单独成句）。
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    dict_block = re.search(r'nanchangCardGameDict[^{]*\{(.*?)\n\};', source, re.S)
+    if dict_block:
+        for match in re.finditer(r"'[^']*'\s*:\s*'([^']*)'", dict_block.group(1)):
+            yield match.group(1)
+    idioms_block = re.search(r'nanchangIdioms[^\[]*\[(.*?)\];', source, re.S)
+    if idioms_block:
+        yield from re.findall(r"'([^']*)'", idioms_block.group(1))
+
+
+def text_file_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+def game_sentences(text_files=()):
+    """要预编译的句子：整句及其按句末标点切开的各句（长文本分句并行合成时按单句查表）"""
+    sources = [i18n_texts(), warmup_texts(), nanchang_texts()] + [text_file_lines(path) for path in text_files]
+
+    sentences = OrderedDict()
+    for source in sources:
+        for text in source:
+            text = normalize_text(text)
+            if len(text) < 2 or not any(ch.isalpha() for ch in text):
+                continue
+            sentences[text] = None
+            for sentence in split_sentences(text):
+                sentences[normalize_text(sentence)] = None
+    return list(sentences)
+
+
+def build(model_path, sentences):
+    """音素化所有句子并写入词表文件，返回写入的条目数（只需要模型配置，不创建推理会话）"""
+    from piper import PiperVoice
+    from piper.config import PiperConfig
+
+    config_path = f'{model_path}.json'
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = PiperConfig.from_dict(json.load(f))
+    voice = PiperVoice(session=None, config=config)
+
+    entries = {}
+    for text in sentences:
+        entry = phonemize_entry(voice.phonemize, voice.phonemes_to_ids, text)
+        entries[text] = [[list(phonemes), phonemes.ids] for phonemes in entry]
+
+    path = lexicon_path_for(model_path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': LEXICON_VERSION,
+            'model': os.path.basename(model_path),
+            'config_sha256': file_sha256(config_path),
+            'piper_version': piper_version(),
+            'entries': entries,
+        }, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='为 Piper 模型预编译游戏词表（音素和音素ID）')
+    parser.add_argument('models', nargs='*', help='模型文件（默认 tts-services/models 下所有 .onnx）')
+    parser.add_argument('--text-file', action='append', default=[], help='额外加入的句子文件（每行一句，可多次指定）')
+    args = parser.parse_args(argv)
+
+    paths = args.models
+    if not paths:
+        model_dir = os.path.abspath(DEFAULT_MODEL_DIR)
+        paths = [
+            os.path.join(model_dir, name)
+            for name in sorted(os.listdir(model_dir))
+            if name.endswith('.onnx')
+        ] if os.path.isdir(model_dir) else []
+
+    sentences = game_sentences(args.text_file)
+    print(f' 待预编译句子: {len(sentences)} 条')
+    failed = 0
+    for path in paths:
+        if not os.path.exists(f'{path}.json'):
+            print(f' 跳过（缺少配置文件 {path}.json）: {path}')
+            continue
+        try:
+            count = build(path, sentences)
+            print(f' 已生成: {lexicon_path_for(path)}（{count} 条）')
+        except Exception as e:
+            failed += 1
+            print(f' 生成失败: {path}: {e}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
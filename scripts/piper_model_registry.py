@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 模型索引
+
+启动时扫描一次模型目录，读出每个 .onnx 旁边的 .onnx.json（语言、说话人、采样率），
+按文件内容哈希标识模型：同一份文件不管有几个路径、被几种声音引用，都只对应一个会话。
+之后由后台线程定期轮询目录（只比较文件大小和修改时间，不读文件），
+发现新增、修改或删除的模型时重新建立索引，交给服务先加载好再切换。
+
+轮询而不是 inotify：标准库没有 inotify，模型目录文件很少，每几秒 stat 一遍的开销可以忽略。
+"""
+
+import json
+import os
+import threading
+
+from tts_audio_store import file_sha256
+
+
+class ModelInfo:
+    """一个模型文件及其配置"""
+
+    __slots__ = ('path', 'name', 'size', 'mtime_ns', 'sha256', 'language', 'sample_rate',
+                 'num_speakers', 'speaker_id_map', 'quality', 'dataset')
+
+    def __init__(self, path, stat, sha256, config):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.sha256 = sha256
+        language = config.get('language') or {}
+        audio = config.get('audio') or {}
+        self.language = language.get('code') if isinstance(language, dict) else language
+        self.sample_rate = audio.get('sample_rate', 22050)
+        self.quality = audio.get('quality')
+        self.num_speakers = config.get('num_speakers', 1)
+        self.speaker_id_map = config.get('speaker_id_map') or {}
+        self.dataset = config.get('dataset')
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'path': self.path,
+            'sha256': self.sha256,
+            'size': self.size,
+            'language': self.language,
+            'sample_rate': self.sample_rate,
+            'quality': self.quality,
+            'num_speakers': self.num_speakers,
+            'speakers': sorted(self.speaker_id_map, key=self.speaker_id_map.get),
+        }
+
+
+class ModelRegistry:
+    """模型目录索引：{路径: ModelInfo}
+
+    索引整体替换（不原地修改），请求线程读到的总是一份完整的索引。
+    """
+
+    def __init__(self, model_dirs):
+        self.model_dirs = [os.path.abspath(d) for d in model_dirs]
+        self._index = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.scans = 0
+        self.reloads = 0
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.scan()
+        return self._index
+
+    @property
+    def current(self):
+        """当前索引，尚未建立时为 None（不触发扫描，供健康检查等不能访问磁盘的地方使用）"""
+        return self._index
+
+    def scan(self, previous=None):
+        """扫描模型目录，返回新的索引；大小和修改时间没变的模型沿用 previous 里的信息"""
+        previous = previous or {}
+        index = {}
+        for model_dir in self.model_dirs:
+            try:
+                entries = sorted(os.scandir(model_dir), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith('.onnx'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if stat.st_size == 0:
+                    continue
+                # 同一文件经符号链接或重复目录出现多次时只记一次
+                path = os.path.realpath(entry.path)
+                if path in index:
+                    continue
+                old = previous.get(path)
+                if old is not None and old.size == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+                    index[path] = old
+                    continue
+                try:
+                    with open(f'{entry.path}.json', 'r', encoding='utf-8') as f:
+                        config = json.load(f)
+                except (OSError, ValueError):
+                    config = {}
+                try:
+                    index[path] = ModelInfo(path, stat, file_sha256(path), config)
+                except OSError:
+                    # 文件正在被替换：下一轮再看
+                    continue
+        self.scans += 1
+        return index
+
+    def publish(self, index):
+        """切换到新的索引"""
+        self._index = index
+        self.reloads += 1
+
+    def has_changed(self, index):
+        current = self._index or {}
+        return {path: m.sha256 for path, m in index.items()} != {path: m.sha256 for path, m in current.items()}
+
+    def find(self, names, index=None):
+        """按文件名优先级查找模型，返回 ModelInfo 或 None（目录顺序决定同名文件的优先级）"""
+        index = self.index if index is None else index
+        by_name = {}
+        for model in index.values():
+            by_name.setdefault(model.name, model)
+        for name in names:
+            model = by_name.get(name)
+            if model is not None:
+                return model
+        return None
+
+    def models(self):
+        return list(self.index.values())
+
+    def watch(self, interval, before_publish, after_publish=None):
+        """后台轮询模型目录
+        Args:
+            before_publish: before_publish(新索引)，切换索引之前调用（先把新模型加载好）
+            after_publish: after_publish()，切换索引之后调用（释放不再使用的模型）
+        """
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    index = self.scan(self._index)
+                    if self.has_changed(index):
+                        before_publish(index)
+                        self.publish(index)
+                        print(f'[Piper TTS] 🔄 模型索引已更新: {len(index)} 个模型')
+                        if after_publish is not None:
+                            after_publish()
+                except Exception as e:
+                    print(f'[Piper TTS] ⚠️ 模型目录扫描失败: {e}')
+
+        self.index  # 确保启动轮询前已有初始索引
+        thread = threading.Thread(target=loop, name='piper-model-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
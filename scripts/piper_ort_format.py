@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 模型转换为 ORT 格式
+
+ONNX Runtime 每次从 .onnx 创建会话都要重新做一遍图优化，多进程模式下每个会话都要做。
+这里离线做一次优化并保存为 ORT 格式（与 .onnx 同目录、同名，扩展名为 .ort）。
+Piper 服务发现比 .onnx 新的 .ort 文件时优先使用它，创建会话时不再做图优化。
+
+不使用 session.use_ort_model_bytes_directly：Python 绑定会把传入的 bytes 复制成临时缓冲区，
+会话创建完后缓冲区即被释放，权重指向已释放的内存（推理结果错误甚至崩溃），因此直接按路径加载。
+
+推理微批处理（piper_batching.py）要按各音素的时长（w_ceil 张量）切开批内各句的音频。
+只在开启批处理时（durations=True）才在加载或转换前把它加为模型的第二个输出（需要 onnx 包）：
+加输出要读入整个图再序列化，默认不开批处理时仍按路径加载，不多花启动时间和内存。
+要配合批处理使用 .ort 文件时，用 --durations 转换（已有旧文件时加 --force）。
+
+使用方法：
+    python scripts/piper_ort_format.py                     # 转换 tts-services/models 下所有模型
+    python scripts/piper_ort_format.py path/to/model.onnx  # 转换指定模型
+    python scripts/piper_ort_format.py --force             # 已是最新也重新转换
+    python scripts/piper_ort_format.py --durations         # 带时长输出（开启推理批处理时使用）
+scripts/download-piper-model.py 下载完成后也会自动调用。
+"""
+
+import os
+import sys
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(__file__), '..', 'tts-services', 'models')
+
+
+def ort_path_for(model_path):
+    """.onnx 对应的 ORT 格式文件路径"""
+    root, _ = os.path.splitext(model_path)
+    return root + '.ort'
+
+
+def with_durations(model_path):
+    """读入 .onnx 并把各音素的时长（w_ceil）加为图的输出，返回序列化后的模型
+
+    没有 onnx 包、模型已带时长输出或找不到 w_ceil 时返回 None（按原文件加载）。
+    """
+    try:
+        import onnx
+        from piper.patch_voice_with_alignment import add_alignment_output
+    except ImportError:
+        return None
+
+    model = onnx.load(model_path)
+    try:
+        add_alignment_output(model)
+    except ValueError:
+        return None
+    return model.SerializeToString()
+
+
+def convert(model_path, force=False, durations=False):
+    """把 .onnx 转换为 ORT 格式，返回生成的文件路径（已是最新时直接返回）
+
+    durations=True 时先加上时长输出（见 with_durations()），供推理批处理使用。
+    """
+    import onnxruntime
+
+    ort_path = ort_path_for(model_path)
+    if not force and os.path.exists(ort_path) and os.path.getmtime(ort_path) >= os.path.getmtime(model_path):
+        return ort_path
+
+    options = onnxruntime.SessionOptions()
+    # EXTENDED 级别的优化与具体 CPU 无关，转换结果可以拷到其他机器使用
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    tmp_path = f'{ort_path}.{os.getpid()}.tmp'
+    options.optimized_model_filepath = tmp_path
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    source = (durations and with_durations(model_path)) or model_path
+    onnxruntime.InferenceSession(source, sess_options=options, providers=['CPUExecutionProvider'])
+    os.replace(tmp_path, ort_path)
+    return ort_path
+
+
+def find_ort_model(model_path):
+    """返回可用的 ORT 格式文件路径；不存在或比 .onnx 旧时返回 None"""
+    ort_path = ort_path_for(model_path)
+    try:
+        if os.path.getmtime(ort_path) >= os.path.getmtime(model_path):
+            return ort_path
+    except OSError:
+        pass
+    return None
+
+
+def session_model_source(model_path, session_options, durations=False):
+    """为 InferenceSession 准备模型来源
+
+    有可用的 ORT 文件时返回它的路径，并设置会话按 ORT 格式加载；
+    否则返回 .onnx 路径。durations=True（开启推理批处理）时返回加上时长输出的模型
+    （bytes，见 with_durations()），不能加时仍返回路径。
+    """
+    ort_path = find_ort_model(model_path)
+    if ort_path is None:
+        return (durations and with_durations(model_path)) or model_path
+
+    session_options.add_session_config_entry('session.load_model_format', 'ORT')
+    return ort_path
+
+
+def main(paths):
+    force = '--force' in paths
+    durations = '--durations' in paths
+    paths = [path for path in paths if path not in ('--force', '--durations')]
+    if not paths:
+        model_dir = os.path.abspath(DEFAULT_MODEL_DIR)
+        paths = [
+            os.path.join(model_dir, name)
+            for name in sorted(os.listdir(model_dir))
+            if name.endswith('.onnx')
+        ] if os.path.isdir(model_dir) else []
+
+    failed = 0
+    for path in paths:
+        if os.path.getsize(path) == 0:
+            print(f' 跳过空文件: {path}')
+            continue
+        try:
+            print(f' 已转换: {convert(path, force, durations)}')
+        except Exception as e:
+            failed += 1
+            print(f' 转换失败: {path}: {e}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
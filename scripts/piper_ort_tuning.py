@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper 模型的 ONNX Runtime 会话参数自动校准
+
+默认的 SessionOptions 让每个会话使用所有核做 intra-op 并行。多个请求同时推理时线程互相争抢，
+而游戏里大部分台词很短，开 16 个线程也快不了多少。这里在启动时扫描
+intra-op/inter-op 线程数和执行模式，按"并发吞吐量"（每秒墙钟时间产出的音频秒数）选出
+短文本和长文本各自的最佳配置，并按 (主机, 模型) 持久化到 JSON 文件，之后启动直接复用。
+
+运行时 TunedVoice 为同一个模型持有两个会话：短文本走线程少的会话，长文本走线程多的会话。
+两个配置相同时只创建一个会话。
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 文本字数不超过该值的请求视为短文本
+SHORT_TEXT_CHARS = 24
+
+# 校准用的参考文本（游戏常用台词 / 吵架长句）
+REFERENCE_TEXTS = {
+    'short': ['要不起', '我跟一手', '你莫急咧', '炸弹！', '这局我拿下了！', '顺子'],
+    'long': [
+        '你这一手打得不行！我跟你讲，这把要是输了，全都怪你，下回莫坐我对门了。',
+        '莫急莫急，好牌在后头，等我把这手炸弹甩出来，你们三个都只有看的份。',
+    ],
+}
+
+# 每个配置重复测量的轮数
+CALIBRATION_ROUNDS = 2
+
+
+def host_id():
+    """主机标识：主机名 + CPU 核数（同名机器换了规格也会重新校准）"""
+    return f'{socket.gethostname()}/{os.cpu_count() or 1}cpu'
+
+
+def session_options(profile):
+    """把校准结果转换为 onnxruntime.SessionOptions"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = profile['intra_op']
+    options.inter_op_num_threads = profile['inter_op']
+    if profile['execution_mode'] == 'parallel':
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+    else:
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    return options
+
+
+def candidate_profiles(cpu_count):
+    """要扫描的配置：intra-op 线程数取 1、2、4…直到核数，再加上并行执行模式"""
+    threads = []
+    n = 1
+    while n < cpu_count:
+        threads.append(n)
+        n *= 2
+    threads.append(cpu_count)
+
+    profiles = [{'intra_op': t, 'inter_op': 1, 'execution_mode': 'sequential'} for t in threads]
+    if cpu_count >= 4:
+        profiles.append({'intra_op': max(1, cpu_count // 2), 'inter_op': 2, 'execution_mode': 'parallel'})
+    return profiles
+
+
+def measure_throughput(voice, texts, concurrency, rounds=CALIBRATION_ROUNDS):
+    """以 concurrency 个并发请求反复合成 texts，返回每秒墙钟时间产出的音频秒数"""
+    def work(text):
+        samples = 0
+        sample_rate = 22050
+        for chunk in voice.synthesize(text):
+            sample_rate = chunk.sample_rate
+            samples += len(chunk.audio_int16_bytes) // chunk.sample_width
+        return samples / sample_rate
+
+    jobs = [text for _ in range(rounds) for text in texts]
+    jobs = jobs * max(1, concurrency // len(texts))
+    # 先跑一遍，避免把会话首次运行的内存分配算进去
+    work(texts[0])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        audio_seconds = sum(executor.map(work, jobs))
+    return audio_seconds / (time.perf_counter() - started)
+
+
+def calibrate(make_voice, cpu_count=None, log=print):
+    """扫描候选配置，分别为短文本和长文本选出吞吐量最高的配置
+    Args:
+        make_voice: make_voice(onnxruntime.SessionOptions) -> PiperVoice
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    best = {}
+    for profile in candidate_profiles(cpu_count):
+        threads_per_request = profile['intra_op'] * profile['inter_op']
+        # 用满所有核：每个请求占用 threads_per_request 个线程
+        concurrency = max(1, cpu_count // threads_per_request)
+        voice = make_voice(session_options(profile))
+        for kind, texts in REFERENCE_TEXTS.items():
+            throughput = measure_throughput(voice, texts, concurrency)
+            log(f'[ORT 校准] {kind:5s} intra={profile["intra_op"]:2d} inter={profile["inter_op"]} '
+                f'{profile["execution_mode"]:10s} 并发={concurrency:2d} -> {throughput:.2f} 音频秒/秒')
+            if kind not in best or throughput > best[kind][1]:
+                best[kind] = (profile, throughput)
+        del voice
+
+    return {
+        'short': dict(best['short'][0], throughput=round(best['short'][1], 3)),
+        'long': dict(best['long'][0], throughput=round(best['long'][1], 3)),
+        'short_text_chars': SHORT_TEXT_CHARS,
+        'calibrated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+_profiles_lock = threading.Lock()
+
+
+def load_profile(path, model_hash):
+    """读取该主机、该模型已保存的校准结果，没有则返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return profiles.get(f'{host_id()}|{model_hash}')
+
+
+def save_profile(path, model_hash, profile):
+    """保存校准结果（同一文件可保存多台主机、多个模型的结果）"""
+    with _profiles_lock:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+        profiles[f'{host_id()}|{model_hash}'] = profile
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def same_session_config(a, b):
+    return all(a[k] == b[k] for k in ('intra_op', 'inter_op', 'execution_mode'))
+
+
+class TunedVoice:
+    """按文本长度在两个会话之间分派的 PiperVoice 包装
+
+    短文本用线程少的会话，多个请求可以并行推理；长文本用线程多的会话，缩短单条耗时。
+    其余属性（config、phonemize 等）都转发给短文本会话的 PiperVoice。
+    """
+
+    def __init__(self, short_voice, long_voice, short_text_chars=SHORT_TEXT_CHARS):
+        self.short_voice = short_voice
+        self.long_voice = long_voice
+        self.short_text_chars = short_text_chars
+
+    def voice_for(self, text):
+        return self.short_voice if len(text) <= self.short_text_chars else self.long_voice
+
+    def synthesize(self, text, *args, **kwargs):
+        return self.voice_for(text).synthesize(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.short_voice, name)
+
+    @classmethod
+    def from_profile(cls, make_voice, profile):
+        short_voice = make_voice(session_options(profile['short']))
+        if same_session_config(profile['short'], profile['long']):
+            long_voice = short_voice
+        else:
+            long_voice = make_voice(session_options(profile['long']))
+        return cls(short_voice, long_voice, profile.get('short_text_chars', SHORT_TEXT_CHARS))
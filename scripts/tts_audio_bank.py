@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预生成音频库（audio bank）：游戏固定台词离线合成、打包成一个文件，服务用 mmap 直接读取
+
+游戏里大部分台词是固定的（i18n-resources 的文案、COMMON_GAME_PHRASES、预热清单），
+这里离线用进程池把它们按各个声音全部合成一遍，写成一个打包文件。
+服务启动时把文件映射到内存，查磁盘存储之前先查音频库，命中时不做任何推理，
+多进程模式下各工作进程共享同一份页缓存。
+
+文件格式（小端）：
+    b'TTSBANK1'              文件头魔数（8 字节）
+    音频数据                  各条目依次排列（PCM，或转码后的完整音频文件）
+    索引 JSON（UTF-8）        {"version", "created", "engine", "entries": {键: {"offset", "length", ...元数据}}}
+    尾部 24 字节              索引偏移（uint64）、索引长度（uint64）、魔数
+键与共享磁盘存储相同（AudioStore.make_key），元数据也与存储中的一致
+（Piper 的 PCM 为 sample_rate/channels/sample_width，转码结果为 content_type；Melo 为 mimetype），
+另外记录了文本和声音，方便客户端按台词查找。
+
+偏移量从文件开头算起：客户端可以先取 GET /audio-bank/index，再用 Range 请求 GET /audio-bank 取单条音频，
+也可以把整个文件当作音频精灵（audio sprite）一次下载。模型更新后键随模型哈希变化，旧条目自然不再命中，
+重新构建即可；服务在启动时打开音频库，替换文件后需要重启服务。
+
+构建：
+    python scripts/piper-tts-server.py --build-audio-bank tts-services/audio-bank.bin
+    python docs/setup/melo-tts-server-multilang.py --build-audio-bank tts-services/audio-bank-melo.bin
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tts_audio_store import strong_etag
+
+MAGIC = b'TTSBANK1'
+TRAILER = struct.Struct('<QQ8s')
+BANK_VERSION = 1
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+AUDIO_PRELOADER = os.path.join(REPO_ROOT, 'src', 'audio', 'audioPreloader.ts')
+
+# GET /audio-bank 每次读取并发出的字节数
+READ_CHUNK_BYTES = 256 * 1024
+
+
+class AudioBank:
+    """只读打开一个音频库文件（mmap），按键取出音频（线程安全）"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._map)
+        if self.size < len(MAGIC) + TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'不是音频库文件: {self.path}')
+        index_offset, index_length, magic = TRAILER.unpack_from(self._map, self.size - TRAILER.size)
+        if magic != MAGIC or index_offset + index_length > self.size - TRAILER.size:
+            raise ValueError(f'音频库文件不完整: {self.path}')
+        index_bytes = self._map[index_offset:index_offset + index_length]
+        index = json.loads(index_bytes.decode('utf-8'))
+        if index.get('version') != BANK_VERSION:
+            raise ValueError(f'音频库版本 {index.get("version")} 不受支持（需要 {BANK_VERSION}）')
+        self.created = index.get('created')
+        self.engine = index.get('engine')
+        self.entries = index['entries']
+        self.data_bytes = index_offset - len(MAGIC)
+        # 索引里有各条目的内容地址和位置：索引相同则整个文件相同
+        self.etag = strong_etag(hashlib.sha256(index_bytes).hexdigest())
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """返回 (音频 bytes, 元数据) 或 None；与 AudioStore.get() 的返回值相同"""
+        entry = self.entries.get(key) if key is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        offset, length = entry['offset'], entry['length']
+        return self._map[offset:offset + length], entry
+
+    def read(self, start, stop):
+        """逐块产出文件 [start, stop) 范围内的字节（GET /audio-bank 的响应体）"""
+        for offset in range(start, stop, READ_CHUNK_BYTES):
+            yield self._map[offset:min(offset + READ_CHUNK_BYTES, stop)]
+
+    def manifest(self):
+        """GET /audio-bank/index 的内容：各条目的键、位置和元数据"""
+        return {
+            'version': BANK_VERSION,
+            'engine': self.engine,
+            'created': self.created,
+            'size': self.size,
+            'entries': [dict(entry, key=key) for key, entry in self.entries.items()],
+        }
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': len(self.entries),
+                'bytes': self.data_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class BankWriter:
+    """写一个音频库文件：先写临时文件，close() 时写入索引后 os.replace，正在使用旧文件的服务不受影响"""
+
+    def __init__(self, path, engine=None):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+        self.engine = engine
+        self.entries = {}
+
+    def add(self, key, data, meta=None):
+        """追加一条音频（键已存在时忽略）"""
+        if key in self.entries:
+            return
+        self._file.write(data)
+        self.entries[key] = dict(meta or {}, offset=self._offset, length=len(data))
+        self._offset += len(data)
+
+    def close(self):
+        index = json.dumps({
+            'version': BANK_VERSION,
+            'created': time.time(),
+            'engine': self.engine,
+            'entries': self.entries,
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._file.write(index)
+        self._file.write(TRAILER.pack(self._offset, len(index), MAGIC))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.unlink(self._tmp_path)
+
+
+def byte_range(range_header, size):
+    """解析 Range 请求头，返回 (状态码, 起始, 结束(不含), 响应头)
+
+    只支持单个范围（bytes=a-b、bytes=a-、bytes=-n）；多个范围或无法解析（包括 b < a）时按整个文件返回 200，
+    范围超出文件（起点在文件末尾之后，或 bytes=-0）时返回 416。
+    """
+    headers = {'Accept-Ranges': 'bytes'}
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header or '')
+    invalid = match is not None and all(match.groups()) and int(match.group(2)) < int(match.group(1))
+    if match is None or match.groups() == ('', '') or invalid:
+        headers['Content-Length'] = str(size)
+        return 200, 0, size, headers
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    else:
+        start, stop = max(size - int(last), 0), size
+    if start >= stop:
+        headers['Content-Range'] = f'bytes */{size}'
+        return 416, 0, 0, headers
+    headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(stop - start)
+    return 206, start, stop, headers
+
+
+def open_default_bank(default_path):
+    """按环境变量打开音频库；文件不存在或 TTS_AUDIO_BANK=off 时返回 None
+
+    环境变量：
+        TTS_AUDIO_BANK  音频库文件路径（默认 default_path）
+    """
+    path = os.environ.get('TTS_AUDIO_BANK') or default_path
+    if path.lower() in ('off', '0', 'none') or not os.path.exists(path):
+        return None
+    return AudioBank(path)
+
+
+def common_game_phrases(path=AUDIO_PRELOADER):
+    """客户端预加载列表 COMMON_GAME_PHRASES（src/audio/audioPreloader.ts）中的台词"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    block = re.search(r'COMMON_GAME_PHRASES[^\[]*\[(.*?)\n\];', source, re.S)
+    if block:
+        yield from re.findall(r"text:\s*'([^']*)'", block.group(1))
+
+
+def fixed_vocabulary(text_files=()):
+    """要预生成的固定台词（整句，去重后按出现顺序）：i18n-resources 文案、COMMON_GAME_PHRASES 和预热清单"""
+    from piper_lexicon import i18n_texts, normalize_text, text_file_lines, warmup_texts
+
+    sources = [i18n_texts(), common_game_phrases(), warmup_texts()] + [text_file_lines(path) for path in text_files]
+    texts = {}
+    for source in sources:
+        for text in source:
+            text = normalize_text(text)
+            if any(ch.isalnum() for ch in text):
+                texts[text] = None
+    return list(texts)
+
+
+def _render_safely(render, item):
+    try:
+        return render(item), None
+    except Exception as e:
+        return None, str(e)
+
+
+def build_bank(path, items, render, workers=None, engine=None, on_progress=None, initializer=None):
+    """用进程池合成所有条目并写入音频库，返回 (写入的条目数, [(条目, 错误信息)])
+
+    Args:
+        items: 合成请求列表（可序列化的 dict，由 render 解释）
+        render: render(item) -> [(键, 音频 bytes, 元数据)]，在工作进程中执行，必须是模块级函数
+        workers: 进程数（默认 CPU 核数）
+        on_progress: on_progress(已完成数, 总数)，每完成一条在主进程中调用
+        initializer: 每个工作进程启动时调用一次（可选）
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    failed = []
+    writer = BankWriter(path, engine)
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=initializer) as executor:
+            results = executor.map(partial(_render_safely, render), items, chunksize=4)
+            for done, (item, (entries, error)) in enumerate(zip(items, results), 1):
+                if error is not None:
+                    failed.append((item, error))
+                else:
+                    for key, data, meta in entries:
+                        writer.add(key, data, meta)
+                if on_progress is not None:
+                    on_progress(done, len(items))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return len(writer.entries), failed
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS 输出格式协商与编码（Piper / Melo 服务共用）
+
+移动端（vue-mobile）不需要 22.05 kHz 的 WAV，按请求的 format 参数或 Accept 头选择输出：
+
+    wav     16 位 PCM WAV（默认）
+    l16     audio/L16 裸 PCM（大端，无文件头），rate/channels 写在 Content-Type 里
+    adpcm   IMA-ADPCM WAV（4 位/采样，约为 PCM 的 1/4），纯 numpy 编码
+    opus    Ogg/Opus，需要安装 soundfile 且 libsndfile 支持 OPUS
+
+任意格式都可以再加 rate=16000 或 rate=8000 在服务端降采样（numpy 向量化，带抗混叠低通）。
+"""
+
+import io
+import struct
+from collections import namedtuple
+
+FORMATS = ('wav', 'l16', 'adpcm', 'opus')
+RESAMPLE_RATES = (8000, 16000)
+# Opus 只支持这些采样率，其他采样率先重采样到 24 kHz
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# IMA-ADPCM 每块字节数（单声道时每块 505 个采样）
+ADPCM_BLOCK_ALIGN = 256
+
+ADPCM_STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+ADPCM_INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+
+_ACCEPT_TYPES = {
+    'audio/wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/l16': 'l16',
+    'audio/x-ima-adpcm': 'adpcm',
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+}
+
+
+class OutputFormat(namedtuple('OutputFormat', ['name', 'rate'])):
+    """输出格式：name 为 FORMATS 之一，rate 为目标采样率（None 表示保持模型采样率）"""
+
+    @property
+    def streamable(self):
+        """能否边合成边输出（只有无需整体编码的格式可以）"""
+        return self.name in ('wav', 'l16')
+
+    def is_plain_wav(self, sample_rate):
+        """是否就是模型原始输出（无需转码）"""
+        return self.name == 'wav' and self.rate in (None, sample_rate)
+
+    def cache_tag(self):
+        return f'{self.name}@{self.rate or "native"}'
+
+
+DEFAULT_FORMAT = OutputFormat('wav', None)
+
+
+def opus_available():
+    """本地是否有可用的 Opus 编码器（soundfile + 支持 OPUS 的 libsndfile）"""
+    try:
+        import soundfile
+        return 'OPUS' in soundfile.available_subtypes('OGG')
+    except Exception:
+        return False
+
+
+def _parse_rate(value):
+    if value in (None, ''):
+        return None
+    try:
+        rate = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('rate 必须是整数')
+    if rate not in RESAMPLE_RATES:
+        raise ValueError(f'rate 只支持 {", ".join(map(str, RESAMPLE_RATES))}')
+    return rate
+
+
+def _parse_accept(accept):
+    """按 Accept 头的 q 值顺序找第一个支持的格式"""
+    candidates = []
+    for order, part in enumerate(accept.split(',')):
+        fields = [f.strip() for f in part.split(';')]
+        media_type = fields[0].lower()
+        params = {}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            params[key.strip().lower()] = value.strip().strip('"')
+        try:
+            q = float(params.get('q', 1))
+        except ValueError:
+            q = 0
+        if media_type in _ACCEPT_TYPES and q > 0:
+            candidates.append((-q, order, _ACCEPT_TYPES[media_type], params.get('rate')))
+
+    for _, _, name, rate in sorted(candidates):
+        if name == 'opus' and not opus_available():
+            continue
+        try:
+            return OutputFormat(name, _parse_rate(rate))
+        except ValueError:
+            return OutputFormat(name, None)
+    return None
+
+
+def negotiate(format_param=None, rate_param=None, accept=None):
+    """确定输出格式：显式的 format/rate 参数优先，其次是 Accept 头，默认 WAV
+
+    显式参数不合法或不可用时抛出 ValueError；Accept 头里没有支持的类型时使用默认格式。
+    """
+    rate = _parse_rate(rate_param)
+    if format_param:
+        name = str(format_param).lower()
+        if name not in FORMATS:
+            raise ValueError(f'format 只支持 {", ".join(FORMATS)}')
+        if name == 'opus' and not opus_available():
+            raise ValueError('服务端没有可用的 Opus 编码器（需要安装 soundfile）')
+        return OutputFormat(name, rate)
+
+    negotiated = _parse_accept(accept) if accept else None
+    if negotiated is None:
+        return OutputFormat('wav', rate)
+    if rate is not None:
+        negotiated = negotiated._replace(rate=rate)
+    return negotiated
+
+
+def wav_header(sample_rate=22050, channels=1, sample_width=2, data_size=None):
+    """构造 PCM WAV 文件头
+    Args:
+        data_size: PCM数据字节数；为 None 时生成流式头（RIFF/data 大小填 0xFFFFFFFF）
+    """
+    if data_size is None:
+        # 流式输出时总长度未知，按惯例填最大值，播放器会读到连接结束
+        riff_size = 0xFFFFFFFF
+        data_size = 0xFFFFFFFF
+    else:
+        # RIFF chunk大小 = 文件大小 - 8，WAV头固定44字节
+        riff_size = 36 + data_size
+
+    byte_rate = sample_rate * channels * sample_width
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', riff_size, b'WAVE',
+        b'fmt ', 16,
+        1,                  # 音频格式（1=PCM）
+        channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        sample_width * 8,   # 位深度
+        b'data', data_size
+    )
+
+
+def wav_to_pcm(wav_data):
+    """解析 16 位 PCM WAV，返回 (pcm字节, (采样率, 声道数, 采样宽度))"""
+    import wave
+
+    with wave.open(io.BytesIO(wav_data), 'rb') as wav_file:
+        audio_format = (wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth())
+        return wav_file.readframes(wav_file.getnframes()), audio_format
+
+
+def resample_pcm16(pcm, src_rate, dst_rate, channels=1):
+    """16 位 PCM 重采样（窗函数 sinc 低通 + 线性插值，numpy 向量化）"""
+    import numpy as np
+
+    if src_rate == dst_rate or not pcm:
+        return pcm
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32).reshape(-1, channels)
+
+    if dst_rate < src_rate:
+        # 抗混叠低通：截止频率为目标采样率的奈奎斯特频率
+        cutoff = 0.5 * dst_rate / src_rate
+        n = np.arange(-32, 33)
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(len(n))
+        taps /= taps.sum()
+        samples = np.stack(
+            [np.convolve(samples[:, c], taps, mode='same') for c in range(channels)],
+            axis=1
+        )
+
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(n_out) * (src_rate / dst_rate)
+    source = np.arange(len(samples))
+    out = np.stack([np.interp(positions, source, samples[:, c]) for c in range(channels)], axis=1)
+    return np.clip(np.round(out), -32768, 32767).astype('<i2').tobytes()
+
+
+def pcm16_to_l16(pcm):
+    """小端 PCM 转为 audio/L16 要求的网络字节序（大端）"""
+    import numpy as np
+
+    return np.frombuffer(pcm, dtype='<i2').astype('>i2').tobytes()
+
+
+def l16_content_type(sample_rate, channels=1):
+    return f'audio/L16; rate={sample_rate}; channels={channels}'
+
+
+def encode_ima_adpcm(pcm, sample_rate):
+    """单声道 16 位 PCM 编码为 IMA-ADPCM WAV（WAVE_FORMAT_IMA_ADPCM = 0x11）
+
+    每个块以第一个采样和步长索引开头，块与块之间互不依赖，
+    因此按块向量化：对所有块同时逐采样编码，Python 循环次数只等于块长（505）。
+    """
+    import numpy as np
+
+    step_table = np.array(ADPCM_STEP_TABLE, dtype=np.int32)
+    index_table = np.array(ADPCM_INDEX_TABLE, dtype=np.int32)
+    samples_per_block = (ADPCM_BLOCK_ALIGN - 4) * 2 + 1
+
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.int32)
+    total = len(samples)
+    n_blocks = max(1, -(-total // samples_per_block))
+    padded = np.zeros(n_blocks * samples_per_block, dtype=np.int32)
+    padded[:total] = samples
+    if total:
+        padded[total:] = samples[-1]
+    blocks = padded.reshape(n_blocks, samples_per_block)
+
+    predictor = blocks[:, 0].copy()
+    # 初始步长按块开头的平均差值估计，使每块都能独立编码
+    first_diffs = np.abs(np.diff(blocks[:, :9], axis=1)).mean(axis=1)
+    index = np.clip(np.searchsorted(step_table, first_diffs), 0, 88).astype(np.int32)
+    header_index = index.copy()
+
+    codes = np.empty((n_blocks, samples_per_block - 1), dtype=np.uint8)
+    for i in range(1, samples_per_block):
+        step = step_table[index]
+        diff = blocks[:, i] - predictor
+        nibble = np.where(diff < 0, 8, 0)
+        diff = np.abs(diff)
+        vpdiff = step >> 3
+        for bit, shift in ((4, 0), (2, 1), (1, 2)):
+            s = step >> shift
+            hit = diff >= s
+            nibble = np.where(hit, nibble | bit, nibble)
+            diff = np.where(hit, diff - s, diff)
+            vpdiff = np.where(hit, vpdiff + s, vpdiff)
+        predictor = np.clip(np.where(nibble & 8, predictor - vpdiff, predictor + vpdiff), -32768, 32767)
+        index = np.clip(index + index_table[nibble], 0, 88)
+        codes[:, i - 1] = nibble
+
+    # 每个字节低 4 位是前一个采样，高 4 位是后一个采样
+    packed = codes[:, 0::2] | (codes[:, 1::2] << 4)
+    headers = np.zeros((n_blocks, 4), dtype=np.uint8)
+    headers[:, 0:2] = blocks[:, 0].astype('<i2').view(np.uint8).reshape(n_blocks, 2)
+    headers[:, 2] = header_index
+    data = np.concatenate([headers, packed], axis=1).tobytes()
+
+    fmt = struct.pack(
+        '<HHIIHHHH',
+        0x11,                                                   # WAVE_FORMAT_IMA_ADPCM
+        1,                                                      # 声道数
+        sample_rate,
+        sample_rate * ADPCM_BLOCK_ALIGN // samples_per_block,   # 字节率
+        ADPCM_BLOCK_ALIGN,
+        4,                                                      # 位深度
+        2,                                                      # 扩展字段大小
+        samples_per_block
+    )
+    body = (
+        b'WAVE'
+        + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+        + b'fact' + struct.pack('<II', 4, total)
+        + b'data' + struct.pack('<I', len(data)) + data
+    )
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def encode_opus(pcm, sample_rate, channels=1):
+    """编码为 Ogg/Opus，返回 (字节, 实际采样率)"""
+    import numpy as np
+    import soundfile
+
+    if sample_rate not in OPUS_RATES:
+        pcm = resample_pcm16(pcm, sample_rate, 24000, channels)
+        sample_rate = 24000
+    samples = np.frombuffer(pcm, dtype='<i2').reshape(-1, channels)
+    out = io.BytesIO()
+    soundfile.write(out, samples, sample_rate, format='OGG', subtype='OPUS')
+    return out.getvalue(), sample_rate
+
+
+def encode_pcm(pcm, sample_rate, channels, sample_width, output):
+    """把 16 位 PCM 编码为指定输出格式，返回 (字节, Content-Type)"""
+    if sample_width != 2:
+        raise ValueError('只支持 16 位 PCM')
+    if output.rate and output.rate != sample_rate:
+        pcm = resample_pcm16(pcm, sample_rate, output.rate, channels)
+        sample_rate = output.rate
+
+    if output.name == 'wav':
+        return wav_header(sample_rate, channels, 2, len(pcm)) + pcm, 'audio/wav'
+    if output.name == 'l16':
+        return pcm16_to_l16(pcm), l16_content_type(sample_rate, channels)
+    if output.name == 'adpcm':
+        if channels != 1:
+            raise ValueError('IMA-ADPCM 只支持单声道')
+        return encode_ima_adpcm(pcm, sample_rate), 'audio/wav'
+    if output.name == 'opus':
+        return encode_opus(pcm, sample_rate, channels)[0], 'audio/ogg; codecs=opus'
+    raise ValueError(f'未知的输出格式: {output.name}')
+
+
+def stream_chunks(pcm_chunks, output):
+    """流式输出：把 (pcm, (采样率, 声道数, 采样宽度)) 片段转换为 wav/l16 字节流
+
+    WAV 在第一段前发出流式文件头；重采样按片段进行（Piper 每段是一整句，边界处是静音）。
+    """
+    header_sent = False
+    for pcm, (sample_rate, channels, sample_width) in pcm_chunks:
+        if not pcm:
+            continue
+        if output.rate and output.rate != sample_rate:
+            pcm = resample_pcm16(pcm, sample_rate, output.rate, channels)
+            sample_rate = output.rate
+        if output.name == 'l16':
+            yield pcm16_to_l16(pcm)
+        else:
+            if not header_sent:
+                header_sent = True
+                yield wav_header(sample_rate, channels, sample_width)
+            yield pcm
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS 持久化音频存储（内容寻址）
+
+Piper 服务（scripts/piper-tts-server.py）和 Melo 服务（docs/setup/melo-tts-server-multilang.py）
+共用同一个磁盘存储，重启或新开进程后直接命中之前合成过的游戏语句。
+
+目录结构：
+    <root>/index.sqlite3      SQLite 索引（大小、元数据、最近访问时间），WAL 模式，多进程可同时打开
+    <root>/objects/ab/abcd…   音频文件，文件名即键（sha256）
+
+键由 (引擎, 模型文件哈希, 说话人, 语速, 文本) 计算，见 AudioStore.make_key()。
+写入在后台线程完成（write-behind）：先写临时文件再 os.replace，最后提交索引，
+进程崩溃时最多留下临时文件或无索引的孤儿文件，下次打开时会被清理。
+"""
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# 打开存储时，只清理早于这个时间（秒）的临时/孤儿文件，避免误删其他进程正在写入的文件
+ORPHAN_GRACE_SECONDS = 60
+
+_model_hashes = {}  # {(path, size, mtime): sha256}
+_model_hashes_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """计算模型文件的 sha256，按 (路径, 大小, 修改时间) 缓存，模型更新后自动重新计算"""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    cache_key = (path, st.st_size, st.st_mtime_ns)
+    with _model_hashes_lock:
+        digest = _model_hashes.get(cache_key)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    digest = h.hexdigest()
+    with _model_hashes_lock:
+        _model_hashes[cache_key] = digest
+    return digest
+
+
+class AudioStore:
+    """内容寻址的磁盘音频存储，按总字节数限额、按最近访问时间淘汰"""
+
+    def __init__(self, root, max_bytes, write_behind=True):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(self.root, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = self._open_index()
+        self._pending = {}  # 尚未落盘的写入：{key: (片段元组, meta)}
+        self._queue = queue.Queue()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+
+        self.recover()
+
+        self._writer = None
+        if write_behind:
+            self._writer = threading.Thread(target=self._write_loop, name='tts-audio-store-writer', daemon=True)
+            self._writer.start()
+
+    @staticmethod
+    def make_key(engine, model_hash, speaker, speed, text, **extra):
+        """计算内容地址。extra 用于引擎特有的其他合成参数（如 Piper 的 noise_scale）"""
+        payload = json.dumps(
+            {
+                'engine': engine,
+                'model': model_hash,
+                'speaker': speaker,
+                'speed': speed,
+                'text': text,
+                'extra': extra,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(',', ':'),
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _open_index(self):
+        index_path = os.path.join(self.root, 'index.sqlite3')
+        try:
+            db = self._connect(index_path)
+            if db.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError('索引校验失败')
+        except sqlite3.DatabaseError:
+            # 索引损坏：移到一边重建，音频文件会在 recover() 中作为孤儿清理
+            corrupt_path = f'{index_path}.corrupt-{int(time.time())}'
+            os.replace(index_path, corrupt_path)
+            db = self._connect(index_path)
+        return db
+
+    @staticmethod
+    def _connect(index_path):
+        db = sqlite3.connect(index_path, timeout=30, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' key TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' meta TEXT NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' last_access REAL NOT NULL)'
+        )
+        db.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)')
+        return db
+
+    def _object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def recover(self):
+        """崩溃恢复：删除缺少文件的索引行，以及超过宽限期的临时文件和无索引文件"""
+        with self._lock:
+            keys = {row[0] for row in self._db.execute('SELECT key FROM entries')}
+            missing = [key for key in keys if not os.path.exists(self._object_path(key))]
+            for key in missing:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name in keys:
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+    def get(self, key):
+        """读取音频，返回 (data, meta) 或 None"""
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.hits += 1
+                return b''.join(pending[0]), pending[1]
+            row = self._db.execute('SELECT meta FROM entries WHERE key = ?', (key,)).fetchone()
+
+        if row is not None:
+            try:
+                with open(self._object_path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # 文件被其他进程淘汰或丢失：按未命中处理，顺手删掉索引
+                with self._lock:
+                    self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # 最近访问时间由后台线程批量更新，不阻塞请求
+        self._submit(('touch', key, time.time()))
+        return data, json.loads(row[0])
+
+    def put(self, key, data, meta=None):
+        """写入音频（后台落盘）；超过总容量的单条不保存
+
+        data 可以是 bytes，也可以是按顺序拼接的 bytes 片段元组/列表（落盘时逐段写入，不拼接）。
+        """
+        segments = tuple(data) if isinstance(data, (tuple, list)) else (bytes(data),)
+        size = sum(len(segment) for segment in segments)
+        if not size or size > self.max_bytes:
+            return
+        with self._lock:
+            self._pending[key] = (segments, dict(meta or {}))
+        self._submit(('put', key))
+
+    def _submit(self, job):
+        if self._writer is None:
+            self._run_job(job)
+        else:
+            self._queue.put(job)
+
+    def flush(self, timeout=None):
+        """等待后台写入全部完成"""
+        if self._writer is None:
+            return
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait(timeout)
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                self.write_errors += 1
+                print(f'[Audio Store] ⚠️ 后台写入失败: {e}')
+
+    def _run_job(self, job):
+        kind = job[0]
+        if kind == 'flush':
+            job[1].set()
+        elif kind == 'touch':
+            _, key, accessed = job
+            with self._lock:
+                self._db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (accessed, key))
+        elif kind == 'put':
+            self._write_entry(job[1])
+
+    def _write_entry(self, key):
+        with self._lock:
+            entry = self._pending.get(key)
+        if entry is None:
+            return
+        segments, meta = entry
+        path = self._object_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.writelines(segments)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            now = time.time()
+            with self._lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries (key, size, meta, created, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (key, sum(len(segment) for segment in segments), json.dumps(meta, ensure_ascii=False), now, now),
+                )
+        finally:
+            with self._lock:
+                if self._pending.get(key) is entry:
+                    del self._pending[key]
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        """超过容量时按最近访问时间淘汰最旧的条目"""
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for key, size in self._db.execute('SELECT key, size FROM entries ORDER BY last_access'):
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+            for key in victims:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.evictions += len(victims)
+
+        for key in victims:
+            try:
+                os.unlink(self._object_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            return {
+                'root': self.root,
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'pending_writes': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'write_errors': self.write_errors,
+            }
+
+
+def strong_etag(digest):
+    """强 ETag：只用于由已有字节算出的摘要（如音频库索引的哈希），内容相同时才相同"""
+    return f'"{digest}"'
+
+
+def weak_etag(key):
+    """存储键作为弱 ETag（W/"键"）：合成之前就能算出，304 不用查缓存也不用合成
+
+    VITS 合成带随机噪声，同一个键在不同工作进程、或缓存淘汰后重新合成的音频不保证逐字节相同，
+    只是同一句话的等价版本，所以不能用强 ETag。
+    """
+    return f'W/"{key}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 请求头是否匹配 etag（* 匹配任意 ETag；按弱比较，两边都忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+def open_default_store(default_root):
+    """按环境变量打开共享存储；TTS_AUDIO_STORE_MB=0 时返回 None（关闭磁盘缓存）
+
+    环境变量：
+        TTS_AUDIO_STORE_DIR  存储目录（两个服务指向同一目录即可共享）
+        TTS_AUDIO_STORE_MB   容量上限，默认 512
+    """
+    max_bytes = int(float(os.environ.get('TTS_AUDIO_STORE_MB', '512')) * 1024 * 1024)
+    if max_bytes <= 0:
+        return None
+    root = os.environ.get('TTS_AUDIO_STORE_DIR') or default_root
+    return AudioStore(root, max_bytes)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式文本的增量分句（WebSocket 边收文本边合成用）
+
+对骂台词由大模型（src/ai/quarrelService.ts）逐词流式生成，原来要等整段回复生成完才能请求 TTS，
+大模型的耗时和合成的耗时叠加在一起。WebSocket 接口改为客户端边收到片段边推给服务端，
+服务端用 ClauseSplitter 在句子/子句边界切开，每凑齐一个子句就立即合成并推回音频，
+两段耗时重叠起来。
+
+切分规则：
+    1. 句末标点（。！？；…、换行，英文句号后跟空白）处总是断开。
+    2. 子句标点（，、：等）处在子句字数达到 min_chars 之后断开，避免"好，"这样的碎片单独合成。
+    3. 一直没有标点时，攒到 max_chars 个字符在最后一个空白处（没有则直接）断开。
+标点后面可能还跟着引号、括号或更多标点，因此标点位于缓冲区末尾时先不切，等下一个片段或 finish()。
+
+Piper 服务（scripts/piper-tts-server.py）和 Melo 服务（docs/setup/melo-tts-server-multilang.py）共用。只依赖标准库。
+"""
+
+SENTENCE_MARKS = '。！？!?；;…\n'
+CLAUSE_MARKS = '，,、：:～~—'
+# 紧跟在标点后、应当留在本子句里的字符
+TRAILING_MARKS = SENTENCE_MARKS + CLAUSE_MARKS + '”’"」』）)》】.'
+
+DEFAULT_MIN_CHARS = 4
+DEFAULT_MAX_CHARS = 80
+
+
+def spoken_chars(text):
+    """需要念出来的字符数（文字和数字，不含标点和空白）"""
+    return sum(1 for ch in text if ch.isalnum())
+
+
+class ClauseSplitter:
+    """增量分句器：push() 送入文本片段，返回已经完整的子句；finish() 取出剩余的文本"""
+
+    def __init__(self, min_chars=DEFAULT_MIN_CHARS, max_chars=DEFAULT_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ''
+        self._prefix = ''  # 没有文字的片段（如单独的"……"）并入下一个子句
+
+    def push(self, fragment):
+        """送入一个片段，返回切出的子句列表（可能为空）"""
+        self._buffer += fragment
+        return self._split(final=False)
+
+    def finish(self):
+        """文本结束：返回剩余的子句（可能为空），之后可以继续 push 新的一段"""
+        clauses = self._split(final=True)
+        tail = self._emit(self._buffer)
+        self._buffer = ''
+        self._prefix = ''
+        return clauses + tail
+
+    def _split(self, final):
+        clauses = []
+        buffer = self._buffer
+        start = 0
+        i = 0
+        while i < len(buffer):
+            ch = buffer[i]
+            end = None
+            if ch in SENTENCE_MARKS or ch in CLAUSE_MARKS or ch == '.':
+                j = i + 1
+                while j < len(buffer) and buffer[j] in TRAILING_MARKS:
+                    j += 1
+                if j == len(buffer) and not final:
+                    break  # 标点在末尾：等后面的片段确定子句到哪里结束
+                if ch == '.' and set(buffer[i:j]) == {'.'} and j < len(buffer) and not buffer[j].isspace():
+                    # 英文句号只在后跟空白时断句（"3.5"、"e.g" 不断）
+                    i = j
+                    continue
+                sentence_end = any(mark in SENTENCE_MARKS or mark == '.' for mark in buffer[i:j])
+                if sentence_end or spoken_chars(buffer[start:j]) >= self.min_chars:
+                    end = j
+                i = j
+            else:
+                i += 1
+                if i - start >= self.max_chars:
+                    space = buffer.rfind(' ', start, i)
+                    end = space + 1 if space > start else i
+            if end is not None:
+                clauses += self._emit(buffer[start:end])
+                start = end
+        self._buffer = buffer[start:]
+        return clauses
+
+    def _emit(self, piece):
+        piece = piece.strip()
+        if not piece:
+            return []
+        if not any(ch.isalnum() for ch in piece):
+            self._prefix += piece
+            return []
+        clause = self._prefix + piece
+        self._prefix = ''
+        return [clause]
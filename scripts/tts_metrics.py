@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS 服务的进程内指标（Prometheus 文本格式）
+
+Piper 服务（scripts/piper-tts-server.py）和 Melo 服务（docs/setup/*.py）共用，只依赖标准库。
+请求路径上只做一次加锁的加法或一次二分查找：直方图按桶保存计数，抓取时才累加成 Prometheus 的累积桶；
+队列深度这类本来就有的状态用回调 Gauge，抓取时才读取，请求路径上不需要额外维护。
+
+多进程（prefork）模式下每个工作进程各有一份指标，由 REGISTRY.const_labels 加上 worker 标签区分。
+"""
+
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟类直方图的默认桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 实时率（合成耗时 / 音频时长）直方图的桶
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """指标集合，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+        self.const_labels = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        const = ''.join(f'{name}="{_escape(value)}",' for name, value in self.const_labels.items())
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                pairs = const + ''.join(f'{name}="{_escape(v)}",' for name, v in labels)
+                label_text = '{' + pairs.rstrip(',') + '}' if pairs else ''
+                lines.append(f'{metric.name}{suffix}{label_text} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _labels(self, values):
+        return tuple(zip(self.labelnames, values))
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for values, value in sorted(items):
+            yield '', self._labels(values), value
+
+
+class Counter(Metric):
+    """只增不减的计数；标签值按 labelnames 的顺序以元组传入"""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的数值；给出 function 时抓取时调用它取值（无标签）"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, function=None):
+        super().__init__(name, help, labelnames, registry)
+        self.function = function
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def samples(self):
+        if self.function is not None:
+            yield '', (), self.function()
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    """分桶计数；每个标签组合保存 [各桶计数..., 总和, 总数]，桶计数不累积"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(values, list(state)) for values, state in self._values.items()]
+        for values, state in sorted(items):
+            labels = self._labels(values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                yield '_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', labels, state[-2]
+            yield '_count', labels, state[-1]
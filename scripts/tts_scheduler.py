@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成任务的优先级与公平调度
+
+客户端区分播报优先级（channelScheduler 的 PlaybackPriority：报牌 > 对骂 > 事件 > 聊天），
+服务端原来按到达顺序合成，一阵闲聊就能把"要不起"压在后面。这里按两条规则排队：
+    1. 优先级之间严格优先：有高优先级任务排队时，低优先级任务不会被取出。
+    2. 同一优先级内按房间、再按角色（玩家）加权公平：每个房间、房间内每个角色轮流获得合成时间，
+       按文本长度计费（启动时间公平排队 SFQ），一个话多的 AI 玩家或一个忙碌的房间不会饿死其他人。
+排队中的低优先级任务可以被抢占：队列满时高优先级任务挤掉最低优先级中最后才会轮到的那个；
+排队过久的低优先级任务（闲聊播出来也已经没有意义）和超过请求截止时间的任务在取出时直接丢弃。
+
+Cancellation 是一个请求的取消令牌：客户端显式取消、断开连接或超过截止时间后，
+合成在句子（片段）之间停下，不再为没人播放的音频消耗 CPU。
+
+FairExecutor 给 Piper 服务的 ASGI 合成队列用（固定数量的合成线程从公平队列取任务），
+FairGate 给每个请求一个线程的服务（Melo）用（请求线程在这里等待合成名额）。只依赖标准库。
+"""
+
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, InvalidStateError
+
+# 与客户端 PlaybackPriority（src/services/channelScheduler.ts）的取值一致
+PRIORITIES = {'chat': 1, 'event': 2, 'quarrel': 3, 'announcement': 4}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+DEFAULT_PRIORITY = PRIORITIES['event']
+
+# 各优先级在队列中的最长等待时间（秒），超过后丢弃；不在表中的优先级不会过期
+# 可用 TTS_STALE_SECONDS 覆盖，如 "chat=5,event=15,quarrel=0"（0 表示不过期）
+DEFAULT_STALE_SECONDS = {PRIORITIES['chat']: 5.0, PRIORITIES['event']: 15.0}
+
+
+class Schedule(namedtuple('Schedule', ['priority', 'room', 'role', 'cost', 'deadline'], defaults=(None,))):
+    """一个任务的调度信息：优先级、房间、角色、计费（文本长度）、截止时间（time.monotonic()，可为空）"""
+
+    __slots__ = ()
+
+
+def parse_priority(value):
+    """解析请求中的优先级：名称（chat/event/quarrel/announcement）或数字 1-4；为空时返回默认优先级"""
+    if value is None or value == '':
+        return DEFAULT_PRIORITY
+    if isinstance(value, str) and value.strip().lower() in PRIORITIES:
+        return PRIORITIES[value.strip().lower()]
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        priority = None
+    if priority not in PRIORITY_NAMES:
+        raise ValueError(f'priority 必须是 {"/".join(PRIORITIES)} 或 1-{len(PRIORITIES)}')
+    return priority
+
+
+def make_schedule(priority=None, room=None, role=None, text='', deadline=None):
+    """根据请求参数创建 Schedule；优先级不合法时抛出 ValueError"""
+    return Schedule(
+        parse_priority(priority),
+        '' if room is None else str(room),
+        '' if role is None else str(role),
+        max(1, len(text)),
+        deadline,
+    )
+
+
+def parse_deadline_ms(value):
+    """解析截止时间请求头（剩余毫秒数，不依赖客户端与服务端的时钟一致），返回 time.monotonic() 时刻或 None"""
+    if value is None or value == '':
+        return None
+    try:
+        remaining = float(value)
+    except (TypeError, ValueError):
+        remaining = -1
+    if not remaining >= 0:
+        raise ValueError('截止时间必须是非负的毫秒数')
+    return time.monotonic() + remaining / 1000
+
+
+def stale_seconds_from_env(name='TTS_STALE_SECONDS'):
+    """读取各优先级的最长排队时间配置（格式见 DEFAULT_STALE_SECONDS）"""
+    limits = dict(DEFAULT_STALE_SECONDS)
+    for part in os.environ.get(name, '').split(','):
+        if '=' not in part:
+            continue
+        key, value = part.split('=', 1)
+        priority = parse_priority(key)
+        limits[priority] = float(value)
+    return {priority: seconds for priority, seconds in limits.items() if seconds > 0}
+
+
+class Rejected(Exception):
+    """任务没有被执行：队列已满（full）、被高优先级任务抢占（preempted）、排队过久（stale）或超过截止时间（deadline）"""
+
+    def __init__(self, reason, message, priority=DEFAULT_PRIORITY):
+        super().__init__(message)
+        self.reason = reason
+        self.priority = priority
+
+
+class _Entry:
+    __slots__ = ('item', 'schedule', 'enqueued', 'cancelled', 'dropped')
+
+    def __init__(self, item, schedule, enqueued):
+        self.item = item
+        self.schedule = schedule
+        self.enqueued = enqueued
+        self.cancelled = False
+        self.dropped = None  # 取出时被丢弃的原因：'stale' / 'deadline'
+
+
+class _Flow:
+    """一个角色的任务（先进先出）"""
+
+    def __init__(self):
+        self.entries = deque()
+        self.live = 0
+        self.start = 0.0
+        self.finish = 0.0
+
+    def push(self, path, entry):
+        if self.live == 0:
+            self.entries.clear()  # 只剩被抢占的条目
+        self.entries.append(entry)
+        self.live += 1
+
+    def pop(self):
+        while True:
+            entry = self.entries.popleft()
+            if not entry.cancelled:
+                self.live -= 1
+                return entry
+
+    def last(self):
+        for entry in reversed(self.entries):
+            if not entry.cancelled:
+                return entry
+
+    def discard(self, path):
+        self.live -= 1
+
+
+class _Node:
+    """按启动时间公平排队（SFQ）分配的一层：子节点为房间或角色
+
+    每个有任务的子节点带一个启动标签，总是先服务标签最小的子节点；
+    服务一个任务后该子节点的标签增加任务的计费，新加入的子节点从当前虚拟时间开始。
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.children = {}
+        self.vtime = 0.0
+        self.live = 0
+        self.start = 0.0
+        self.finish = 0.0
+
+    def _child(self, key):
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = _Node(self.depth - 1) if self.depth > 1 else _Flow()
+        return child
+
+    def push(self, path, entry):
+        child = self._child(path[0])
+        if child.live == 0:
+            child.start = max(self.vtime, child.finish)
+        child.push(path[1:], entry)
+        self.live += 1
+
+    def pop(self):
+        key, child = min(
+            ((key, child) for key, child in self.children.items() if child.live > 0),
+            key=lambda pair: pair[1].start
+        )
+        entry = child.pop()
+        self.live -= 1
+        self.vtime = child.start
+        child.finish = child.start + entry.schedule.cost
+        child.start = child.finish
+        # 空闲且不欠账的子节点不必保留
+        for stale_key in [k for k, c in self.children.items() if c.live == 0 and c.finish <= self.vtime]:
+            del self.children[stale_key]
+        return entry
+
+    def last(self):
+        """最后才会轮到的任务（抢占时的牺牲者；标签相同时挑排队任务最多的子节点）"""
+        child = max((c for c in self.children.values() if c.live > 0), key=lambda c: (c.start, c.live))
+        return child.last()
+
+    def discard(self, path):
+        self.children[path[0]].discard(path[1:])
+        self.live -= 1
+
+
+class FairQueue:
+    """优先级之间严格优先、优先级内按房间和角色公平的队列（非线程安全，由调用方加锁）"""
+
+    def __init__(self, stale_seconds=None):
+        self.stale_seconds = DEFAULT_STALE_SECONDS if stale_seconds is None else stale_seconds
+        self._classes = {}  # 优先级 -> _Node（房间 -> 角色）
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, item, schedule, now=None):
+        entry = _Entry(item, schedule, time.monotonic() if now is None else now)
+        node = self._classes.get(schedule.priority)
+        if node is None:
+            node = self._classes[schedule.priority] = _Node(2)
+        node.push((schedule.room, schedule.role), entry)
+        self._size += 1
+        return entry
+
+    def pop(self, now=None):
+        """取出下一个任务，返回 (条目或 None, [排队过久或超过截止时间被丢弃的条目])"""
+        now = time.monotonic() if now is None else now
+        dropped = []
+        for priority in sorted(self._classes, reverse=True):
+            node = self._classes[priority]
+            limit = self.stale_seconds.get(priority)
+            while node.live > 0:
+                entry = node.pop()
+                self._size -= 1
+                if entry.schedule.deadline is not None and now > entry.schedule.deadline:
+                    entry.dropped = 'deadline'
+                elif limit is not None and now - entry.enqueued > limit:
+                    entry.dropped = 'stale'
+                if entry.dropped is not None:
+                    dropped.append(entry)
+                    continue
+                return entry, dropped
+        return None, dropped
+
+    def evict(self, priority):
+        """抢占：移除一个优先级低于 priority 的排队任务（最低优先级中最后才会轮到的那个），没有则返回 None"""
+        for lower in sorted(self._classes):
+            if lower >= priority:
+                return None
+            node = self._classes[lower]
+            if node.live > 0:
+                entry = node.last()
+                self.remove(entry)
+                return entry
+        return None
+
+    def remove(self, entry):
+        """撤下一个还在排队的条目（已经取出的不受影响），撤下了返回 True"""
+        if entry.cancelled or entry.dropped is not None or not self._contains(entry):
+            return False
+        entry.cancelled = True
+        self._classes[entry.schedule.priority].discard((entry.schedule.room, entry.schedule.role))
+        self._size -= 1
+        return True
+
+    def _contains(self, entry):
+        node = self._classes.get(entry.schedule.priority)
+        room = node.children.get(entry.schedule.room) if node is not None else None
+        flow = room.children.get(entry.schedule.role) if room is not None else None
+        return flow is not None and any(e is entry for e in flow.entries)
+
+    def counts(self):
+        """各优先级排队的任务数"""
+        return {PRIORITY_NAMES.get(p, str(p)): node.live for p, node in sorted(self._classes.items()) if node.live}
+
+
+def _preempted(entry):
+    return Rejected('preempted', '合成任务被更高优先级的请求抢占，请稍后重试', entry.schedule.priority)
+
+
+def _dropped(entry):
+    if entry.dropped == 'deadline':
+        return Rejected('deadline', '合成任务在排队中超过了截止时间', entry.schedule.priority)
+    return Rejected('stale', '合成任务排队过久已丢弃', entry.schedule.priority)
+
+
+def _reject(future, error):
+    """以 error 结束一个排队中的 Future；已经被取消（或已结束）的不受影响"""
+    try:
+        future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class FairExecutor:
+    """固定数量的工作线程，按 FairQueue 的顺序执行提交的任务
+
+    与 ThreadPoolExecutor 一样返回 concurrent.futures.Future；被抢占或过期的任务以 Rejected 结束。
+    排队中的 Future 被取消（future.cancel()）时从队列中撤下。
+    """
+
+    def __init__(self, workers, thread_name_prefix='fair-worker', stale_seconds=None):
+        self.workers = workers
+        self._queue = FairQueue(stale_seconds)
+        self._cond = threading.Condition()
+        self.preempted = 0
+        self.dropped = 0
+        for index in range(workers):
+            threading.Thread(target=self._work, name=f'{thread_name_prefix}_{index}', daemon=True).start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, fn, schedule):
+        future = Future()
+        with self._cond:
+            entry = self._queue.push((fn, future), schedule)
+            self._cond.notify()
+        future.add_done_callback(lambda done: done.cancelled() and self._withdraw(entry))
+        return future
+
+    def _withdraw(self, entry):
+        with self._cond:
+            self._queue.remove(entry)
+
+    def preempt(self, priority):
+        """挤掉一个优先级更低的排队任务，成功返回 True"""
+        with self._cond:
+            entry = self._queue.evict(priority)
+            if entry is None:
+                return False
+            self.preempted += 1
+        # 撤下之后、结束之前被取消时名额同样已经空出
+        _reject(entry.item[1], _preempted(entry))
+        return True
+
+    def counts(self):
+        with self._cond:
+            return self._queue.counts()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not len(self._queue):
+                    self._cond.wait()
+                entry, dropped = self._queue.pop()
+                self.dropped += len(dropped)
+            for stale in dropped:
+                _reject(stale.item[1], _dropped(stale))
+            if entry is None:
+                continue
+            fn, future = entry.item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class FairGate:
+    """限制同时合成的数量，等待中的请求按 FairQueue 的顺序获得名额（每个请求一个线程的服务用）
+
+    用法：
+        with gate.slot(schedule):
+            合成...
+    队列已满且无法抢占时、被抢占、排队过久或超过截止时间时抛出 Rejected；排队中被取消时抛出 Cancelled。
+    """
+
+    def __init__(self, concurrency, max_queue, stale_seconds=None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._queue = FairQueue(stale_seconds)
+        self._cond = threading.Condition()
+        self.running = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.dropped = 0
+
+    def acquire(self, schedule, cancellation=None):
+        """等待一个合成名额；排队中被取消（cancellation）时抛出 Cancelled"""
+        with self._cond:
+            if self.running < self.concurrency and not len(self._queue):
+                self.running += 1
+                return
+            if len(self._queue) >= self.max_queue:
+                victim = self._queue.evict(schedule.priority)
+                if victim is None:
+                    self.rejected += 1
+                    raise Rejected('full', '合成队列已满，请稍后重试', schedule.priority)
+                self.preempted += 1
+                victim.item['error'] = _preempted(victim)
+            waiter = {'granted': False, 'error': None}
+            entry = self._queue.push(waiter, schedule)
+            self._cond.notify_all()
+        if cancellation is not None:
+            cancellation.on_cancel(lambda: self._withdraw(entry, cancellation))
+        with self._cond:
+            while not waiter['granted'] and waiter['error'] is None:
+                if schedule.deadline is None:
+                    self._cond.wait()
+                    continue
+                # 有截止时间的请求最多等到截止时间，不必等下一个名额释放时才被丢弃
+                remaining = schedule.deadline - time.monotonic()
+                if remaining <= 0 and self._queue.remove(entry):
+                    self.dropped += 1
+                    entry.dropped = 'deadline'
+                    waiter['error'] = _dropped(entry)
+                    break
+                self._cond.wait(max(remaining, 0.001))
+            if waiter['error'] is not None:
+                raise waiter['error']
+
+    def _withdraw(self, entry, cancellation):
+        with self._cond:
+            if self._queue.remove(entry):
+                entry.item['error'] = Cancelled(cancellation.reason)
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._grant()
+
+    def _grant(self):
+        while self.running < self.concurrency and len(self._queue):
+            entry, dropped = self._queue.pop()
+            for stale in dropped:
+                stale.item['error'] = _dropped(stale)
+            self.dropped += len(dropped)
+            if entry is not None:
+                entry.item['granted'] = True
+                self.running += 1
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, schedule, cancellation=None):
+        self.acquire(schedule, cancellation)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'queued': len(self._queue),
+                'queued_by_priority': self._queue.counts(),
+                'rejected': self.rejected,
+                'preempted': self.preempted,
+                'dropped': self.dropped,
+            }
+
+
+class Cancelled(Exception):
+    """合成中途停止：显式取消（cancelled）、客户端断开（disconnected）或超过截止时间（deadline）"""
+
+    def __init__(self, reason):
+        super().__init__({
+            'cancelled': '合成已被取消',
+            'disconnected': '客户端已断开，合成已停止',
+            'deadline': '已超过请求的截止时间，合成已停止',
+        }.get(reason, reason))
+        self.reason = reason
+
+
+class Cancellation:
+    """一个请求的取消令牌（线程安全）
+
+    cancel() 之后（或超过截止时间后）check() 抛出 Cancelled；合成循环在每句（每个片段）之间调用 check()。
+    on_cancel() 注册的回调在取消时调用，用于撤下还在排队的任务。截止时间只在 check() 时被动检查。
+    """
+
+    def __init__(self, request_id=None, deadline=None):
+        self.request_id = request_id
+        self.deadline = deadline
+        self._reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def reason(self):
+        """取消原因，未取消时为 None"""
+        if self._reason is None and self.deadline is not None and time.monotonic() > self.deadline:
+            return 'deadline'
+        return self._reason
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self._reason is not None:
+                return
+            self._reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if self._reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise Cancelled(reason)
+
+    def guard(self, items):
+        """透传 items，开始前和每一项之后检查是否已取消；取消时关闭 items（停止后续合成）"""
+        try:
+            self.check()
+            for item in items:
+                self.check()
+                yield item
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
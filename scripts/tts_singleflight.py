@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相同合成请求的合并（single-flight）
+
+一局结束时房间里的几个客户端往往在几毫秒内请求同一句播报、同一个声音，缓存还没来得及写入，
+每个请求都会各自合成一遍。这里按缓存键合并正在进行的合成：第一个请求（leader）开始合成，
+之后到达的相同请求（follower）挂到同一次合成上，逐段读取同一份结果，流式和非流式都适用。
+
+合成由消费者按需拉取（谁读到了还没产出的位置，谁就在自己的线程里取下一段），
+不额外开线程；leader 的客户端中途断开时，其余消费者接着拉取，合成不会中断。
+所有消费者都离开而合成还没完成时，关闭底层生成器（取消尚未开始的工作）。
+
+Piper 服务（scripts/piper-tts-server.py）和 Melo 服务（docs/setup/melo-tts-server-multilang.py）共用。
+"""
+
+import threading
+
+_END = object()
+
+
+class _Flight:
+    """一次进行中的合成：已产出的片段列表 + 底层生成器"""
+
+    __slots__ = ('source', 'items', 'done', 'error', 'producing', 'consumers', 'cond')
+
+    def __init__(self, source):
+        self.source = source
+        self.items = []
+        self.done = False
+        self.error = None
+        self.producing = False
+        self.consumers = 0
+        self.cond = threading.Condition()
+
+    def get(self, index):
+        """取第 index 段，还没产出时由当前线程拉取（或等待正在拉取的线程）；结束时返回 _END"""
+        with self.cond:
+            while True:
+                if index < len(self.items):
+                    return self.items[index]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return _END
+                if not self.producing:
+                    self.producing = True
+                    break
+                self.cond.wait()
+
+        item = _END
+        error = None
+        try:
+            item = next(self.source)
+        except StopIteration:
+            pass
+        except BaseException as e:
+            error = e
+        with self.cond:
+            if item is _END:
+                self.done = True
+                self.error = error
+            else:
+                self.items.append(item)
+            self.producing = False
+            self.cond.notify_all()
+        if error is not None:
+            raise error
+        return item
+
+
+class SingleFlight:
+    """按键合并进行中的合成（线程安全）
+
+    Args:
+        on_follow: 每当一个请求挂到已有的合成上时调用（用于计数指标）
+    """
+
+    def __init__(self, on_follow=None):
+        self.on_follow = on_follow
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def stream(self, key, make_source, follow_only=False):
+        """返回一个逐段产出合成结果的生成器
+        Args:
+            make_source: 没有进行中的相同合成时调用，返回底层生成器（应当是惰性的）
+            follow_only: 为 True 时只跟随已有的合成，没有则返回 None
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                if follow_only:
+                    return None
+                flight = self._flights[key] = _Flight(make_source())
+                self.leaders += 1
+                follower = False
+            else:
+                self.followers += 1
+                follower = True
+            flight.consumers += 1
+        if follower and self.on_follow is not None:
+            self.on_follow()
+        return self._consume(key, flight)
+
+    def do(self, key, fn):
+        """合并一次性调用：相同 key 的并发调用只执行一次 fn()，都得到同一个返回值（或同一个异常）"""
+        consumer = self.stream(key, lambda: (fn() for _ in range(1)))
+        try:
+            return next(consumer)
+        finally:
+            consumer.close()
+
+    def _consume(self, key, flight):
+        index = 0
+        try:
+            while True:
+                item = flight.get(index)
+                if item is _END:
+                    return
+                yield item
+                index += 1
+        finally:
+            self._release(key, flight)
+
+    def _release(self, key, flight):
+        abandoned = False
+        with self._lock:
+            flight.consumers -= 1
+            # 合成完成后新请求直接查缓存；全部消费者都离开时放弃这次合成
+            if (flight.done or flight.consumers == 0) and self._flights.get(key) is flight:
+                del self._flights[key]
+            abandoned = flight.consumers == 0 and not flight.done
+        if abandoned:
+            flight.source.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+            }
@@ -101,6 +101,11 @@ export class PiperTTSClient implements ITTSClient {
         requestBody.gender = voiceConfig.gender; // 'male' 或 'female'
       }
 
+      // 多说话人模型：按说话人名称（或编号）区分玩家，服务端所有说话人共用一个模型会话
+      if (voiceConfig?.speaker) {
+        requestBody.speaker = voiceConfig.speaker;
+      }
+
       const response = await fetch(endpoint, {
         method: 'POST',
         headers: {
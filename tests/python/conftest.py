@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""TTS 服务（scripts/ 下的 Python 模块）的测试：python -m pytest tests/python"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+
+@pytest.fixture(scope='session')
+def server():
+    """按路径导入 piper-tts-server.py（文件名带连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location('piper_tts_server', os.path.join(SCRIPTS_DIR, 'piper-tts-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
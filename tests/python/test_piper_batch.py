@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import pytest
+
+# 两个多说话人模型，说话人 a、b 在各自模型里都是 0 号
+MODELS = {
+    'a': SimpleNamespace(name='voice-a', sha256='hash-a', num_speakers=2, speaker_id_map={'a': 0, 'x': 1}),
+    'b': SimpleNamespace(name='voice-b', sha256='hash-b', num_speakers=2, speaker_id_map={'b': 0, 'y': 1}),
+}
+
+
+@pytest.fixture
+def batch(server, monkeypatch):
+    monkeypatch.setattr(server, 'resolve_model', lambda gender='female', index=None, speaker=None: MODELS.get(speaker, MODELS['a']))
+    return server.parse_batch_request
+
+
+def grouped_ids(groups):
+    return [group['ids'] for group in groups]
+
+
+def test_identical_items_share_one_synthesis(batch):
+    groups, errors = batch({'items': [{'id': 1, 'text': '你好'}, {'id': 2, 'text': ' 你好 '}, {'id': 3, 'text': '再见'}]})
+    assert grouped_ids(groups) == [[1, 2], [3]] and errors == []
+
+
+def test_items_for_different_speakers_are_not_merged(batch):
+    groups, _ = batch({'items': [
+        {'id': 1, 'text': '你好', 'speaker': 'a'},
+        {'id': 2, 'text': '你好', 'speaker': 'b'},
+        {'id': 3, 'text': '你好', 'speaker': 'x'},
+        {'id': 4, 'text': '你好', 'speaker': 'a'},
+    ]})
+    assert grouped_ids(groups) == [[1, 4], [2], [3]]
+
+
+def test_output_format_and_params_split_groups(batch):
+    groups, _ = batch({'items': [
+        {'id': 1, 'text': '你好'},
+        {'id': 2, 'text': '你好', 'format': 'l16'},
+        {'id': 3, 'text': '你好', 'length_scale': 1.5},
+    ]})
+    assert grouped_ids(groups) == [[1], [2], [3]]
+
+
+def test_invalid_items_and_bodies(batch):
+    groups, errors = batch({'items': ['text', {'id': 'x'}, {'text': '好'}]})
+    assert grouped_ids(groups) == [[2]]
+    assert [item_id for item_id, _ in errors] == [0, 'x']
+    for body in (None, [], 'items'):
+        with pytest.raises(ValueError, match='JSON 对象'):
+            batch(body)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from piper_batching import MicroBatcher, _Pending, has_durations
+
+HOP = 4
+
+
+class FakeSession:
+    """按音素ID生成音频的假会话：每个音素 (id % 3 + 1) 帧，补齐部分填非零的"噪声\""""
+
+    def __init__(self, durations=True):
+        self.durations = durations
+        self.calls = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in ('input', 'input_lengths', 'scales')]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name='output')] + ([SimpleNamespace(name='w_ceil')] if self.durations else [])
+
+    def run(self, names, args):
+        ids, lengths = args['input'], args['input_lengths']
+        self.calls.append(len(ids))
+        w_ceil = (ids % 3 + 1).astype(np.float32)
+        for row, length in enumerate(lengths):
+            w_ceil[row, length:] = 0
+        frames = w_ceil.sum(axis=1).astype(int)
+        audio = np.full((len(ids), 1, 1, frames.max() * HOP), 0.5, dtype=np.float32)
+        for row in range(len(ids)):
+            samples = np.repeat(ids[row, :lengths[row]], (w_ceil[row, :lengths[row]] * HOP).astype(int))
+            audio[row, 0, 0, :len(samples)] = samples / 100
+        return [audio, w_ceil[:, None, :]] if self.durations else [audio]
+
+
+def make_batcher(session, **kwargs):
+    config = SimpleNamespace(noise_scale=0.667, length_scale=1.0, noise_w_scale=0.8, num_speakers=1,
+                             default_speaker_id=0, hop_length=HOP)
+    return MicroBatcher(session, config, **kwargs)
+
+
+def test_has_durations():
+    assert has_durations(FakeSession())
+    assert not has_durations(FakeSession(durations=False))
+
+
+def test_batch_rows_are_trimmed_by_durations():
+    session = FakeSession()
+    batcher = make_batcher(session)
+    sentences = [[1, 5, 7, 2], [3, 4], [8, 8, 8, 1, 2, 6]]
+    scales = batcher.scales_for(None)
+    outputs = batcher._infer_batch([_Pending(ids, scales, None) for ids in sentences])
+    assert session.calls == [3]
+    for ids, audio in zip(sentences, outputs):
+        single = batcher._infer_batch([_Pending(ids, scales, None)])[0]
+        # 补齐部分（0.5）被切掉，与单独推理的结果相同
+        np.testing.assert_array_equal(audio, single)
+        assert len(audio) == sum(i % 3 + 1 for i in ids) * HOP
+
+
+def test_batches_group_similar_lengths_and_same_scales():
+    batcher = make_batcher(FakeSession(), max_batch=3, length_ratio=1.5)
+    scales = batcher.scales_for(None)
+    other = batcher.scales_for(SimpleNamespace(length_scale=1.2))
+    first, near, far, different, nearer = (
+        _Pending([1] * 10, scales, None), _Pending([1] * 14, scales, None), _Pending([1] * 30, scales, None),
+        _Pending([1] * 10, other, None), _Pending([1] * 11, scales, None),
+    )
+    batcher._pending = [first, near, far, different, nearer]
+    assert batcher._take() == [first, nearer, near]
+    assert batcher._pending == [far, different]
+
+
+def test_inference_errors_reach_every_caller():
+    session = FakeSession()
+    session.run = lambda names, args: (_ for _ in ()).throw(RuntimeError('boom'))
+    batcher = make_batcher(session)
+    with pytest.raises(RuntimeError):
+        batcher.infer([1, 2, 3])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from piper_lexicon import PhonemeCache, PhonemeList, cached_phonemes, normalize_text, split_sentences
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('要不起', ['要不起']),
+    ('要不起！我跟一手。', ['要不起！', '我跟一手。']),
+    ('你说"好啊！"然后呢？', ['你说"好啊！"', '然后呢？']),
+    ('等等……好吧', ['等等……', '好吧']),
+    ('第一行\n第二行', ['第一行', '第二行']),
+    ('Wait. Go on', ['Wait.', 'Go on']),
+    ('版本3.5可以', ['版本3.5可以']),
+    ('炸弹！！！', ['炸弹！！！']),
+    ('……我来', ['……我来']),
+    ('好！……', ['好！……']),
+    ('', []),
+    ('……', ['……']),
+])
+def test_split_sentences(text, expected):
+    assert split_sentences(text) == expected
+
+
+def test_normalize_text():
+    assert normalize_text('  要不起 \n 我跟\t一手 ') == '要不起 我跟 一手'
+
+
+def fake_phonemize(calls):
+    def phonemize(sentence):
+        calls.append(sentence)
+        return [PhonemeList(list(sentence), [ord(ch) for ch in sentence])]
+    return phonemize
+
+
+def test_runtime_cache_is_per_sentence():
+    calls = []
+    lookups = []
+    cache = PhonemeCache(16)
+    first = cached_phonemes(cache, '要不起！我跟一手。', fake_phonemize(calls), lookups.append)
+    assert [list(phonemes) for phonemes in first] == [list('要不起！'), list('我跟一手。')]
+    assert calls == ['要不起！', '我跟一手。']
+    # 另一句台词里相同的句子直接命中
+    second = cached_phonemes(cache, '炸弹！ 我跟一手。', fake_phonemize(calls), lookups.append)
+    assert calls == ['要不起！', '我跟一手。', '炸弹！']
+    assert second[1] is first[1]
+    assert lookups == ['miss', 'miss', 'miss', 'memory']
+
+
+def test_lexicon_serves_whole_lines_and_sentences():
+    calls = []
+    whole = [PhonemeList(['a'], [1]), PhonemeList(['b'], [2])]
+    sentence = [PhonemeList(['c'], [3])]
+    cache = PhonemeCache(16, {'要不起！我跟一手。': whole, '炸弹！': sentence})
+    assert cached_phonemes(cache, ' 要不起！我跟一手。 ', fake_phonemize(calls)) == whole
+    assert cached_phonemes(cache, '炸弹！顺子。', fake_phonemize(calls))[0] is sentence[0]
+    assert calls == ['顺子。']
+    assert cache.stats()['lexicon_hits'] == 2
+
+
+def test_cache_evicts_least_recently_used():
+    cache = PhonemeCache(2)
+    for key in ('a', 'b'):
+        cache.put(key, [key])
+    cache.get('a')
+    cache.put('c', ['c'])
+    assert cache.get('b') == (None, 'miss')
+    assert cache.get('a') == (['a'], 'memory')
+    disabled = PhonemeCache(0)
+    disabled.put('a', ['a'])
+    assert disabled.get('a') == (None, 'miss')
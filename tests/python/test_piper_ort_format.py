@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+onnx = pytest.importorskip('onnx')
+onnxruntime = pytest.importorskip('onnxruntime')
+pytest.importorskip('piper.patch_voice_with_alignment')
+
+from onnx import TensorProto, helper
+
+import piper_ort_format
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    """只有一个 Ceil 节点（相当于 Piper 的 w_ceil）的小模型"""
+    graph = helper.make_graph(
+        [helper.make_node('Ceil', ['input'], ['w_ceil']), helper.make_node('Neg', ['w_ceil'], ['output'])],
+        'tiny',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [None])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [None])]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8)
+    path = tmp_path / 'voice.onnx'
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def output_names(source, options=None):
+    session = onnxruntime.InferenceSession(source, sess_options=options, providers=['CPUExecutionProvider'])
+    return [output.name for output in session.get_outputs()]
+
+
+def test_session_model_source_loads_by_path_unless_durations_are_needed(model_path):
+    assert piper_ort_format.session_model_source(model_path, onnxruntime.SessionOptions()) == model_path
+
+    source = piper_ort_format.session_model_source(model_path, onnxruntime.SessionOptions(), durations=True)
+    assert isinstance(source, bytes)
+    assert output_names(source) == ['output', 'w_ceil']
+
+
+def test_convert_adds_durations_only_on_request(model_path):
+    ort_path = piper_ort_format.convert(model_path)
+    options = onnxruntime.SessionOptions()
+    assert piper_ort_format.session_model_source(model_path, options, durations=True) == ort_path
+    assert output_names(ort_path, options) == ['output']
+
+    piper_ort_format.convert(model_path, force=True, durations=True)
+    options = onnxruntime.SessionOptions()
+    options.add_session_config_entry('session.load_model_format', 'ORT')
+    assert output_names(ort_path, options) == ['output', 'w_ceil']
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import Future
+
+import pytest
+
+from tts_scheduler import Cancelled
+
+
+def chunks(*items):
+    yield from items
+
+
+def collect(stream):
+    async def run():
+        return [item async for item in stream]
+    return asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+
+def test_stream_yields_chunks(server):
+    queue = server.SynthesisQueue(1, 4)
+    queue.admit()
+    assert collect(queue.stream(lambda: chunks(b'a', b'b'))) == [b'a', b'b']
+
+
+def test_stream_raises_when_make_iter_fails(server):
+    def make_iter():
+        raise ValueError('bad text')
+
+    queue = server.SynthesisQueue(1, 4)
+    queue.admit()
+    with pytest.raises(ValueError, match='bad text'):
+        collect(queue.stream(make_iter))
+
+
+def finished_future(outcome):
+    def submit(fn, schedule):
+        future = Future()
+        outcome(future)
+        return future
+    return submit
+
+
+def test_stream_raises_when_cancelled_without_reason(server):
+    queue = server.SynthesisQueue(1, 4)
+    queue._submit = finished_future(lambda future: future.cancel())
+    with pytest.raises(Cancelled):
+        collect(queue.stream(lambda: chunks(b'a')))
+
+
+def test_stream_raises_executor_errors(server):
+    queue = server.SynthesisQueue(1, 4)
+    queue._submit = finished_future(lambda future: future.set_exception(RuntimeError('executor down')))
+    with pytest.raises(RuntimeError, match='executor down'):
+        collect(queue.stream(lambda: chunks(b'a')))
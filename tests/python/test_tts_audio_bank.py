@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from tts_audio_bank import MAGIC, AudioBank, BankWriter, byte_range, common_game_phrases, open_default_bank
+
+
+@pytest.fixture
+def bank_path(tmp_path):
+    path = tmp_path / 'bank.bin'
+    writer = BankWriter(str(path), engine='piper')
+    writer.add('k1', b'first', {'text': '要不起', 'sample_rate': 22050})
+    writer.add('k2', b'second!', {'text': '炸弹', 'content_type': 'audio/ogg'})
+    writer.add('k1', b'ignored')
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, (200, 0, 100)),
+    ('bytes=0-9', (206, 0, 10)),
+    ('bytes=90-', (206, 90, 100)),
+    ('bytes=90-500', (206, 90, 100)),
+    ('bytes=-10', (206, 90, 100)),
+    ('bytes=-500', (206, 0, 100)),
+    ('bytes=99-99', (206, 99, 100)),
+    # 多个范围、无法解析和 b < a 的范围都忽略
+    ('bytes=0-1,5-6', (200, 0, 100)),
+    ('bytes=-', (200, 0, 100)),
+    ('items=0-1', (200, 0, 100)),
+    ('bytes=9-3', (200, 0, 100)),
+    # 不可满足的范围
+    ('bytes=-0', (416, 0, 0)),
+    ('bytes=100-', (416, 0, 0)),
+    ('bytes=150-200', (416, 0, 0)),
+])
+def test_byte_range(header, expected):
+    status, start, stop, headers = byte_range(header, 100)
+    assert (status, start, stop) == expected
+    assert headers['Accept-Ranges'] == 'bytes'
+    if status == 206:
+        assert headers['Content-Range'] == f'bytes {start}-{stop - 1}/100'
+        assert headers['Content-Length'] == str(stop - start)
+    elif status == 416:
+        assert headers['Content-Range'] == 'bytes */100'
+        assert 'Content-Length' not in headers
+    else:
+        assert headers['Content-Length'] == '100'
+
+
+def test_bank_round_trip(bank_path):
+    bank = AudioBank(str(bank_path))
+    assert len(bank) == 2 and bank.engine == 'piper'
+    audio, meta = bank.get('k1')
+    assert audio == b'first' and meta['text'] == '要不起'
+    assert bank.get('k2')[0] == b'second!'
+    assert bank.get('missing') is None and bank.get(None) is None
+    assert bank.stats()['hits'] == 2 and bank.stats()['misses'] == 2
+    # 清单里的偏移量可以直接用于 Range 请求
+    whole = b''.join(bank.read(0, bank.size))
+    assert whole == bank_path.read_bytes() and whole.startswith(MAGIC)
+    for entry in bank.manifest()['entries']:
+        assert whole[entry['offset']:entry['offset'] + entry['length']] == bank.get(entry['key'])[0]
+    assert bank.etag.startswith('"') and bank.etag == AudioBank(str(bank_path)).etag
+
+
+def test_truncated_or_foreign_files_are_rejected(bank_path, tmp_path):
+    data = bank_path.read_bytes()
+    truncated = tmp_path / 'truncated.bin'
+    truncated.write_bytes(data[:-5])
+    foreign = tmp_path / 'foreign.bin'
+    foreign.write_bytes(b'RIFF' + b'\x00' * 64)
+    for path in (truncated, foreign):
+        with pytest.raises(ValueError):
+            AudioBank(str(path))
+
+
+def test_aborted_writer_leaves_no_file(tmp_path):
+    writer = BankWriter(str(tmp_path / 'bank.bin'))
+    writer.add('k', b'audio')
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_open_default_bank(bank_path, tmp_path, monkeypatch):
+    monkeypatch.delenv('TTS_AUDIO_BANK', raising=False)
+    assert open_default_bank(str(tmp_path / 'missing.bin')) is None
+    assert len(open_default_bank(str(bank_path))) == 2
+    monkeypatch.setenv('TTS_AUDIO_BANK', 'off')
+    assert open_default_bank(str(bank_path)) is None
+
+
+def test_common_game_phrases(tmp_path):
+    source = tmp_path / 'audioPreloader.ts'
+    source.write_text(
+        "const OTHER = [{ text: '不要' }];\n"
+        "export const COMMON_GAME_PHRASES: PreloadItem[] = [\n"
+        "  { text: '要不起', priority: 1 },\n"
+        "  { text: '炸弹！' },\n"
+        "];\n",
+        encoding='utf-8'
+    )
+    assert list(common_game_phrases(str(source))) == ['要不起', '炸弹！']
+    assert list(common_game_phrases(str(tmp_path / 'missing.ts'))) == []
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import io
+import struct
+
+import numpy as np
+import pytest
+
+import tts_audio_formats
+from tts_audio_formats import (
+    ADPCM_INDEX_TABLE, ADPCM_STEP_TABLE, DEFAULT_FORMAT, OutputFormat, encode_ima_adpcm, encode_pcm, negotiate,
+    pcm16_to_l16, resample_pcm16, stream_chunks, wav_header, wav_to_pcm,
+)
+
+
+def tone(frequency, sample_rate, seconds=0.5, amplitude=8000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype('<i2').tobytes()
+
+
+def peak_frequency(pcm, sample_rate):
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.argmax(spectrum) * sample_rate / len(samples)
+
+
+def rms(pcm):
+    return float(np.sqrt(np.mean(np.frombuffer(pcm, dtype='<i2').astype(np.float64) ** 2)))
+
+
+def ima_decode_block(block, samples_per_block):
+    """IMA-ADPCM 标准解码（逐采样），用作对照"""
+    predictor = struct.unpack('<h', block[:2])[0]
+    index = block[2]
+    out = [predictor]
+    nibbles = []
+    for byte in block[4:]:
+        nibbles += [byte & 0x0F, byte >> 4]
+    for nibble in nibbles[:samples_per_block - 1]:
+        step = ADPCM_STEP_TABLE[index]
+        diff = step >> 3
+        if nibble & 4:
+            diff += step
+        if nibble & 2:
+            diff += step >> 1
+        if nibble & 1:
+            diff += step >> 2
+        predictor = max(-32768, min(32767, predictor - diff if nibble & 8 else predictor + diff))
+        index = max(0, min(88, index + ADPCM_INDEX_TABLE[nibble]))
+        out.append(predictor)
+    return out
+
+
+def test_negotiate_explicit_parameters():
+    assert negotiate() == DEFAULT_FORMAT
+    assert negotiate('L16', '16000') == OutputFormat('l16', 16000)
+    assert negotiate('adpcm', accept='audio/l16') == OutputFormat('adpcm', None)
+    for format_param, rate_param in (('mp3', None), ('wav', '44100'), ('wav', 'fast')):
+        with pytest.raises(ValueError):
+            negotiate(format_param, rate_param)
+
+
+def test_negotiate_accept_header(monkeypatch):
+    monkeypatch.setattr(tts_audio_formats, 'opus_available', lambda: False)
+    assert negotiate(accept='audio/L16; rate=8000') == OutputFormat('l16', 8000)
+    assert negotiate(accept='audio/wav;q=0.5, audio/x-ima-adpcm') == OutputFormat('adpcm', None)
+    assert negotiate(accept='audio/l16;q=0.2, audio/x-wav;q=0.9') == OutputFormat('wav', None)
+    # 不支持的采样率忽略，显式的 rate 参数覆盖 Accept 头
+    assert negotiate(accept='audio/l16; rate=44100') == OutputFormat('l16', None)
+    assert negotiate(rate_param=16000, accept='audio/l16; rate=8000') == OutputFormat('l16', 16000)
+    # q=0、不认识的类型和不可用的 Opus 都跳过
+    assert negotiate(accept='audio/l16;q=0, text/html, */*') == DEFAULT_FORMAT
+    assert negotiate(accept='audio/ogg, audio/l16;q=0.1') == OutputFormat('l16', None)
+    with pytest.raises(ValueError):
+        negotiate('opus')
+    monkeypatch.setattr(tts_audio_formats, 'opus_available', lambda: True)
+    assert negotiate(accept='audio/ogg, audio/l16;q=0.1') == OutputFormat('opus', None)
+
+
+def test_output_format_helpers():
+    assert OutputFormat('wav', None).is_plain_wav(22050)
+    assert OutputFormat('wav', 22050).is_plain_wav(22050)
+    assert not OutputFormat('wav', 16000).is_plain_wav(22050)
+    assert OutputFormat('l16', None).streamable and not OutputFormat('adpcm', None).streamable
+    assert OutputFormat('opus', 16000).cache_tag() == 'opus@16000'
+    assert DEFAULT_FORMAT.cache_tag() == 'wav@native'
+
+
+def test_wav_header_round_trip():
+    pcm = tone(440, 22050, 0.1)
+    data = wav_header(22050, 1, 2, len(pcm)) + pcm
+    assert len(wav_header()) == 44
+    assert struct.unpack('<I', data[4:8])[0] == len(data) - 8
+    assert wav_to_pcm(data) == (pcm, (22050, 1, 2))
+    assert wav_header(data_size=None)[4:8] == b'\xff\xff\xff\xff'
+
+
+def test_l16_is_big_endian():
+    assert pcm16_to_l16(struct.pack('<hh', 1, -2)) == b'\x00\x01\xff\xfe'
+    audio, content_type = encode_pcm(struct.pack('<h', 0x1234), 22050, 1, 2, OutputFormat('l16', None))
+    assert audio == b'\x12\x34'
+    assert content_type == 'audio/L16; rate=22050; channels=1'
+
+
+def test_resample_keeps_pitch_and_length():
+    pcm = tone(1000, 22050)
+    out = resample_pcm16(pcm, 22050, 16000)
+    assert len(out) // 2 == round(len(pcm) // 2 * 16000 / 22050)
+    assert abs(peak_frequency(out, 16000) - 1000) < 10
+    assert abs(rms(out) - rms(pcm)) / rms(pcm) < 0.05
+    assert resample_pcm16(pcm, 22050, 22050) is pcm
+
+
+def test_downsampling_filters_frequencies_above_nyquist():
+    # 6 kHz 在 8 kHz 采样下会混叠到 2 kHz，低通后应当基本消失
+    out = resample_pcm16(tone(6000, 22050), 22050, 8000)
+    assert rms(out) < 0.05 * rms(tone(6000, 22050))
+
+
+def test_ima_adpcm_matches_reference_decoder():
+    pcm = tone(440, 16000, 0.2) + tone(2000, 16000, 0.1, amplitude=20000)
+    data = encode_ima_adpcm(pcm, 16000)
+    with io.BytesIO(data) as f:
+        assert f.read(4) == b'RIFF'
+        assert struct.unpack('<I', f.read(4))[0] == len(data) - 8
+        assert f.read(8) == b'WAVEfmt '
+        size = struct.unpack('<I', f.read(4))[0]
+        fmt = struct.unpack('<HHIIHHHH', f.read(size))
+        assert fmt[0] == 0x11 and fmt[1] == 1 and fmt[2] == 16000 and fmt[4] == 256 and fmt[5] == 4
+        samples_per_block = fmt[7]
+        assert samples_per_block == 505
+        assert f.read(4) == b'fact'
+        f.read(4)
+        total = struct.unpack('<I', f.read(4))[0]
+        assert f.read(4) == b'data'
+        body = f.read(struct.unpack('<I', f.read(4))[0])
+    assert total == len(pcm) // 2
+    assert len(body) % 256 == 0
+    decoded = []
+    for offset in range(0, len(body), 256):
+        decoded += ima_decode_block(body[offset:offset + 256], samples_per_block)
+    decoded = np.array(decoded[:total], dtype=np.float64)
+    original = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+    snr = 10 * np.log10(np.sum(original ** 2) / np.sum((original - decoded) ** 2))
+    assert snr > 20
+
+
+def test_ima_adpcm_is_readable_by_libsndfile():
+    soundfile = pytest.importorskip('soundfile')
+    pcm = tone(440, 8000, 0.3)
+    samples, rate = soundfile.read(io.BytesIO(encode_ima_adpcm(pcm, 8000)), dtype='int16')
+    # libsndfile 不看 fact 块，按整块返回（末尾是补齐的最后一个采样）
+    assert rate == 8000 and len(samples) == 5 * 505
+    assert abs(peak_frequency(samples[:len(pcm) // 2].astype('<i2').tobytes(), 8000) - 440) < 10
+
+
+def test_encode_pcm_resamples_before_encoding():
+    audio, content_type = encode_pcm(tone(440, 22050), 22050, 1, 2, OutputFormat('wav', 8000))
+    assert content_type == 'audio/wav'
+    assert wav_to_pcm(audio)[1] == (8000, 1, 2)
+    with pytest.raises(ValueError):
+        encode_pcm(b'\x00' * 4, 22050, 1, 1, DEFAULT_FORMAT)
+
+
+def test_stream_chunks():
+    chunks = [(struct.pack('<h', 1), (22050, 1, 2)), (b'', (22050, 1, 2)), (struct.pack('<h', 2), (22050, 1, 2))]
+    assert list(stream_chunks(chunks, OutputFormat('wav', None))) == [
+        wav_header(22050, 1, 2), struct.pack('<h', 1), struct.pack('<h', 2)
+    ]
+    assert b''.join(stream_chunks(chunks, OutputFormat('l16', None))) == b'\x00\x01\x00\x02'
+
+
+def test_opus_resamples_unsupported_rates():
+    if not tts_audio_formats.opus_available():
+        pytest.skip('没有可用的 Opus 编码器')
+    audio, content_type = encode_pcm(tone(440, 22050), 22050, 1, 2, OutputFormat('opus', None))
+    assert content_type == 'audio/ogg; codecs=opus'
+    assert audio[:4] == b'OggS'
+    assert tts_audio_formats.encode_opus(tone(440, 16000), 16000)[1] == 16000
+    assert tts_audio_formats.encode_opus(tone(440, 22050), 22050)[1] == 24000
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+import tts_audio_store
+from tts_audio_store import AudioStore, etag_matches, open_default_store, strong_etag, weak_etag
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AudioStore(tmp_path / 'store', 1000, write_behind=False)
+
+
+def test_make_key_covers_every_parameter():
+    key = AudioStore.make_key('piper', 'abc', 0, 1.0, '要不起')
+    assert key == AudioStore.make_key('piper', 'abc', 0, 1.0, '要不起')
+    assert len({
+        key,
+        AudioStore.make_key('melo', 'abc', 0, 1.0, '要不起'),
+        AudioStore.make_key('piper', 'abd', 0, 1.0, '要不起'),
+        AudioStore.make_key('piper', 'abc', 1, 1.0, '要不起'),
+        AudioStore.make_key('piper', 'abc', 0, 1.2, '要不起'),
+        AudioStore.make_key('piper', 'abc', 0, 1.0, '要得起'),
+        AudioStore.make_key('piper', 'abc', 0, 1.0, '要不起', output='l16@native'),
+    }) == 7
+
+
+def test_put_and_get(store):
+    assert store.get('k1') is None
+    store.put('k1', b'wav-data', {'mimetype': 'audio/wav'})
+    store.put('k2', (b'seg', b'ments'), {'sample_rate': 22050})
+    assert store.get('k1') == (b'wav-data', {'mimetype': 'audio/wav'})
+    assert store.get('k2') == (b'segments', {'sample_rate': 22050})
+    stats = store.stats()
+    assert (stats['entries'], stats['bytes'], stats['hits'], stats['misses']) == (2, 16, 2, 1)
+
+
+def test_empty_and_oversized_entries_are_not_stored(store):
+    store.put('empty', b'')
+    store.put('huge', b'x' * 1001)
+    assert store.get('empty') is None and store.get('huge') is None
+    assert store.stats()['entries'] == 0
+
+
+def test_write_behind_serves_pending_entries(tmp_path):
+    store = AudioStore(tmp_path, 1000)
+    store.put('k', b'audio', {'a': 1})
+    assert store.get('k') == (b'audio', {'a': 1})
+    store.flush(5)
+    assert store.stats()['pending_writes'] == 0
+    assert os.path.exists(os.path.join(store.objects_dir, 'k', 'k'))
+    # 另一个进程（新打开的存储）能读到
+    assert AudioStore(tmp_path, 1000, write_behind=False).get('k') == (b'audio', {'a': 1})
+
+
+def test_least_recently_used_entries_are_evicted(store, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(tts_audio_store.time, 'time', lambda: next(clock))
+    for key in ('a', 'b', 'c'):
+        store.put(key, b'x' * 300)
+    store.get('a')
+    store.put('d', b'x' * 300)
+    assert store.get('b') is None
+    assert [store.get(key) is not None for key in ('a', 'c', 'd')] == [True, True, True]
+    assert store.stats()['evictions'] == 1
+    assert not os.path.exists(store._object_path('b'))
+
+
+def test_recover_drops_missing_files_and_old_orphans(tmp_path):
+    root = tmp_path / 'store'
+    store = AudioStore(root, 1000, write_behind=False)
+    store.put('kept', b'audio')
+    store.put('lost', b'audio')
+    os.unlink(store._object_path('lost'))
+    old_orphan = os.path.join(store.objects_dir, 'or', 'orphan')
+    os.makedirs(os.path.dirname(old_orphan))
+    with open(old_orphan, 'wb') as f:
+        f.write(b'x')
+    old = time.time() - tts_audio_store.ORPHAN_GRACE_SECONDS - 10
+    os.utime(old_orphan, (old, old))
+    fresh_tmp = store._object_path('kept') + '.123.tmp'
+    with open(fresh_tmp, 'wb') as f:
+        f.write(b'x')
+
+    reopened = AudioStore(root, 1000, write_behind=False)
+    assert reopened.stats()['entries'] == 1
+    assert reopened.get('kept') == (b'audio', {})
+    assert not os.path.exists(old_orphan)
+    # 宽限期内的临时文件可能是其他进程正在写入的，不删除
+    assert os.path.exists(fresh_tmp)
+
+
+def test_missing_file_is_a_miss(store):
+    store.put('k', b'audio')
+    os.unlink(store._object_path('k'))
+    assert store.get('k') is None
+    assert store.stats()['entries'] == 0
+
+
+def test_corrupt_index_is_rebuilt(tmp_path):
+    root = tmp_path / 'store'
+    AudioStore(root, 1000, write_behind=False).put('k', b'audio')
+    index = root / 'index.sqlite3'
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(f'{index}{suffix}'):
+            os.unlink(f'{index}{suffix}')
+    index.write_bytes(b'not a database' * 100)
+    store = AudioStore(root, 1000, write_behind=False)
+    assert store.get('k') is None
+    assert any(name.startswith('index.sqlite3.corrupt-') for name in os.listdir(root))
+
+
+def test_open_default_store(tmp_path, monkeypatch):
+    monkeypatch.setenv('TTS_AUDIO_STORE_MB', '0')
+    assert open_default_store(str(tmp_path)) is None
+    monkeypatch.setenv('TTS_AUDIO_STORE_MB', '1')
+    monkeypatch.setenv('TTS_AUDIO_STORE_DIR', str(tmp_path / 'shared'))
+    store = open_default_store(str(tmp_path / 'default'))
+    assert store.root == str(tmp_path / 'shared') and store.max_bytes == 1024 * 1024
+
+
+def test_etags():
+    etag = strong_etag('abc')
+    assert etag == '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert etag_matches(' * ', etag)
+    assert not etag_matches('"abcd"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('', etag)
+
+
+def test_weak_etags_match_either_form():
+    etag = weak_etag('abc')
+    assert etag == 'W/"abc"'
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert not etag_matches('W/"abcd"', etag)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from tts_scheduler import (
+    Cancellation, Cancelled, FairExecutor, FairGate, FairQueue, Rejected, make_schedule, parse_deadline_ms,
+    parse_priority, stale_seconds_from_env,
+)
+
+
+def drain(queue, now=0):
+    """按顺序取出队列中的所有任务"""
+    items = []
+    while len(queue):
+        entry, _ = queue.pop(now)
+        if entry is not None:
+            items.append(entry.item)
+    return items
+
+
+def test_parse_priority():
+    assert parse_priority(None) == parse_priority('event') == 2
+    assert parse_priority(' Announcement ') == parse_priority(4) == parse_priority('4') == 4
+    for value in ('shout', 0, 5, 'x1'):
+        with pytest.raises(ValueError):
+            parse_priority(value)
+
+
+def test_parse_deadline_ms():
+    assert parse_deadline_ms(None) is None
+    assert parse_deadline_ms('0') <= time.monotonic()
+    assert parse_deadline_ms('1000') > time.monotonic() + 0.9
+    for value in ('-1', 'soon', 'nan'):
+        with pytest.raises(ValueError):
+            parse_deadline_ms(value)
+
+
+def test_stale_seconds_from_env(monkeypatch):
+    monkeypatch.setenv('TTS_STALE_SECONDS', 'chat=2,quarrel=30,event=0')
+    assert stale_seconds_from_env() == {1: 2.0, 3: 30.0}
+
+
+def test_higher_priority_is_served_first():
+    queue = FairQueue({})
+    queue.push('chat', make_schedule('chat'), now=0)
+    queue.push('event', make_schedule('event'), now=0)
+    queue.push('announcement', make_schedule('announcement'), now=0)
+    queue.push('quarrel', make_schedule('quarrel'), now=0)
+    assert drain(queue) == ['announcement', 'quarrel', 'event', 'chat']
+
+
+def test_roles_in_a_room_take_turns():
+    queue = FairQueue({})
+    for index in range(3):
+        queue.push(f'a{index}', make_schedule(room='r', role='a', text='要不起'), now=0)
+    queue.push('b0', make_schedule(room='r', role='b', text='要不起'), now=0)
+    assert drain(queue) == ['a0', 'b0', 'a1', 'a2']
+
+
+def test_busy_room_does_not_starve_other_rooms():
+    queue = FairQueue({})
+    for index in range(4):
+        queue.push(f'busy{index}', make_schedule(room='busy', role=str(index), text='炸弹'), now=0)
+    queue.push('quiet', make_schedule(room='quiet', text='炸弹'), now=0)
+    assert drain(queue).index('quiet') == 1
+
+
+def test_cost_is_charged_by_text_length():
+    queue = FairQueue({})
+    queue.push('long', make_schedule(role='a', text='长' * 40), now=0)
+    queue.push('long2', make_schedule(role='a', text='长' * 40), now=0)
+    for index in range(3):
+        queue.push(f'short{index}', make_schedule(role='b', text='好'), now=0)
+    # 说了一长句的角色要等另一个角色把短句说完
+    assert drain(queue) == ['long', 'short0', 'short1', 'short2', 'long2']
+
+
+def test_stale_and_expired_entries_are_dropped_on_pop():
+    queue = FairQueue({1: 5.0})
+    stale = queue.push('chat', make_schedule('chat'), now=0)
+    expired = queue.push('event', make_schedule('event', deadline=3), now=0)
+    queue.push('quarrel', make_schedule('quarrel'), now=0)
+    entry, dropped = queue.pop(now=1)
+    assert entry.item == 'quarrel' and dropped == []
+    entry, dropped = queue.pop(now=10)
+    assert entry is None and len(queue) == 0
+    assert dropped == [expired, stale]
+    assert (expired.dropped, stale.dropped) == ('deadline', 'stale')
+
+
+def test_evict_picks_the_last_lowest_priority_entry():
+    queue = FairQueue({})
+    queue.push('event', make_schedule('event'), now=0)
+    queue.push('chat0', make_schedule('chat', role='a'), now=0)
+    queue.push('chat1', make_schedule('chat', role='a'), now=0)
+    queue.push('chat2', make_schedule('chat', role='b'), now=0)
+    assert queue.evict(1) is None
+    assert queue.evict(4).item == 'chat1'
+    assert queue.counts() == {'chat': 2, 'event': 1}
+    assert drain(queue) == ['event', 'chat0', 'chat2']
+
+
+def test_removed_entries_are_skipped():
+    queue = FairQueue({})
+    first = queue.push('first', make_schedule(role='a'), now=0)
+    queue.push('second', make_schedule(role='a'), now=0)
+    assert queue.remove(first)
+    assert not queue.remove(first)
+    assert len(queue) == 1
+    assert drain(queue) == ['second']
+    # 已经取出的条目不能再撤下
+    taken = queue.push('third', make_schedule(), now=0)
+    queue.pop(0)
+    assert not queue.remove(taken)
+
+
+def test_executor_runs_jobs_and_reports_errors():
+    executor = FairExecutor(1)
+    assert executor.submit(lambda: 42, make_schedule()).result(timeout=5) == 42
+    with pytest.raises(ZeroDivisionError):
+        executor.submit(lambda: 1 / 0, make_schedule()).result(timeout=5)
+
+
+def _block(executor):
+    """占住唯一的工作线程，返回放行用的 Event"""
+    release = threading.Event()
+    started = threading.Event()
+    executor.submit(lambda: (started.set(), release.wait(5)), make_schedule('announcement'))
+    assert started.wait(5)
+    return release
+
+
+def test_cancelled_future_leaves_queue_before_going_stale():
+    executor = FairExecutor(1, stale_seconds={1: 0.05})
+    release = _block(executor)
+    future = executor.submit(lambda: 'chat', make_schedule('chat'))
+    assert future.cancel()
+    assert len(executor) == 0
+    time.sleep(0.1)
+    release.set()
+    # 工作线程还活着：后面的任务照常执行
+    assert executor.submit(lambda: 'next', make_schedule('event')).result(timeout=5) == 'next'
+
+
+def test_cancel_racing_stale_drop_keeps_worker_alive():
+    executor = FairExecutor(1, stale_seconds={1: 0.05})
+    release = _block(executor)
+    # 取消回调来不及撤下条目（取消与工作线程取出同时发生）
+    executor._withdraw = lambda entry: None
+    future = executor.submit(lambda: 'chat', make_schedule('chat'))
+    assert future.cancel()
+    time.sleep(0.1)
+    release.set()
+    # 先让工作线程取出并丢弃过期的条目，再提交下一个任务
+    time.sleep(0.1)
+    assert executor.submit(lambda: 'next', make_schedule('event')).result(timeout=5) == 'next'
+
+
+def test_preempt_skips_cancelled_entries():
+    executor = FairExecutor(1)
+    release = _block(executor)
+    cancelled = executor.submit(lambda: 'cancelled', make_schedule('chat'))
+    victim = executor.submit(lambda: 'victim', make_schedule('chat', room='r2'))
+    assert cancelled.cancel()
+    assert executor.preempt(4)
+    with pytest.raises(Rejected) as error:
+        victim.result(timeout=5)
+    assert error.value.reason == 'preempted'
+    # 队列里已经没有可以挤掉的任务
+    assert not executor.preempt(4)
+    release.set()
+    assert executor.submit(lambda: 'next', make_schedule('event')).result(timeout=5) == 'next'
+
+
+def _occupy(gate):
+    """占住 gate 的所有名额，返回释放用的函数"""
+    for _ in range(gate.concurrency):
+        gate.acquire(make_schedule('announcement'))
+    return lambda: [gate.release() for _ in range(gate.concurrency)]
+
+
+def _wait_in_background(gate, schedule, cancellation=None):
+    result = {}
+
+    def wait():
+        try:
+            with gate.slot(schedule, cancellation):
+                result['granted'] = True
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while gate.stats()['queued'] == 0 and thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return thread, result
+
+
+def test_gate_rejects_when_full():
+    gate = FairGate(1, 1)
+    release = _occupy(gate)
+    thread, result = _wait_in_background(gate, make_schedule('event'))
+    with pytest.raises(Rejected) as error:
+        gate.acquire(make_schedule('chat'))
+    assert error.value.reason == 'full'
+    release()
+    thread.join(5)
+    assert result == {'granted': True}
+
+
+def test_gate_preempts_lower_priority_waiter():
+    gate = FairGate(1, 1)
+    release = _occupy(gate)
+    thread, result = _wait_in_background(gate, make_schedule('chat'))
+    high, high_result = _wait_in_background(gate, make_schedule('announcement'))
+    thread.join(5)
+    assert result['error'].reason == 'preempted'
+    release()
+    high.join(5)
+    assert high_result == {'granted': True}
+    assert gate.stats()['preempted'] == 1
+
+
+def test_gate_withdraws_cancelled_waiter():
+    gate = FairGate(1, 4)
+    release = _occupy(gate)
+    cancellation = Cancellation('r1')
+    thread, result = _wait_in_background(gate, make_schedule('chat'), cancellation)
+    cancellation.cancel()
+    thread.join(5)
+    assert isinstance(result['error'], Cancelled) and result['error'].reason == 'cancelled'
+    assert gate.stats()['queued'] == 0
+    release()
+    assert gate.stats()['running'] == 0
+
+
+def test_gate_drops_waiter_past_its_deadline():
+    gate = FairGate(1, 4)
+    release = _occupy(gate)
+    with pytest.raises(Rejected) as error:
+        gate.acquire(make_schedule('event', deadline=time.monotonic() + 0.05))
+    assert error.value.reason == 'deadline'
+    release()
+
+
+def test_cancellation_callbacks_and_guard():
+    cancellation = Cancellation('r1')
+    calls = []
+    cancellation.on_cancel(lambda: calls.append('before'))
+    produced = []
+
+    def items():
+        for index in range(5):
+            produced.append(index)
+            yield index
+
+    for item in cancellation.guard(items()):
+        if item == 1:
+            cancellation.cancel('disconnected')
+            break
+    with pytest.raises(Cancelled):
+        list(cancellation.guard(items()))
+    cancellation.on_cancel(lambda: calls.append('after'))
+    assert calls == ['before', 'after']
+    assert cancellation.reason == 'disconnected'
+    assert produced == [0, 1]
+
+
+def test_cancellation_deadline():
+    cancellation = Cancellation(deadline=time.monotonic() - 1)
+    assert cancellation.reason == 'deadline'
+    with pytest.raises(Cancelled):
+        cancellation.check()
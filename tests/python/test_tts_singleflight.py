@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from tts_singleflight import SingleFlight
+
+
+def run_concurrently(flights, key, fn, count):
+    """count 个线程同时对同一个 key 调用 do()，返回各自的结果或异常"""
+    results = [None] * count
+
+    def call(index):
+        try:
+            results[index] = flights.do(key, fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def blocking(result_or_error, started, release, calls):
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        if isinstance(result_or_error, Exception):
+            raise result_or_error
+        return result_or_error
+    return fn
+
+
+def test_concurrent_calls_share_one_execution():
+    follows = []
+    flights = SingleFlight(on_follow=lambda: follows.append(1))
+    started, release, calls = threading.Event(), threading.Event(), []
+    fn = blocking('wav', started, release, calls)
+    holder = threading.Thread(target=lambda: run_concurrently(flights, 'k', fn, 1))
+    holder.start()
+    started.wait(5)
+    results = []
+    followers = threading.Thread(target=lambda: results.extend(run_concurrently(flights, 'k', fn, 3)))
+    followers.start()
+    while flights.stats()['followers'] < 3:
+        time.sleep(0.005)
+    release.set()
+    holder.join(5)
+    followers.join(5)
+    assert results == ['wav'] * 3
+    assert calls == [1]
+    assert len(follows) == 3
+    assert len(flights) == 0
+
+
+def test_leader_failure_reaches_followers_and_next_call_retries():
+    flights = SingleFlight()
+    started, release, calls = threading.Event(), threading.Event(), []
+    fn = blocking(RuntimeError('model crashed'), started, release, calls)
+    results = []
+    leader = threading.Thread(target=lambda: results.extend(run_concurrently(flights, 'k', fn, 1)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.extend(run_concurrently(flights, 'k', fn, 1)))
+    follower.start()
+    while flights.stats()['followers'] < 1:
+        time.sleep(0.005)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert [str(result) for result in results] == ['model crashed'] * 2
+    assert calls == [1]
+    # 失败的合成不会留在表里：下一次调用重新执行
+    assert flights.do('k', lambda: 'retried') == 'retried'
+
+
+def test_follower_retries_after_leader_is_cancelled():
+    """Melo 服务的用法：等的那次合成被它自己的请求取消时，跟随者重新发起合成"""
+
+    class Cancelled(Exception):
+        pass
+
+    flights = SingleFlight()
+    started, release, calls = threading.Event(), threading.Event(), []
+    leader = threading.Thread(
+        target=lambda: run_concurrently(flights, 'k', blocking(Cancelled(), started, release, calls), 1)
+    )
+    leader.start()
+    started.wait(5)
+    outcome = {}
+
+    def follow():
+        while 'audio' not in outcome:
+            try:
+                outcome['audio'] = flights.do('k', lambda: 'own synthesis')
+            except Cancelled:
+                outcome['retried'] = True
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    while flights.stats()['followers'] < 1:
+        time.sleep(0.005)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert outcome == {'audio': 'own synthesis', 'retried': True}
+
+
+def test_stream_survives_leader_disconnect_and_closes_when_abandoned():
+    closed = []
+
+    def chunks():
+        try:
+            for index in range(4):
+                yield index
+        finally:
+            closed.append(True)
+
+    flights = SingleFlight()
+    leader = flights.stream('k', chunks)
+    follower = flights.stream('k', chunks)
+    assert flights.stream('other', chunks, follow_only=True) is None
+    assert next(leader) == 0
+    leader.close()
+    assert list(follower) == [0, 1, 2, 3]
+    assert closed == [True]
+    assert len(flights) == 0
+
+    closed.clear()
+    abandoned = flights.stream('k', chunks)
+    assert next(abandoned) == 0
+    abandoned.close()
+    assert closed == [True]
+    assert len(flights) == 0
+
+
+def test_errors_from_stream_are_raised_to_every_consumer():
+    def failing():
+        yield 'first'
+        raise ValueError('bad text')
+
+    flights = SingleFlight()
+    first = flights.stream('k', failing)
+    second = flights.stream('k', failing)
+    assert next(first) == 'first'
+    with pytest.raises(ValueError):
+        next(first)
+    assert next(second) == 'first'
+    with pytest.raises(ValueError):
+        next(second)